@@ -1,85 +1,305 @@
+import argparse
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
-import sqlite3
-from datetime import datetime, timedelta
+from tkinter import ttk, messagebox, filedialog
+from datetime import datetime
+from itertools import islice
+
+from lms_branches import BRANCHES_FILE, BranchLibrary, load_branches
+from lms_client import RemoteLibraryService
+from lms_db import DB_PATH, DEFAULT_DURABILITY, DURABILITY
+from lms_fines import FINES_REPORTS
+from lms_profile import SLOW_QUERY_MS, enable_profiling, get_profiler, measure, timed
+from lms_reports import render_lines
+from lms_service import SEARCH_LIMIT, LibraryError, LibraryService
+from lms_worker import DatabaseWorker
+
+PAGE_SIZE = 200
+SEARCH_DELAY_MS = 150
+REPORT_PAGE_LINES = 200
+JOBS_INTERVAL_MS = 60 * 60 * 1000
+# Let the first pages load before the first job run takes the worker
+JOBS_STARTUP_DELAY_MS = 10 * 1000
+
+
+class PagedTreeview:
+    """Keyset-paginated rows for a Treeview.
+
+    Only ``page_size`` rows are fetched at a time, ordered by id; the next page
+    is requested when the scrollbar nears the bottom. Item iids are the row ids
+    so a single row can be refreshed or removed after a mutation. Queries run
+    on the background worker; ``fetch_page`` and ``fetch_row`` name the
+    service methods that read a page and a single row; ``on_load`` is called
+    after each page is added.
+    """
+    
+    def __init__(self, tree, scrollbar, worker, fetch_page, fetch_row, page_size=PAGE_SIZE, on_load=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.worker = worker
+        self.fetch_page = fetch_page
+        self.fetch_row = fetch_row
+        self.page_size = page_size
+        self.on_load = on_load
+        self.last_id = 0
+        self.exhausted = False
+        self.pending = False
+        self.filtered = False
+        self.generation = 0
+        self.tree.configure(yscrollcommand=self.on_scroll)
+    
+    def clear(self):
+        """Drop all rows and discard any page still being fetched"""
+        self.tree.delete(*self.tree.get_children())
+        self.generation += 1
+        self.pending = False
+    
+    def reset(self):
+        """Drop all rows and load the first page again"""
+        self.clear()
+        self.last_id = 0
+        self.exhausted = False
+        self.filtered = False
+        self.load_more()
+    
+    def show_rows(self, rows):
+        """Replace the view with a fixed set of rows, e.g. search results"""
+        self.clear()
+        with measure('render', self.fetch_page):
+            for row in rows:
+                self.tree.insert('', 'end', iid=str(row[0]), values=row)
+        self.exhausted = True
+        self.filtered = True
+    
+    def load_more(self):
+        """Request the next page of rows after the last loaded id"""
+        if self.exhausted or self.pending:
+            return
+        
+        self.pending = True
+        after_id, generation = self.last_id, self.generation
+        self.worker.submit(
+            lambda service: getattr(service, self.fetch_page)(after_id, self.page_size),
+            lambda rows: self.add_page(rows, generation),
+            show_error,
+            key=self,
+            name=self.fetch_page
+        )
+    
+    def add_page(self, rows, generation):
+        """Append a fetched page unless the view was reset meanwhile"""
+        if generation != self.generation:
+            return
+        self.pending = False
+        
+        with measure('render', self.fetch_page):
+            for row in rows:
+                if not self.tree.exists(str(row[0])):
+                    self.tree.insert('', 'end', iid=str(row[0]), values=row)
+        
+        if rows:
+            self.last_id = rows[-1][0]
+        if len(rows) < self.page_size:
+            self.exhausted = True
+        if self.on_load:
+            self.on_load()
+    
+    def on_scroll(self, first, last):
+        """Forward scroll updates and fetch more rows near the bottom"""
+        self.scrollbar.set(first, last)
+        if not self.exhausted and not self.pending and float(last) >= 0.9:
+            self.load_more()
+    
+    def refresh_row(self, row_id):
+        """Re-read one row and update, insert or remove its item"""
+        self.worker.submit(
+            lambda service: getattr(service, self.fetch_row)(row_id),
+            lambda row: self.apply_row(row_id, row),
+            show_error,
+            name=self.fetch_row
+        )
+    
+    def apply_row(self, row_id, row):
+        iid = str(row_id)
+        
+        if row is None:
+            if self.tree.exists(iid):
+                self.tree.delete(iid)
+            return
+        
+        if self.tree.exists(iid):
+            self.tree.item(iid, values=row)
+        elif self.filtered:
+            return
+        elif row_id > self.last_id:
+            # Rows past the loaded window show up with the next page
+            if self.exhausted:
+                self.tree.insert('', 'end', iid=iid, values=row)
+                self.last_id = row_id
+        else:
+            ids = [int(child) for child in self.tree.get_children()]
+            index = next((i for i, child_id in enumerate(ids) if child_id > row_id), len(ids))
+            self.tree.insert('', index, iid=iid, values=row)
+    
+    def remove_row(self, row_id):
+        """Remove one row from the view if it is loaded"""
+        iid = str(row_id)
+        if self.tree.exists(iid):
+            self.tree.delete(iid)
+
+
+def show_error(error):
+    messagebox.showerror("Database Error", str(error))
+
 
 class LibraryManagementSystem:
-    def __init__(self, root):
+    def __init__(self, root, server_url=None, profile_out=None, launched=None, measure_startup=False,
+                 durability=DEFAULT_DURABILITY, db_path=DB_PATH, snapshot_minutes=None, branches=None, branch=None):
         self.root = root
-        self.root.title("Library Management System")
+        self.server_url = server_url
+        self.durability = durability
+        self.db_path = db_path
+        self.snapshot_minutes = snapshot_minutes
+        self.branches = branches
+        self.branch = branch
+        self.branch_library = None
+        self.profile_out = profile_out
+        self.launched = launched or time.perf_counter()
+        self.measure_startup = measure_startup
+        self.startup_times = {}
+        self.root.title(f"Library Management System - {branch} branch" if branch else "Library Management System")
         self.root.geometry("900x600")
         self.root.resizable(True, True)
+        self.search_job = None
         
         self.init_database()
     
         self.create_gui()
-        
-        self.load_books()
-        self.load_members()
-        self.load_issued_books()
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.root.bind('<Expose>', lambda event: self.mark_startup('window_shown'), add='+')
+        
+        # Only the visible tab is built and loaded now; its first page arrives in the background
+        self.on_tab_changed()
+        self.jobs_timer = self.root.after(JOBS_STARTUP_DELAY_MS, self.run_jobs)
+        if self.snapshot_worker is not None:
+            self.snapshot_timer = self.root.after(JOBS_STARTUP_DELAY_MS, self.run_snapshot)
+        self.mark_startup('gui_built')
+    
+    def mark_startup(self, milestone):
+        """Record the time from launch to a startup milestone, once"""
+        if milestone in self.startup_times:
+            return
+        ms = (time.perf_counter() - self.launched) * 1000
+        self.startup_times[milestone] = round(ms, 1)
+        profiler = get_profiler()
+        if profiler is not None:
+            profiler.record('startup', milestone, ms)
+        
+        if self.measure_startup and milestone == 'first_page':
+            print(' '.join(f"{name}={ms}ms" for name, ms in self.startup_times.items()))
+            self.close()
+    
+    def on_first_page(self):
+        """Mark time-to-first-paint once the rows of the first page have been drawn"""
+        if 'first_page' not in self.startup_times:
+            self.root.after_idle(lambda: self.mark_startup('first_page'))
     
     def init_database(self):
-        """Initialize SQLite database and create tables"""
-        self.conn = sqlite3.connect('library.db')
-        self.cursor = self.conn.cursor()
-       
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                author TEXT NOT NULL,
-                isbn TEXT UNIQUE NOT NULL,
-                quantity INTEGER NOT NULL,
-                available INTEGER NOT NULL
-            )
-        ''')
-        
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS members (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                phone TEXT,
-                membership_date TEXT NOT NULL
-            )
-        ''')
-        
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS issued_books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                book_id INTEGER NOT NULL,
-                member_id INTEGER NOT NULL,
-                issue_date TEXT NOT NULL,
-                due_date TEXT NOT NULL,
-                return_date TEXT,
-                FOREIGN KEY (book_id) REFERENCES books (id),
-                FOREIGN KEY (member_id) REFERENCES members (id)
-            )
-        ''')
-        
-        self.conn.commit()
+        """Open the library (local database or server) and start the background reader"""
+        self.service = self.open_service()
+        self.busy_workers = 0
+        self.worker = DatabaseWorker(self.root, self.open_reader, on_busy=self.set_busy)
+        # Background writes (imports, the hourly jobs, the fines refresh before
+        # a fines report) get their own thread and connection, so the reader
+        # above stays read-only and the window never waits on them. Like the
+        # Tk thread's writes they take the lock with BEGIN IMMEDIATE, and the
+        # busy timeout queues the two behind each other.
+        self.job_worker = DatabaseWorker(self.root, self.open_service, on_busy=self.set_busy)
+        # Snapshots get their own thread so a backup never holds up list loads
+        self.snapshot_worker = None
+        if self.snapshot_minutes and not self.server_url:
+            self.snapshot_worker = DatabaseWorker(self.root, self.open_service)
+    
+    def open_service(self):
+        """Open a service; in the WAL durability modes the background reader never blocks writes"""
+        if self.server_url:
+            return RemoteLibraryService(self.server_url)
+        return LibraryService.open(self.db_path, self.durability)
+    
+    def open_reader(self):
+        """Open the background reader's service; locally its connection refuses writes"""
+        service = self.open_service()
+        if not self.server_url:
+            service.conn.execute("PRAGMA query_only = ON")
+        return service
+    
+    def close(self):
+        """Stop the background worker and close the window"""
+        self.root.after_cancel(self.jobs_timer)
+        if self.snapshot_worker is not None:
+            self.root.after_cancel(self.snapshot_timer)
+            self.snapshot_worker.close()
+        self.worker.close()
+        self.job_worker.close()
+        if self.branch_library is not None:
+            self.branch_library.close()
+        self.service.close()
+        if self.profile_out:
+            get_profiler().dump(self.profile_out)
+        self.root.destroy()
+    
+    def set_busy(self, busy):
+        """Show the progress indicator while either background worker has jobs"""
+        self.busy_workers += 1 if busy else -1
+        if busy and self.busy_workers == 1:
+            self.progress.start(10)
+        elif not busy and self.busy_workers == 0:
+            self.progress.stop()
     
     def create_gui(self):
         """Create the main GUI interface"""
         
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side='bottom', fill='x', padx=10, pady=(0, 5))
+        self.progress = ttk.Progressbar(status_frame, mode='indeterminate', length=120)
+        self.progress.pack(side='right')
+        
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(fill='both', expand=True, padx=10, pady=10)
-       
-        self.books_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.books_frame, text='Books')
-        self.create_books_tab()
-       
-        self.members_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.members_frame, text='Members')
-        self.create_members_tab()
-       
-        self.issue_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.issue_frame, text='Issue/Return')
-        self.create_issue_tab()
-       
-        self.reports_frame = ttk.Frame(self.notebook)
-        self.notebook.add(self.reports_frame, text='Reports')
-        self.create_reports_tab()
+        
+        # Tab contents are built and loaded the first time the tab is selected
+        self.pending_tabs = {}
+        self.books_frame = self.add_tab('Books', self.create_books_tab, self.load_books)
+        self.members_frame = self.add_tab('Members', self.create_members_tab, self.load_members)
+        self.issue_frame = self.add_tab('Issue/Return', self.create_issue_tab, self.load_issue_tab)
+        self.batch_frame = self.add_tab('Batch Scan', self.create_batch_tab)
+        self.reports_frame = self.add_tab('Reports', self.create_reports_tab)
+        if get_profiler() is not None:
+            self.diagnostics_frame = self.add_tab('Diagnostics', self.create_diagnostics_tab, self.refresh_diagnostics)
+        
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+    
+    def add_tab(self, text, create, load=None):
+        """Add an empty tab whose create (and load) run when it is first shown"""
+        frame = ttk.Frame(self.notebook)
+        self.notebook.add(frame, text=text)
+        self.pending_tabs[str(frame)] = (create, load)
+        return frame
+    
+    def tab_built(self, frame):
+        return str(frame) not in self.pending_tabs
+    
+    def on_tab_changed(self, event=None):
+        """Build the selected tab on first view; keep the diagnostics current"""
+        tab = self.notebook.select()
+        if tab in self.pending_tabs:
+            create, load = self.pending_tabs.pop(tab)
+            with measure('handler', f"build {self.notebook.tab(tab, 'text')} tab"):
+                create()
+                if load:
+                    load()
+        elif get_profiler() is not None and tab == str(self.diagnostics_frame):
+            self.refresh_diagnostics()
     
     def create_books_tab(self):
         """Create the books management interface"""
@@ -103,8 +323,17 @@ class LibraryManagementSystem:
         self.quantity_entry = ttk.Entry(add_frame, width=30)
         self.quantity_entry.grid(row=1, column=3, padx=5, pady=5)
         
+        ttk.Button(add_frame, text="Import Catalog...", command=self.import_catalog).grid(row=2, column=2, padx=5, pady=5, sticky='e')
         ttk.Button(add_frame, text="Add Book", command=self.add_book).grid(row=2, column=3, padx=5, pady=5, sticky='e')
         
+        search_frame = ttk.Frame(self.books_frame)
+        search_frame.pack(fill='x', padx=10, pady=5)
+        
+        ttk.Label(search_frame, text="Search:").pack(side='left', padx=5)
+        self.book_search_entry = ttk.Entry(search_frame, width=50)
+        self.book_search_entry.pack(side='left', padx=5)
+        self.book_search_entry.bind('<KeyRelease>', lambda event: self.schedule_search(self.search_books))
+        
         list_frame = ttk.LabelFrame(self.books_frame, text="Book List")
         list_frame.pack(fill='both', expand=True, padx=10, pady=5)
         
@@ -126,12 +355,16 @@ class LibraryManagementSystem:
         self.books_tree.column('available', width=80)
         
         scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.books_tree.yview)
-        self.books_tree.configure(yscrollcommand=scrollbar.set)
+        self.books_pages = PagedTreeview(self.books_tree, scrollbar, self.worker, 'books_page', 'get_book',
+                                         on_load=self.on_first_page)
         
         self.books_tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
         
         ttk.Button(list_frame, text="Delete Selected", command=self.delete_book).pack(side='bottom', pady=5)
+        ttk.Button(list_frame, text="Show Copies", command=self.show_copies).pack(side='bottom', pady=5)
+        if self.branches:
+            ttk.Button(list_frame, text="Find at Branches", command=self.find_at_branches).pack(side='bottom', pady=5)
     
     def create_members_tab(self):
         """Create the members management interface"""
@@ -172,7 +405,8 @@ class LibraryManagementSystem:
         self.members_tree.column('membership_date', width=120)
         
         scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.members_tree.yview)
-        self.members_tree.configure(yscrollcommand=scrollbar.set)
+        self.members_pages = PagedTreeview(self.members_tree, scrollbar, self.worker, 'members_page', 'get_member',
+                                           on_load=self.on_first_page)
         
         self.members_tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
@@ -188,10 +422,17 @@ class LibraryManagementSystem:
         ttk.Label(issue_frame, text="Member:").grid(row=0, column=0, padx=5, pady=5, sticky='e')
         self.issue_member_combo = ttk.Combobox(issue_frame, state="readonly")
         self.issue_member_combo.grid(row=0, column=1, padx=5, pady=5)
+        self.issue_member_combo.bind('<<ComboboxSelected>>', self.load_holds)
         
         ttk.Label(issue_frame, text="Book:").grid(row=0, column=2, padx=5, pady=5, sticky='e')
-        self.issue_book_combo = ttk.Combobox(issue_frame, state="readonly")
+        self.issue_book_combo = ttk.Combobox(issue_frame, width=40)
         self.issue_book_combo.grid(row=0, column=3, padx=5, pady=5)
+        self.issue_book_combo.bind('<KeyRelease>', self.on_issue_book_key)
+        
+        # Ids behind each combobox entry, index for index
+        self.member_choice_ids = []
+        self.book_choice_ids = []
+        self.return_choice_ids = []
         
         ttk.Button(issue_frame, text="Issue Book", command=self.issue_book).grid(row=0, column=4, padx=5, pady=5)
         
@@ -204,6 +445,37 @@ class LibraryManagementSystem:
         
         ttk.Button(return_frame, text="Return Book", command=self.return_book).grid(row=0, column=2, padx=5, pady=5)
         
+        holds_frame = ttk.LabelFrame(self.issue_frame, text="Holds (selected member, or the pickup shelf)")
+        holds_frame.pack(fill='x', padx=10, pady=5)
+        
+        ttk.Label(holds_frame, text="Book ID:").grid(row=0, column=0, padx=5, pady=5, sticky='e')
+        self.hold_book_entry = ttk.Entry(holds_frame, width=10)
+        self.hold_book_entry.grid(row=0, column=1, padx=5, pady=5, sticky='w')
+        ttk.Button(holds_frame, text="Place Hold", command=self.place_hold).grid(row=0, column=2, padx=5, pady=5)
+        ttk.Button(holds_frame, text="Issue Held Copy", command=self.issue_held_copy).grid(row=0, column=3, padx=5, pady=5)
+        ttk.Button(holds_frame, text="Cancel Hold", command=self.cancel_hold).grid(row=0, column=4, padx=5, pady=5)
+        
+        columns = ('id', 'book_title', 'member_name', 'status', 'place', 'expires')
+        self.holds_tree = ttk.Treeview(holds_frame, columns=columns, show='headings', height=4)
+        
+        self.holds_tree.heading('id', text='ID')
+        self.holds_tree.heading('book_title', text='Book Title')
+        self.holds_tree.heading('member_name', text='Member Name')
+        self.holds_tree.heading('status', text='Status')
+        self.holds_tree.heading('place', text='Place in Queue')
+        self.holds_tree.heading('expires', text='Pick Up By')
+        
+        self.holds_tree.column('id', width=50)
+        self.holds_tree.column('book_title', width=200)
+        self.holds_tree.column('member_name', width=150)
+        self.holds_tree.column('status', width=80)
+        self.holds_tree.column('place', width=100)
+        self.holds_tree.column('expires', width=100)
+        self.holds_tree.grid(row=1, column=0, columnspan=5, padx=5, pady=5, sticky='ew')
+        
+        # (member_id, book_id) behind each hold row, by hold id
+        self.hold_rows = {}
+        
         list_frame = ttk.LabelFrame(self.issue_frame, text="Currently Issued Books")
         list_frame.pack(fill='both', expand=True, padx=10, pady=5)
         
@@ -223,11 +495,65 @@ class LibraryManagementSystem:
         self.issued_tree.column('due_date', width=100)
         
         scrollbar = ttk.Scrollbar(list_frame, orient='vertical', command=self.issued_tree.yview)
-        self.issued_tree.configure(yscrollcommand=scrollbar.set)
+        self.issued_pages = PagedTreeview(self.issued_tree, scrollbar, self.worker, 'issued_page', 'get_issued',
+                                          on_load=self.on_first_page)
         
         self.issued_tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
     
+    def create_batch_tab(self):
+        """Create the batch checkout/return interface for barcode scanners"""
+        
+        scan_frame = ttk.LabelFrame(self.batch_frame, text="Scan Items")
+        scan_frame.pack(fill='x', padx=10, pady=5)
+        
+        self.batch_mode = tk.StringVar(value='checkout')
+        ttk.Radiobutton(scan_frame, text="Checkout", variable=self.batch_mode, value='checkout').grid(row=0, column=0, padx=5, pady=5)
+        ttk.Radiobutton(scan_frame, text="Return", variable=self.batch_mode, value='return').grid(row=0, column=1, padx=5, pady=5)
+        
+        ttk.Label(scan_frame, text="Member ID:").grid(row=0, column=2, padx=5, pady=5, sticky='e')
+        self.batch_member_entry = ttk.Entry(scan_frame, width=12)
+        self.batch_member_entry.grid(row=0, column=3, padx=5, pady=5)
+        
+        ttk.Label(scan_frame, text="Barcode / ISBN / Loan ID:").grid(row=1, column=0, padx=5, pady=5, sticky='e')
+        self.scan_entry = ttk.Entry(scan_frame, width=30)
+        self.scan_entry.grid(row=1, column=1, columnspan=2, padx=5, pady=5, sticky='w')
+        self.scan_entry.bind('<Return>', self.queue_scan)
+        
+        self.scan_count_label = ttk.Label(scan_frame, text="0 items queued")
+        self.scan_count_label.grid(row=1, column=3, padx=5, pady=5)
+        
+        ttk.Button(scan_frame, text="Process Batch", command=self.process_batch).grid(row=1, column=4, padx=5, pady=5)
+        ttk.Button(scan_frame, text="Clear", command=self.clear_scans).grid(row=1, column=5, padx=5, pady=5)
+        
+        queue_frame = ttk.LabelFrame(self.batch_frame, text="Queued Scans")
+        queue_frame.pack(fill='x', padx=10, pady=5)
+        
+        self.scan_listbox = tk.Listbox(queue_frame, height=6)
+        self.scan_listbox.pack(side='left', fill='x', expand=True)
+        self.scan_listbox.bind('<Delete>', self.remove_scan)
+        
+        results_frame = ttk.LabelFrame(self.batch_frame, text="Results")
+        results_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        columns = ('code', 'result', 'details')
+        self.batch_tree = ttk.Treeview(results_frame, columns=columns, show='headings')
+        
+        self.batch_tree.heading('code', text='Scanned')
+        self.batch_tree.heading('result', text='Result')
+        self.batch_tree.heading('details', text='Details')
+        
+        self.batch_tree.column('code', width=150)
+        self.batch_tree.column('result', width=80)
+        self.batch_tree.column('details', width=450)
+        self.batch_tree.tag_configure('failed', foreground='red')
+        
+        scrollbar = ttk.Scrollbar(results_frame, orient='vertical', command=self.batch_tree.yview)
+        self.batch_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.batch_tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+    
     def create_reports_tab(self):
         """Create the reports interface"""
        
@@ -238,97 +564,327 @@ class LibraryManagementSystem:
         ttk.Button(reports_frame, text="Members Report", command=self.generate_members_report, width=20).pack(pady=5)
         ttk.Button(reports_frame, text="Issued Books Report", command=self.generate_issued_report, width=20).pack(pady=5)
         ttk.Button(reports_frame, text="Overdue Books", command=self.generate_overdue_report, width=20).pack(pady=5)
+        ttk.Button(reports_frame, text="Member Fines", command=self.generate_fines_report, width=20).pack(pady=5)
+        
+        dashboard_frame = ttk.LabelFrame(reports_frame, text="Circulation Dashboard")
+        dashboard_frame.pack(fill='x', pady=5)
+        
+        ttk.Button(dashboard_frame, text="Summary", command=self.generate_circulation_report, width=20).pack(side='left', padx=5, pady=5)
+        ttk.Button(dashboard_frame, text="Loans per Day", command=self.generate_loans_by_day_report, width=20).pack(side='left', padx=5, pady=5)
+        ttk.Button(dashboard_frame, text="Most Borrowed", command=self.generate_top_books_report, width=20).pack(side='left', padx=5, pady=5)
+        ttk.Button(dashboard_frame, text="Member Activity", command=self.generate_member_activity_report, width=20).pack(side='left', padx=5, pady=5)
+        
+        filter_frame = ttk.LabelFrame(reports_frame, text="Filters")
+        filter_frame.pack(fill='x', pady=5)
+        
+        self.report_filter_entries = {}
+        for column, (name, label) in enumerate([
+            ('date_from', "From (YYYY-MM-DD):"),
+            ('date_to', "To:"),
+            ('member_id', "Member ID:"),
+            ('book_id', "Book ID:"),
+        ]):
+            ttk.Label(filter_frame, text=label).grid(row=0, column=column * 2, padx=5, pady=5, sticky='e')
+            entry = ttk.Entry(filter_frame, width=12)
+            entry.grid(row=0, column=column * 2 + 1, padx=5, pady=5)
+            self.report_filter_entries[name] = entry
+        
+        self.report_from_snapshot = tk.BooleanVar(value=False)
+        ttk.Checkbutton(filter_frame, text="Use latest snapshot", variable=self.report_from_snapshot).grid(row=1, column=0, columnspan=3, padx=5, pady=5, sticky='w')
+        ttk.Button(filter_frame, text="Export CSV...", command=lambda: self.export_current_report('csv')).grid(row=1, column=6, padx=5, pady=5)
+        ttk.Button(filter_frame, text="Export JSONL...", command=lambda: self.export_current_report('jsonl')).grid(row=1, column=7, padx=5, pady=5)
         
         self.report_text = tk.Text(reports_frame, height=20, width=80)
         self.report_text.pack(pady=10, fill='both', expand=True)
         
-        scrollbar = ttk.Scrollbar(self.report_text, orient='vertical', command=self.report_text.yview)
-        self.report_text.configure(yscrollcommand=scrollbar.set)
-        scrollbar.pack(side='right', fill='y')
+        self.report_scrollbar = ttk.Scrollbar(self.report_text, orient='vertical', command=self.report_text.yview)
+        self.report_text.configure(yscrollcommand=self.on_report_scroll)
+        self.report_scrollbar.pack(side='right', fill='y')
+        
+        self.report_name = None
+        self.report_lines = None
+        self.report_pending = False
     
-    def load_books(self):
-        """Load books from database into the treeview"""
-        for item in self.books_tree.get_children():
-            self.books_tree.delete(item)
+    @timed('handler')
+    def create_diagnostics_tab(self):
+        """Create the profiling view: latency histograms and the slow query log"""
+        
+        button_frame = ttk.Frame(self.diagnostics_frame)
+        button_frame.pack(fill='x', padx=10, pady=5)
+        
+        ttk.Button(button_frame, text="Refresh", command=self.refresh_diagnostics).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Reset", command=self.reset_diagnostics).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Save JSON...", command=self.save_diagnostics).pack(side='left', padx=5)
+        
+        latency_frame = ttk.LabelFrame(self.diagnostics_frame, text="Latency (ms)")
+        latency_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        
+        columns = ('kind', 'count', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'name')
+        self.latency_tree = ttk.Treeview(latency_frame, columns=columns, show='headings', height=8)
+        for column, heading, width in [
+            ('kind', 'Kind', 80), ('count', 'Count', 60), ('total_ms', 'Total', 70), ('mean_ms', 'Mean', 60),
+            ('p50_ms', 'p50', 50), ('p95_ms', 'p95', 50), ('p99_ms', 'p99', 50), ('max_ms', 'Max', 60),
+            ('name', 'Name', 400),
+        ]:
+            self.latency_tree.heading(column, text=heading)
+            self.latency_tree.column(column, width=width, stretch=column == 'name')
+        
+        scrollbar = ttk.Scrollbar(latency_frame, orient='vertical', command=self.latency_tree.yview)
+        self.latency_tree.configure(yscrollcommand=scrollbar.set)
+        self.latency_tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
         
-        self.cursor.execute("SELECT * FROM books")
-        books = self.cursor.fetchall()
+        slow_frame = ttk.LabelFrame(self.diagnostics_frame, text="Slow Queries")
+        slow_frame.pack(fill='both', expand=True, padx=10, pady=5)
         
-        for book in books:
-            self.books_tree.insert('', 'end', values=book)
+        columns = ('at', 'ms', 'rows', 'sql')
+        self.slow_tree = ttk.Treeview(slow_frame, columns=columns, show='headings', height=5)
+        for column, heading, width in [('at', 'At', 140), ('ms', 'ms', 70), ('rows', 'Rows', 60), ('sql', 'SQL', 500)]:
+            self.slow_tree.heading(column, text=heading)
+            self.slow_tree.column(column, width=width, stretch=column == 'sql')
+        self.slow_tree.bind('<<TreeviewSelect>>', self.show_slow_query)
+        self.slow_tree.pack(fill='both', expand=True)
         
-        self.cursor.execute("SELECT id, title FROM books WHERE available > 0")
-        available_books = self.cursor.fetchall()
+        self.plan_text = tk.Text(slow_frame, height=6, width=80)
+        self.plan_text.pack(fill='x', pady=5)
+        
+        self.slow_queries = []
+    
+    def refresh_diagnostics(self):
+        """Show the latest profile, costliest totals first"""
+        snapshot = get_profiler().snapshot()
+        
+        self.latency_tree.delete(*self.latency_tree.get_children())
+        for entry in snapshot['latency']:
+            self.latency_tree.insert('', 'end', values=(
+                entry['kind'], entry['count'], f"{entry['total_ms']:.1f}", f"{entry['mean_ms']:.2f}",
+                entry['p50_ms'], entry['p95_ms'], entry['p99_ms'], f"{entry['max_ms']:.1f}", entry['name']
+            ))
+        
+        self.slow_queries = snapshot['slow_queries']
+        self.slow_tree.delete(*self.slow_tree.get_children())
+        for index, query in enumerate(self.slow_queries):
+            self.slow_tree.insert('', 'end', iid=str(index), values=(query['at'], f"{query['ms']:.1f}", query['rows'], query['sql']))
+        self.plan_text.delete(1.0, tk.END)
+    
+    def show_slow_query(self, event):
+        """Show the full statement and query plan of the selected slow query"""
+        selected = self.slow_tree.selection()
+        if not selected:
+            return
+        query = self.slow_queries[int(selected[0])]
+        plan = query['plan'] or ["(no plan recorded)"]
+        self.plan_text.delete(1.0, tk.END)
+        self.plan_text.insert(tk.END, query['sql'] + '\n\n' + '\n'.join(plan))
+    
+    def reset_diagnostics(self):
+        get_profiler().reset()
+        self.refresh_diagnostics()
+    
+    def save_diagnostics(self):
+        """Write the profile to a JSON file"""
+        path = filedialog.asksaveasfilename(
+            title="Save Profile",
+            defaultextension=".json",
+            initialfile="lms_profile.json",
+            filetypes=[("JSON", "*.json"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            get_profiler().dump(path)
+        except OSError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        messagebox.showinfo("Profile Saved", f"Profile written to {path}")
+    
+    @timed('handler')
+    def load_books(self):
+        """Load the first page of books into the treeview"""
+        if self.tab_built(self.books_frame):
+            self.books_pages.reset()
+        self.load_book_choices()
+    
+    def load_book_choices(self):
+        """Fill the issue combobox with available books matching the typed text"""
+        if not self.tab_built(self.issue_frame):
+            return
+        text = self.issue_book_combo.get()
+        if text and self.issue_book_combo.current() < 0:
+            query = lambda service: service.search_books(text, available_only=True)
+        else:
+            query = lambda service: service.available_books(limit=SEARCH_LIMIT)
+        self.worker.submit(query, self.show_book_choices, show_error, key='book_choices')
+    
+    @timed('render')
+    def show_book_choices(self, available_books):
+        self.book_choice_ids = [book[0] for book in available_books]
         self.issue_book_combo['values'] = [f"{book[0]} - {book[1]}" for book in available_books]
     
+    def schedule_search(self, callback):
+        """Run a search callback once typing pauses"""
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DELAY_MS, callback)
+    
+    @timed('handler')
+    def search_books(self):
+        """Show the top catalog matches for the search box, or the full list"""
+        self.search_job = None
+        text = self.book_search_entry.get().strip()
+        if text:
+            self.books_pages.clear()
+            self.worker.submit(
+                lambda service: service.search_books(text),
+                self.books_pages.show_rows,
+                show_error,
+                key='book_search'
+            )
+        else:
+            self.worker.cancel_key('book_search')
+            self.books_pages.reset()
+    
+    def on_issue_book_key(self, event):
+        """Search available books as the user types into the issue combobox"""
+        if event.keysym in ('Up', 'Down', 'Return', 'Escape', 'Tab'):
+            return
+        self.schedule_search(self.search_issue_books)
+    
+    def search_issue_books(self):
+        """Refresh the issue combobox choices for the typed text"""
+        self.search_job = None
+        self.load_book_choices()
+    
+    @timed('handler')
     def load_members(self):
-        """Load members from database into the treeview"""
-        for item in self.members_tree.get_children():
-            self.members_tree.delete(item)
-        
-        self.cursor.execute("SELECT * FROM members")
-        members = self.cursor.fetchall()
-        
-        for member in members:
-            self.members_tree.insert('', 'end', values=member)
-        
+        """Load the first page of members into the treeview"""
+        if self.tab_built(self.members_frame):
+            self.members_pages.reset()
+        self.load_member_choices()
+    
+    def load_member_choices(self):
+        """Fill the issue combobox with members"""
+        if not self.tab_built(self.issue_frame):
+            return
+        self.worker.submit(lambda service: service.member_choices(), self.show_member_choices, show_error, key='member_choices')
+    
+    @timed('render')
+    def show_member_choices(self, members):
+        self.member_choice_ids = [member[0] for member in members]
         self.issue_member_combo['values'] = [f"{member[0]} - {member[1]}" for member in members]
     
+    @timed('handler')
     def load_issued_books(self):
-        """Load issued books from database into the treeview"""
-        for item in self.issued_tree.get_children():
-            self.issued_tree.delete(item)
-        
-        self.cursor.execute('''
-            SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date 
-            FROM issued_books ib
-            JOIN books b ON ib.book_id = b.id
-            JOIN members m ON ib.member_id = m.id
-            WHERE ib.return_date IS NULL
-        ''')
-        issued_books = self.cursor.fetchall()
-        
-        for book in issued_books:
-            self.issued_tree.insert('', 'end', values=book)
-        
+        """Load the first page of issued books into the treeview"""
+        if not self.tab_built(self.issue_frame):
+            return
+        self.issued_pages.reset()
+        self.load_return_choices()
+    
+    def load_issue_tab(self):
+        """Fill the issued books list, the holds list and all three pickers"""
+        self.load_issued_books()
+        self.load_member_choices()
+        self.load_book_choices()
+        self.load_holds()
+    
+    def load_return_choices(self):
+        """Fill the return combobox with active loans"""
+        if not self.tab_built(self.issue_frame):
+            return
+        self.worker.submit(lambda service: service.active_loans(), self.show_return_choices, show_error, key='return_choices')
+    
+    @timed('render')
+    def show_return_choices(self, issued_books):
+        self.return_choice_ids = [book[0] for book in issued_books]
         self.return_combo['values'] = [f"{book[0]} - {book[1]} (by {book[2]})" for book in issued_books]
     
+    @timed('handler')
     def add_book(self):
         """Add a new book to the database"""
-        title = self.title_entry.get().strip()
-        author = self.author_entry.get().strip()
-        isbn = self.isbn_entry.get().strip()
-        quantity = self.quantity_entry.get().strip()
+        try:
+            with measure('handler', 'add_book'):
+                book_id = self.service.add_book(
+                    self.title_entry.get(),
+                    self.author_entry.get(),
+                    self.isbn_entry.get(),
+                    self.quantity_entry.get()
+                )
+        except LibraryError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        messagebox.showinfo("Success", "Book added successfully")
         
-        if not title or not author or not isbn or not quantity:
-            messagebox.showerror("Error", "Please fill all fields")
+        self.title_entry.delete(0, 'end')
+        self.author_entry.delete(0, 'end')
+        self.isbn_entry.delete(0, 'end')
+        self.quantity_entry.delete(0, 'end')
+        
+        self.books_pages.refresh_row(book_id)
+        self.load_book_choices()
+    
+    def import_catalog(self):
+        """Bulk import books from a catalog file"""
+        path = filedialog.askopenfilename(
+            title="Import Catalog",
+            filetypes=[("Catalog files", "*.csv *.jsonl *.mrk"), ("All files", "*.*")]
+        )
+        if not path:
             return
         
-        try:
-            quantity = int(quantity)
-            if quantity < 1:
-                raise ValueError
-        except ValueError:
-            messagebox.showerror("Error", "Quantity must be a positive integer")
+        self.job_worker.submit(
+            lambda service: service.import_catalog(path),
+            lambda stats: self.on_catalog_imported(path, stats),
+            lambda error: messagebox.showerror("Import Error", str(error)),
+            name='import_catalog'
+        )
+    
+    def on_catalog_imported(self, path, stats):
+        self.load_books()
+        
+        message = f"Import finished: {stats}"
+        if stats.rejected:
+            message += f"\n\nRejected rows were written to {path}.rejects.csv"
+        messagebox.showinfo("Import Complete", message)
+    
+    def show_copies(self):
+        """List every copy of the selected title with its barcode, status and shelf location"""
+        selected = self.books_tree.selection()
+        if not selected:
+            messagebox.showerror("Error", "Please select a book")
             return
         
-        try:
-            self.cursor.execute(
-                "INSERT INTO books (title, author, isbn, quantity, available) VALUES (?, ?, ?, ?, ?)",
-                (title, author, isbn, quantity, quantity)
-            )
-            self.conn.commit()
-            messagebox.showinfo("Success", "Book added successfully")
-            
-            self.title_entry.delete(0, 'end')
-            self.author_entry.delete(0, 'end')
-            self.isbn_entry.delete(0, 'end')
-            self.quantity_entry.delete(0, 'end')
-            
-            self.load_books()
-            
-        except sqlite3.IntegrityError:
-            messagebox.showerror("Error", "A book with this ISBN already exists")
+        book_id = self.books_tree.item(selected[0])['values'][0]
+        self.worker.submit(lambda service: service.book_items(book_id), self.show_book_items, show_error,
+                           key='book_items')
+    
+    def show_book_items(self, rows):
+        lines = [f"{barcode}: {status.replace('_', ' ')}{f' at {location}' if location else ''}"
+                 for item_id, barcode, status, location in rows]
+        messagebox.showinfo("Copies", '\n'.join(lines) if lines else "This title has no copies")
+    
+    def open_branch_library(self):
+        """The shards of every branch, opened on first use by the background worker"""
+        if self.branch_library is None:
+            self.branch_library = BranchLibrary(self.branches, self.durability)
+        return self.branch_library
+    
+    def find_at_branches(self):
+        """Show which branches stock the selected title and how many copies are on their shelves"""
+        selected = self.books_tree.selection()
+        if not selected:
+            messagebox.showerror("Error", "Please select a book")
+            return
+        
+        isbn = self.books_tree.set(selected[0], 'isbn')
+        self.worker.submit(lambda service: self.open_branch_library().locate(isbn),
+                           self.show_branch_copies, show_error, key='find_at_branches')
+    
+    def show_branch_copies(self, rows):
+        lines = [f"{branch}{' (this branch)' if branch == self.branch else ''}: {available} of {quantity} on the shelf"
+                 for branch, book_id, title, quantity, available in rows]
+        messagebox.showinfo("Copies at Branches", '\n'.join(lines) if lines else "No branch stocks this title")
     
     def delete_book(self):
         """Delete the selected book from the database"""
@@ -339,46 +895,41 @@ class LibraryManagementSystem:
         
         book_id = self.books_tree.item(selected[0])['values'][0]
         
-        self.cursor.execute("SELECT COUNT(*) FROM issued_books WHERE book_id = ? AND return_date IS NULL", (book_id,))
-        count = self.cursor.fetchone()[0]
-        
-        if count > 0:
+        if self.service.book_has_active_loans(book_id):
             messagebox.showerror("Error", "Cannot delete book that is currently issued")
             return
         
         if messagebox.askyesno("Confirm", "Are you sure you want to delete this book?"):
-            self.cursor.execute("DELETE FROM books WHERE id = ?", (book_id,))
-            self.conn.commit()
-            self.load_books()
+            try:
+                with measure('handler', 'delete_book'):
+                    self.service.delete_book(book_id)
+            except LibraryError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.books_pages.remove_row(book_id)
+            self.load_book_choices()
     
     def add_member(self):
         """Add a new member to the database"""
-        name = self.member_name_entry.get().strip()
-        email = self.email_entry.get().strip()
-        phone = self.phone_entry.get().strip()
-        
-        if not name or not email:
-            messagebox.showerror("Error", "Name and email are required")
+        try:
+            with measure('handler', 'add_member'):
+                member_id = self.service.add_member(
+                    self.member_name_entry.get(),
+                    self.email_entry.get(),
+                    self.phone_entry.get()
+                )
+        except LibraryError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        membership_date = datetime.now().strftime("%Y-%m-%d")
+        messagebox.showinfo("Success", "Member added successfully")
         
-        try:
-            self.cursor.execute(
-                "INSERT INTO members (name, email, phone, membership_date) VALUES (?, ?, ?, ?)",
-                (name, email, phone, membership_date)
-            )
-            self.conn.commit()
-            messagebox.showinfo("Success", "Member added successfully")
-            
-            self.member_name_entry.delete(0, 'end')
-            self.email_entry.delete(0, 'end')
-            self.phone_entry.delete(0, 'end')
-            
-            self.load_members()
-            
-        except sqlite3.IntegrityError:
-            messagebox.showerror("Error", "A member with this email already exists")
+        self.member_name_entry.delete(0, 'end')
+        self.email_entry.delete(0, 'end')
+        self.phone_entry.delete(0, 'end')
+        
+        self.members_pages.refresh_row(member_id)
+        self.load_member_choices()
     
     def delete_member(self):
         """Delete the selected member from the database"""
@@ -389,18 +940,21 @@ class LibraryManagementSystem:
         
         member_id = self.members_tree.item(selected[0])['values'][0]
         
-        self.cursor.execute("SELECT COUNT(*) FROM issued_books WHERE member_id = ? AND return_date IS NULL", (member_id,))
-        count = self.cursor.fetchone()[0]
-        
-        if count > 0:
+        if self.service.member_has_active_loans(member_id):
             messagebox.showerror("Error", "Cannot delete member who has issued books")
             return
         
         if messagebox.askyesno("Confirm", "Are you sure you want to delete this member?"):
-            self.cursor.execute("DELETE FROM members WHERE id = ?", (member_id,))
-            self.conn.commit()
-            self.load_members()
+            try:
+                with measure('handler', 'delete_member'):
+                    self.service.delete_member(member_id)
+            except LibraryError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.members_pages.remove_row(member_id)
+            self.load_member_choices()
     
+    @timed('handler')
     def issue_book(self):
         """Issue a book to a member"""
         member_selection = self.issue_member_combo.get()
@@ -410,163 +964,406 @@ class LibraryManagementSystem:
             messagebox.showerror("Error", "Please select both a member and a book")
             return
         
-        member_id = int(member_selection.split(' - ')[0])
-        book_id = int(book_selection.split(' - ')[0])
+        member_index = self.issue_member_combo.current()
+        book_index = self.issue_book_combo.current()
+        if member_index < 0 or book_index < 0:
+            messagebox.showerror("Error", "Please pick a book from the search results")
+            return
+        member_id = self.member_choice_ids[member_index]
+        book_id = self.book_choice_ids[book_index]
         
-        self.cursor.execute(
-            "SELECT COUNT(*) FROM issued_books WHERE member_id = ? AND return_date IS NULL", 
-            (member_id,)
-        )
-        borrowed_count = self.cursor.fetchone()[0]
+        try:
+            with measure('handler', 'issue_book'):
+                issue_id, due_date = self.service.issue_book(member_id, book_id)
+        except LibraryError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        messagebox.showinfo("Success", f"Book issued successfully. Due date: {due_date}")
+        
+        if self.tab_built(self.books_frame):
+            self.books_pages.refresh_row(book_id)
+        self.issued_pages.refresh_row(issue_id)
+        self.load_book_choices()
+        self.load_return_choices()
+        self.load_holds()
+    
+    def selected_member_id(self):
+        index = self.issue_member_combo.current()
+        return self.member_choice_ids[index] if index >= 0 else None
+    
+    def load_holds(self, event=None):
+        """Show the selected member's holds, or every copy waiting on the pickup shelf"""
+        if not self.tab_built(self.issue_frame):
+            return
+        member_id = self.selected_member_id()
+        self.worker.submit(lambda service: service.open_holds(member_id), self.show_holds, show_error, key='holds')
+    
+    @timed('render')
+    def show_holds(self, holds):
+        self.holds_tree.delete(*self.holds_tree.get_children())
+        self.hold_rows = {}
+        for hold_id, book_id, title, member_id, name, status, place, expires in holds:
+            self.hold_rows[hold_id] = (member_id, book_id)
+            self.holds_tree.insert('', 'end', iid=hold_id,
+                                   values=(hold_id, title, name, status, place or '', expires or ''))
+    
+    def selected_hold(self):
+        selection = self.holds_tree.selection()
+        if not selection:
+            messagebox.showerror("Error", "Please select a hold")
+            return None
+        return int(selection[0])
+    
+    def place_hold(self):
+        """Queue the selected member for a book with no copies on the shelf"""
+        member_id = self.selected_member_id()
+        book_id = self.hold_book_entry.get().strip()
+        if member_id is None or not book_id.isdigit():
+            messagebox.showerror("Error", "Please select a member and enter a book ID")
+            return
         
-        if borrowed_count >= 5:
-            messagebox.showerror("Error", "Member has reached the maximum borrowing limit (5 books)")
+        try:
+            with measure('handler', 'place_hold'):
+                hold_id, place = self.service.place_hold(member_id, int(book_id))
+        except LibraryError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        issue_date = datetime.now().strftime("%Y-%m-%d")
-        due_date = (datetime.now() + timedelta(days=14)).strftime("%Y-%m-%d") 
+        messagebox.showinfo("Success", f"Hold placed. Place in queue: {place}")
+        self.hold_book_entry.delete(0, 'end')
+        self.load_holds()
+    
+    def issue_held_copy(self):
+        """Issue the copy set aside for the selected ready hold"""
+        hold_id = self.selected_hold()
+        if hold_id is None:
+            return
+        member_id, book_id = self.hold_rows[hold_id]
         
         try:
-            self.cursor.execute(
-                "INSERT INTO issued_books (book_id, member_id, issue_date, due_date) VALUES (?, ?, ?, ?)",
-                (book_id, member_id, issue_date, due_date)
-            )
-            
-            self.cursor.execute(
-                "UPDATE books SET available = available - 1 WHERE id = ?",
-                (book_id,)
-            )
-            
-            self.conn.commit()
-            messagebox.showinfo("Success", f"Book issued successfully. Due date: {due_date}")
-            
-            self.load_books()
-            self.load_issued_books()
-            
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", str(e))
+            with measure('handler', 'issue_held_copy'):
+                issue_id, due_date = self.service.issue_book(member_id, book_id)
+        except LibraryError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        messagebox.showinfo("Success", f"Book issued successfully. Due date: {due_date}")
+        
+        if self.tab_built(self.books_frame):
+            self.books_pages.refresh_row(book_id)
+        self.issued_pages.refresh_row(issue_id)
+        self.load_book_choices()
+        self.load_return_choices()
+        self.load_holds()
     
+    def cancel_hold(self):
+        """Cancel the selected hold; a copy set aside for it goes to the next in the queue"""
+        hold_id = self.selected_hold()
+        if hold_id is None:
+            return
+        if not messagebox.askyesno("Confirm", "Are you sure you want to cancel this hold?"):
+            return
+        
+        try:
+            with measure('handler', 'cancel_hold'):
+                self.service.cancel_hold(hold_id)
+        except LibraryError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        if self.tab_built(self.books_frame):
+            self.books_pages.refresh_row(self.hold_rows[hold_id][1])
+        self.load_book_choices()
+        self.load_holds()
+    
+    @timed('handler')
     def return_book(self):
         """Return an issued book"""
-        selection = self.return_combo.get()
-        if not selection:
+        index = self.return_combo.current()
+        if index < 0:
             messagebox.showerror("Error", "Please select a book to return")
             return
         
-        issue_id = int(selection.split(' - ')[0])
-        return_date = datetime.now().strftime("%Y-%m-%d")
+        issue_id = self.return_choice_ids[index]
         
         try:
-            self.cursor.execute("SELECT book_id FROM issued_books WHERE id = ?", (issue_id,))
-            book_id = self.cursor.fetchone()[0]
-            
-            self.cursor.execute(
-                "UPDATE issued_books SET return_date = ? WHERE id = ?",
-                (return_date, issue_id)
-            )
-            
-            self.cursor.execute(
-                "UPDATE books SET available = available + 1 WHERE id = ?",
-                (book_id,)
-            )
-            
-            self.conn.commit()
-            messagebox.showinfo("Success", "Book returned successfully")
-            
-            self.load_books()
-            self.load_issued_books()
-            
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", str(e))
+            with measure('handler', 'return_book'):
+                book_id = self.service.return_book(issue_id)
+        except LibraryError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        messagebox.showinfo("Success", "Book returned successfully")
+        
+        if self.tab_built(self.books_frame):
+            self.books_pages.refresh_row(book_id)
+        self.issued_pages.remove_row(issue_id)
+        self.load_book_choices()
+        self.load_return_choices()
+        self.load_holds()
     
-    def generate_books_report(self):
-        """Generate a report of all books"""
-        self.cursor.execute("SELECT * FROM books")
-        books = self.cursor.fetchall()
+    def queue_scan(self, event=None):
+        """Add the scanned code to the batch queue and ready the entry for the next scan"""
+        code = self.scan_entry.get().strip()
+        self.scan_entry.delete(0, 'end')
+        if code:
+            self.scan_listbox.insert('end', code)
+            self.scan_listbox.see('end')
+            self.update_scan_count()
+    
+    def remove_scan(self, event=None):
+        for index in reversed(self.scan_listbox.curselection()):
+            self.scan_listbox.delete(index)
+        self.update_scan_count()
+    
+    def clear_scans(self):
+        self.scan_listbox.delete(0, 'end')
+        self.update_scan_count()
+    
+    def update_scan_count(self):
+        self.scan_count_label.config(text=f"{self.scan_listbox.size()} items queued")
+    
+    def process_batch(self):
+        """Issue or return every queued scan in one transaction and list the outcomes"""
+        codes = list(self.scan_listbox.get(0, 'end'))
+        if not codes:
+            messagebox.showerror("Error", "Scan at least one item first")
+            return
+        
+        try:
+            if self.batch_mode.get() == 'checkout':
+                member_text = self.batch_member_entry.get().strip()
+                if not member_text.isdigit():
+                    messagebox.showerror("Error", "Please enter the member ID for checkout")
+                    return
+                with measure('handler', 'issue_books'):
+                    results = self.service.issue_books(int(member_text), codes)
+            else:
+                with measure('handler', 'return_books'):
+                    results = self.service.return_books(codes)
+        except LibraryError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
-        report = "BOOKS REPORT\n"
-        report += "=" * 50 + "\n"
-        report += f"{'ID':<5} {'Title':<30} {'Author':<20} {'ISBN':<15} {'Qty':<5} {'Avail':<5}\n"
-        report += "-" * 85 + "\n"
+        with measure('render', 'batch_results'):
+            self.batch_tree.delete(*self.batch_tree.get_children())
+            for code, ok, details in results:
+                self.batch_tree.insert('', 'end', values=(code, "OK" if ok else "Failed", details),
+                                       tags=() if ok else ('failed',))
+        self.clear_scans()
         
-        for book in books:
-            report += f"{book[0]:<5} {book[1][:29]:<30} {book[2][:19]:<20} {book[3]:<15} {book[4]:<5} {book[5]:<5}\n"
+        done = sum(1 for code, ok, details in results if ok)
+        self.scan_count_label.config(text=f"{done} of {len(results)} processed")
+        
+        self.load_books()
+        self.load_issued_books()
+        self.load_holds()
+        self.scan_entry.focus_set()
+    
+    def report_filters(self):
+        """Read the report filter entries into a dict"""
+        filters = {name: entry.get().strip() for name, entry in self.report_filter_entries.items()}
+        for name in ('date_from', 'date_to'):
+            if filters[name]:
+                datetime.strptime(filters[name], "%Y-%m-%d")
+        for name in ('member_id', 'book_id'):
+            if filters[name]:
+                filters[name] = int(filters[name])
+        return filters
+    
+    def run_report(self, name):
+        """Stream a report into the text widget a page at a time"""
+        try:
+            filters = self.report_filters()
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be YYYY-MM-DD and IDs must be numbers")
+            return
         
+        snapshot = self.report_from_snapshot.get()
+        self.close_report_stream()
+        self.report_name = name
         self.report_text.delete(1.0, tk.END)
-        self.report_text.insert(1.0, report)
+        self.after_fines_refresh(name, snapshot, lambda: self.worker.submit(
+            lambda service: render_lines(name, service.report_rows(name, snapshot, **filters)),
+            self.start_report_stream,
+            show_error,
+            key='report'
+        ))
     
-    def generate_members_report(self):
-        """Generate a report of all members"""
-        self.cursor.execute("SELECT * FROM members")
-        members = self.cursor.fetchall()
+    def after_fines_refresh(self, name, snapshot, then):
+        """Call then() once a live fines report can read current fines, refreshed by the job worker"""
+        if name in FINES_REPORTS and not snapshot:
+            self.job_worker.submit(lambda service: service.refresh_fines(), lambda result: then(), show_error,
+                                   key='fines_refresh')
+        else:
+            then()
+    
+    def close_report_stream(self):
+        """Abandon the report being shown, closing its cursor on the worker"""
+        lines, self.report_lines = self.report_lines, None
+        self.report_pending = False
+        if lines is not None:
+            self.worker.submit(lambda service: lines.close())
+    
+    def start_report_stream(self, lines):
+        self.report_lines = lines
+        self.load_report_page()
+    
+    def load_report_page(self):
+        """Fetch the next page of report lines on the worker"""
+        lines = self.report_lines
+        if lines is None or self.report_pending:
+            return
         
-        report = "MEMBERS REPORT\n"
-        report += "=" * 50 + "\n"
-        report += f"{'ID':<5} {'Name':<25} {'Email':<25} {'Phone':<15} {'Member Since':<12}\n"
-        report += "-" * 85 + "\n"
+        self.report_pending = True
+        self.worker.submit(
+            lambda service: list(islice(lines, REPORT_PAGE_LINES)),
+            lambda page: self.add_report_page(lines, page),
+            show_error,
+            key='report'
+        )
+    
+    @timed('render')
+    def add_report_page(self, lines, page):
+        """Append a page of report lines unless another report replaced it"""
+        if lines is not self.report_lines:
+            return
+        self.report_pending = False
         
-        for member in members:
-            report += f"{member[0]:<5} {member[1][:24]:<25} {member[2][:24]:<25} {member[3]:<15} {member[4]:<12}\n"
+        if page:
+            self.report_text.insert(tk.END, '\n'.join(page) + '\n')
+        if len(page) < REPORT_PAGE_LINES:
+            self.report_lines = None
+    
+    def on_report_scroll(self, first, last):
+        """Forward scroll updates and fetch more report lines near the bottom"""
+        self.report_scrollbar.set(first, last)
+        if float(last) >= 0.9:
+            self.load_report_page()
+    
+    def export_current_report(self, fmt):
+        """Stream the last generated report to a CSV or JSONL file"""
+        name = self.report_name
+        if name is None:
+            messagebox.showerror("Error", "Please generate a report first")
+            return
+        try:
+            filters = self.report_filters()
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be YYYY-MM-DD and IDs must be numbers")
+            return
         
-        self.report_text.delete(1.0, tk.END)
-        self.report_text.insert(1.0, report)
+        path = filedialog.asksaveasfilename(
+            title="Export Report",
+            defaultextension=f".{fmt}",
+            initialfile=f"{name}_report.{fmt}",
+            filetypes=[(fmt.upper(), f"*.{fmt}"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        
+        snapshot = self.report_from_snapshot.get()
+        self.after_fines_refresh(name, snapshot, lambda: self.worker.submit(
+            lambda service: service.export_report(name, path, fmt, snapshot, **filters),
+            lambda count: messagebox.showinfo("Export Complete", f"Exported {count} rows to {path}"),
+            show_error,
+            key='export'
+        ))
+    
+    @timed('handler')
+    def generate_books_report(self):
+        """Generate a report of all books"""
+        self.run_report('books')
     
+    @timed('handler')
+    def generate_members_report(self):
+        """Generate a report of all members"""
+        self.run_report('members')
+    
+    @timed('handler')
     def generate_issued_report(self):
         """Generate a report of all issued books"""
-        self.cursor.execute('''
-            SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date, ib.return_date
-            FROM issued_books ib
-            JOIN books b ON ib.book_id = b.id
-            JOIN members m ON ib.member_id = m.id
-            ORDER BY ib.issue_date DESC
-        ''')
-        issued_books = self.cursor.fetchall()
-        
-        report = "ISSUED BOOKS REPORT\n"
-        report += "=" * 50 + "\n"
-        report += f"{'ID':<5} {'Book':<25} {'Member':<20} {'Issue Date':<12} {'Due Date':<12} {'Return Date':<12}\n"
-        report += "-" * 90 + "\n"
-        
-        for book in issued_books:
-            return_date = book[5] if book[5] else "Not Returned"
-            report += f"{book[0]:<5} {book[1][:24]:<25} {book[2][:19]:<20} {book[3]:<12} {book[4]:<12} {return_date:<12}\n"
-        
-        self.report_text.delete(1.0, tk.END)
-        self.report_text.insert(1.0, report)
+        self.run_report('issued')
     
+    @timed('handler')
     def generate_overdue_report(self):
         """Generate a report of overdue books"""
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        self.cursor.execute('''
-            SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date
-            FROM issued_books ib
-            JOIN books b ON ib.book_id = b.id
-            JOIN members m ON ib.member_id = m.id
-            WHERE ib.due_date < ? AND ib.return_date IS NULL
-            ORDER BY ib.due_date
-        ''', (today,))
-        
-        overdue_books = self.cursor.fetchall()
-        
-        report = "OVERDUE BOOKS REPORT\n"
-        report += "=" * 50 + "\n"
-        
-        if not overdue_books:
-            report += "No overdue books.\n"
-        else:
-            report += f"{'ID':<5} {'Book':<25} {'Member':<20} {'Issue Date':<12} {'Due Date':<12} {'Days Overdue':<12}\n"
-            report += "-" * 90 + "\n"
-            
-            for book in overdue_books:
-                due_date = datetime.strptime(book[4], "%Y-%m-%d")
-                days_overdue = (datetime.now() - due_date).days
-                report += f"{book[0]:<5} {book[1][:24]:<25} {book[2][:19]:<20} {book[3]:<12} {book[4]:<12} {days_overdue:<12}\n"
-        
-        self.report_text.delete(1.0, tk.END)
-        self.report_text.insert(1.0, report)
+        self.run_report('overdue')
+    
+    @timed('handler')
+    def generate_fines_report(self):
+        """Generate a report of fines per member"""
+        self.run_report('fines')
+    
+    @timed('handler')
+    def generate_circulation_report(self):
+        """Generate circulation totals for the filtered period"""
+        self.run_report('circulation')
+    
+    @timed('handler')
+    def generate_loans_by_day_report(self):
+        """Generate loans and returns per day"""
+        self.run_report('loans_by_day')
+    
+    @timed('handler')
+    def generate_top_books_report(self):
+        """Generate the most borrowed books"""
+        self.run_report('top_books')
+    
+    @timed('handler')
+    def generate_member_activity_report(self):
+        """Generate loans per member, most active first"""
+        self.run_report('member_activity')
+    
+    def run_jobs(self):
+        """Update the overdue/fines table and expire uncollected holds in the background, now and every hour"""
+        self.job_worker.submit(lambda service: service.update_fines(), errback=show_error, key='fines_job')
+        self.job_worker.submit(lambda service: service.expire_holds(), self.on_holds_swept, show_error, key='holds_job')
+        self.jobs_timer = self.root.after(JOBS_INTERVAL_MS, self.run_jobs)
+    
+    def run_snapshot(self):
+        """Save a read-only snapshot for reports in the background, now and every snapshot_minutes"""
+        self.snapshot_worker.submit(lambda service: service.take_snapshot(), errback=show_error, key='snapshot')
+        self.snapshot_timer = self.root.after(int(self.snapshot_minutes * 60 * 1000), self.run_snapshot)
+    
+    def on_holds_swept(self, result):
+        """Show the copies that expired holds handed on or put back on the shelf"""
+        if result['expired']:
+            self.load_book_choices()
+            self.load_holds()
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Library Management System")
+    parser.add_argument('--server', help="use a library server (e.g. http://127.0.0.1:8750) instead of library.db")
+    parser.add_argument('--db', default=DB_PATH, help="library database file")
+    parser.add_argument('--branch', help="run as this branch's desk, on its shard from --branches")
+    parser.add_argument('--branches', default=BRANCHES_FILE, help="JSON file mapping branch names to databases")
+    parser.add_argument('--snapshot-every', type=float, metavar='MINUTES',
+                        help="take a read-only snapshot for reports at this interval")
+    parser.add_argument('--durability', choices=DURABILITY, default=DEFAULT_DURABILITY,
+                        help="journal and sync mode of library.db (see lms_db.DURABILITY)")
+    parser.add_argument('--profile', action='store_true', help="time SQL and handlers and add a Diagnostics tab")
+    parser.add_argument('--profile-out', metavar='PATH', help="write the profile to this JSON file on exit (implies --profile)")
+    parser.add_argument('--measure-startup', action='store_true', help="print the time to first paint and exit")
+    parser.add_argument('--slow-ms', type=float, default=SLOW_QUERY_MS, help="log statements slower than this with their plans")
+    args = parser.parse_args()
+    launched = time.perf_counter()
+    
+    branches = None
+    if args.branch:
+        branches = load_branches(args.branches)
+        if args.branch not in branches:
+            parser.error(f"{args.branches} has no branch named {args.branch!r}")
+        args.db = branches[args.branch]
+    
+    if args.profile or args.profile_out:
+        enable_profiling(args.slow_ms)
+    
     root = tk.Tk()
-    app = LibraryManagementSystem(root)
+    app = LibraryManagementSystem(root, server_url=args.server, profile_out=args.profile_out,
+                                  launched=launched, measure_startup=args.measure_startup,
+                                  durability=args.durability, db_path=args.db,
+                                  snapshot_minutes=args.snapshot_every, branches=branches, branch=args.branch)
     root.mainloop()
@@ -0,0 +1,55 @@
+import argparse
+import sys
+import time
+
+from lms_db import DB_PATH, LOAN_STATS, connect_database
+
+
+def verify_rollups(conn):
+    """Compare every rollup table with the same figures computed from loan_history.
+
+    Returns {table: (stale, missing)}: rows in the table that the history
+    does not produce, and rows the history produces that the table lacks.
+    Both are 0 when the rollups are right. Reads one snapshot, so writes
+    committed meanwhile cannot cause false alarms.
+    """
+    results = {}
+    conn.execute("BEGIN")
+    try:
+        for table, sql in LOAN_STATS.items():
+            stale = conn.execute(f"SELECT COUNT(*) FROM (SELECT * FROM {table} EXCEPT {sql})").fetchone()[0]
+            missing = conn.execute(f"SELECT COUNT(*) FROM ({sql} EXCEPT SELECT * FROM {table})").fetchone()[0]
+            results[table] = (stale, missing)
+    finally:
+        conn.execute("COMMIT")
+    return results
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup table from loan_history in one transaction; return rows and time"""
+    started = time.perf_counter()
+    script = ''.join(f"DELETE FROM {table};\nINSERT INTO {table} {sql};\n" for table, sql in LOAN_STATS.items())
+    conn.executescript(f"BEGIN IMMEDIATE;\n{script}COMMIT;")
+    rows = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in LOAN_STATS}
+    return {'rows': rows, 'elapsed_s': round(time.perf_counter() - started, 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the circulation rollups against the loan history, or rebuild them from it")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help="recompute the rollups from scratch first")
+    args = parser.parse_args()
+
+    conn = connect_database(args.db)
+    if args.rebuild:
+        result = rebuild_rollups(conn)
+        print(f"rebuilt {', '.join(f'{table} ({rows} rows)' for table, rows in result['rows'].items())} "
+              f"in {result['elapsed_s']}s")
+
+    started = time.perf_counter()
+    results = verify_rollups(conn)
+    for table, (stale, missing) in results.items():
+        print(f"{'FAIL' if stale or missing else 'ok':<5} {table}: {stale} stale rows, {missing} missing rows")
+    print(f"verified in {time.perf_counter() - started:.3f}s")
+    sys.exit(1 if any(stale or missing for stale, missing in results.values()) else 0)
@@ -0,0 +1,108 @@
+import argparse
+import json
+import time
+from datetime import date, timedelta
+
+from lms_db import DB_PATH, connect_database
+from lms_fines import refresh_fines
+
+ARCHIVE_AFTER_DAYS = 365
+BATCH_SIZE = 5000
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def archive_loans(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, today=None, progress=None):
+    """Move loans returned more than older_than_days ago to issued_books_archive.
+
+    Loans move batch_size at a time, each batch in its own short transaction,
+    so circulation can carry on while a large backlog is archived; like the
+    catalog import it keeps the connection's journal mode and, in WAL mode,
+    runs with synchronous=NORMAL. The fines
+    job is brought up to date first so no late return is archived before it
+    has been fined. Returns the number of loans moved and the time taken.
+    """
+    today = today or date.today().isoformat()
+    refresh_fines(conn, today)
+    cutoff = (date.fromisoformat(today) - timedelta(days=older_than_days)).isoformat()
+    started = time.perf_counter()
+    moved = 0
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    if conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+    try:
+        while True:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                ids = [row[0] for row in conn.execute(
+                    "SELECT id FROM issued_books WHERE return_date < ? ORDER BY return_date LIMIT ?", (cutoff, batch_size)
+                )]
+                if not ids:
+                    break
+                batch = json.dumps(ids)
+                conn.execute('''
+                    INSERT INTO issued_books_archive (id, book_id, member_id, issue_date, due_date, return_date, item_id)
+                    SELECT id, book_id, member_id, issue_date, due_date, return_date, item_id
+                    FROM issued_books WHERE id IN (SELECT value FROM json_each(?))
+                ''', (batch,))
+                conn.execute("DELETE FROM issued_books WHERE id IN (SELECT value FROM json_each(?))", (batch,))
+            moved += len(ids)
+            if progress:
+                progress(moved)
+    finally:
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+
+    return {'cutoff': cutoff, 'moved': moved, 'elapsed_s': round(time.perf_counter() - started, 3)}
+
+
+def database_size(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {'bytes': pages * page_size, 'free_bytes': free * page_size}
+
+
+def reclaim_space(conn, full=False):
+    """Return free pages to the filesystem and report the size before and after.
+
+    Incremental vacuum only works once auto_vacuum is INCREMENTAL, and
+    switching an existing database to it takes one full VACUUM, so that runs
+    the first time (or whenever full is set). Later calls just truncate the
+    free pages, which is quick and needs no copy of the database.
+    """
+    before = database_size(conn)
+    started = time.perf_counter()
+    incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+
+    if full or not incremental:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+
+    return {
+        'mode': 'incremental' if incremental and not full else 'full',
+        'before': before,
+        'after': database_size(conn),
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old returned loans and reclaim database space")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help="archive loans returned this long ago")
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--vacuum', choices=('none', 'incremental', 'full'), default='incremental')
+    args = parser.parse_args()
+
+    conn = connect_database(args.db)
+    result = archive_loans(conn, args.days, args.batch)
+    print(f"archived {result['moved']} loans returned before {result['cutoff']} in {result['elapsed_s']}s")
+
+    if args.vacuum != 'none':
+        result = reclaim_space(conn, full=args.vacuum == 'full')
+        mb = lambda size: size / 2 ** 20
+        print(f"{result['mode']} vacuum: {mb(result['before']['bytes']):.1f} MB -> "
+              f"{mb(result['after']['bytes']):.1f} MB in {result['elapsed_s']}s")
@@ -0,0 +1,150 @@
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from urllib.request import pathname2url
+
+from lms_db import DB_PATH, connect_database
+
+# Pages copied per backup step; between steps other connections can write
+BACKUP_PAGES = 1024
+BACKUP_SLEEP_S = 0.005
+
+SNAPSHOT_DIR = 'snapshots'
+SNAPSHOT_KEEP = 3
+
+
+def database_file(conn):
+    """Path of the main database file behind a connection"""
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def backup_database(conn, path, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP_S, progress=None):
+    """Copy the live database behind conn to path without stopping circulation.
+
+    The copy is made with the SQLite backup API, pages at a time. In WAL
+    mode it runs inside one read transaction, so writers carry on untouched
+    and the copy is the database as of the start. In rollback mode each step
+    holds the read lock only briefly and writes get in between steps (a write
+    on another connection restarts the copy). The copy is written next to
+    path and renamed into place, so path never holds a partial backup, and
+    it uses a rollback journal so it opens on its own without a -wal file.
+    progress, if given, gets (remaining, total) pages after each step.
+    """
+    started = time.perf_counter()
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    wal = conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+    target = sqlite3.connect(partial)
+    try:
+        if wal:
+            conn.execute("BEGIN")
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        try:
+            conn.backup(target, pages=pages, sleep=sleep,
+                        progress=(lambda status, remaining, total: progress(remaining, total)) if progress else None)
+        finally:
+            if wal:
+                conn.execute("COMMIT")
+        target.execute("PRAGMA journal_mode = DELETE")
+        pages_copied = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+    os.replace(partial, path)
+
+    return {
+        'path': path,
+        'pages': pages_copied,
+        'bytes': os.path.getsize(path),
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+
+def snapshot_paths(db_path, snapshot_dir=None):
+    """Snapshots of a database, oldest first.
+
+    Names must be the stem followed by exactly the timestamp take_snapshot
+    writes, so library-archive-*.db is not taken for a snapshot of library.db.
+    """
+    snapshot_dir = snapshot_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), SNAPSHOT_DIR)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    name = re.compile(rf"{re.escape(stem)}-(\d{{8}})-(\d{{6}})(?:-(\d{{6}}))?\.db")
+    snapshots = []
+    for path in glob.glob(os.path.join(snapshot_dir, f"{glob.escape(stem)}-*.db")):
+        match = name.fullmatch(os.path.basename(path))
+        if match:
+            # Names from before microseconds were added sort as .000000
+            snapshots.append((match[1], match[2], match[3] or '000000', path))
+    return snapshot_dir, [path for *taken, path in sorted(snapshots)]
+
+
+def latest_snapshot(db_path, snapshot_dir=None):
+    """Path of the newest snapshot of a database, or None"""
+    snapshots = snapshot_paths(db_path, snapshot_dir)[1]
+    return snapshots[-1] if snapshots else None
+
+
+def take_snapshot(conn, snapshot_dir=None, keep=SNAPSHOT_KEEP):
+    """Back up the database behind conn as a read-only, timestamped snapshot.
+
+    Snapshots go to snapshot_dir (default: snapshots/ next to the database)
+    as <name>-YYYYmmdd-HHMMSS-ffffff.db; only the newest keep (at least 1)
+    are kept. Reports can then read the latest one (see open_snapshot)
+    instead of the live file.
+    """
+    if keep < 1:
+        raise ValueError("keep must be at least 1: the snapshot just taken is always kept")
+    db_path = database_file(conn)
+    snapshot_dir = snapshot_paths(db_path, snapshot_dir)[0]
+    os.makedirs(snapshot_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    taken = datetime.now()
+    while True:
+        path = os.path.join(snapshot_dir, f"{stem}-{taken.strftime('%Y%m%d-%H%M%S-%f')}.db")
+        if not os.path.exists(path):
+            break
+        # Never overwrite: step past a snapshot taken at the same clock reading, keeping the names in order
+        taken += timedelta(microseconds=1)
+
+    result = backup_database(conn, path)
+    os.chmod(path, 0o444)
+    for old in snapshot_paths(db_path, snapshot_dir)[1][:-keep]:
+        os.remove(old)
+    return result
+
+
+def open_snapshot(path):
+    """Open a snapshot read-only; it never changes, so SQLite skips locking it"""
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro&immutable=1", uri=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up the library while it is in use, or take a snapshot")
+    parser.add_argument('--db', default=DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    backup = commands.add_parser('backup', help="copy the database to a file")
+    backup.add_argument('path')
+    snapshot = commands.add_parser('snapshot', help="take a read-only snapshot for reports")
+    snapshot.add_argument('--dir', help=f"snapshot directory (default: {SNAPSHOT_DIR}/ next to the database)")
+    snapshot.add_argument('--keep', type=int, default=SNAPSHOT_KEEP, help="snapshots to keep (at least 1)")
+    snapshot.add_argument('--every', type=float, metavar='MINUTES', help="keep taking snapshots at this interval")
+    args = parser.parse_args()
+    if args.command == 'snapshot' and args.keep < 1:
+        parser.error("--keep must be at least 1")
+
+    conn = connect_database(args.db)
+    report = lambda result: print(f"{result['path']}: {result['bytes'] / 2 ** 20:.1f} MB in {result['elapsed_s']}s",
+                                  flush=True)
+    if args.command == 'backup':
+        report(backup_database(conn, args.path))
+    else:
+        while True:
+            report(take_snapshot(conn, args.dir, args.keep))
+            if not args.every:
+                break
+            time.sleep(args.every * 60)
@@ -0,0 +1,335 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import time
+from datetime import date, datetime, timedelta
+from itertools import accumulate, cycle, islice
+
+from lms_branches import ATTACH_LIMIT, LOCATE_SQL, BranchLibrary
+from lms_db import connect_database
+from lms_items import barcode_for
+from lms_reports import REPORTS, iter_rows, render_lines
+from lms_service import LOAN_DAYS, MAX_LOANS, SEARCH_LIMIT, LibraryError, LibraryService
+
+PAGE_SIZE = 200
+
+# (books, members, loans) per preset size
+SIZES = {
+    'tiny': (1000, 500, 5000),
+    '10k': (10000, 5000, 50000),
+    '100k': (100000, 50000, 500000),
+    '1m': (1000000, 250000, 3000000),
+}
+
+WORDS = (
+    "the of and a to in history life world love war time night house art secret city story guide "
+    "introduction science music death river garden stone light dark water king queen journey modern "
+    "lost last new old little great american english children family mind nature power road sea sky "
+    "summer winter shadow fire blood heart island empire money design data python systems theory"
+).split()
+FIRST_NAMES = "Alex Sam Priya Wei Maria John Aisha Omar Lena Yuki Carlos Noor Ivan Grace Ravi Emma".split()
+LAST_NAMES = "Smith Garcia Chen Patel Kim Müller Rossi Silva Khan Nguyen Brown Cohen Sato Novak".split()
+
+ACTIVE_SHARE = 0.05
+HISTORY_DAYS = 3 * 365
+
+
+def zipf_weights(n, s=1.1):
+    """Cumulative Zipf weights: a few popular items, a long tail"""
+    return list(accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def generate_library(path, books, members, loans, seed=0, progress=print):
+    """Create a synthetic library database at path.
+
+    Book popularity and member activity follow Zipf distributions, loan dates
+    are spread over the last three years, and about ACTIVE_SHARE of loans are
+    still out. Counters are kept consistent with the generated loans.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = connect_database(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    today = date.today()
+
+    progress(f"generating {books} books")
+    quantities = [rng.choice((1, 1, 1, 2, 2, 3, 5)) for _ in range(books)]
+    with conn:
+        # The item triggers count quantity and available up as the copies go in
+        conn.executemany(
+            "INSERT INTO books (id, title, author, isbn, quantity, available) VALUES (?, ?, ?, ?, 0, 0)",
+            ((i + 1,
+              ' '.join(rng.choices(WORDS, k=rng.randint(2, 6))).title(),
+              f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+              f"978{i:010d}") for i in range(books))
+        )
+        conn.executemany(
+            "INSERT INTO items (book_id, barcode) VALUES (?, ?)",
+            ((i + 1, barcode_for(f"978{i:010d}", copy)) for i in range(books) for copy in range(1, quantities[i] + 1))
+        )
+    # Item ids run in book order, so copy n of a book is first_item[book_id] + n
+    first_item = [0, 0] + list(accumulate(quantities))
+
+    progress(f"generating {members} members")
+    with conn:
+        conn.executemany(
+            "INSERT INTO members (id, name, email, phone, membership_date) VALUES (?, ?, ?, ?, ?)",
+            ((i + 1,
+              f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+              f"member{i + 1}@example.org",
+              f"{rng.randint(1000000000, 9999999999)}",
+              (today - timedelta(days=rng.randint(0, HISTORY_DAYS))).isoformat()) for i in range(members))
+        )
+
+    progress(f"generating {loans} loans")
+    book_ids = list(range(1, books + 1))
+    member_ids = list(range(1, members + 1))
+    rng.shuffle(book_ids)
+    rng.shuffle(member_ids)
+    book_picks = rng.choices(book_ids, cum_weights=zipf_weights(books), k=loans)
+    member_picks = rng.choices(member_ids, cum_weights=zipf_weights(members, 0.8), k=loans)
+
+    available = [0] + quantities
+    active = [0] * (members + 1)
+    rows = []
+    for book_id, member_id in zip(book_picks, member_picks):
+        quantity = quantities[book_id - 1]
+        if rng.random() < ACTIVE_SHARE and available[book_id] > 0 and active[member_id] < MAX_LOANS:
+            issued = today - timedelta(days=rng.randint(0, 2 * LOAN_DAYS))
+            returned = None
+            item_id = first_item[book_id] + quantity - available[book_id] + 1
+            available[book_id] -= 1
+            active[member_id] += 1
+        else:
+            issued = today - timedelta(days=rng.randint(2 * LOAN_DAYS, HISTORY_DAYS))
+            returned = (issued + timedelta(days=rng.randint(1, 2 * LOAN_DAYS))).isoformat()
+            item_id = first_item[book_id] + len(rows) % quantity + 1
+        rows.append((book_id, member_id, item_id, issued.isoformat(),
+                     (issued + timedelta(days=LOAN_DAYS)).isoformat(), returned))
+
+    rows.sort(key=lambda row: row[3])
+    with conn:
+        conn.executemany(
+            "INSERT INTO issued_books (book_id, member_id, item_id, issue_date, due_date, return_date) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.executemany("UPDATE items SET status = 'on_loan' WHERE id = ?",
+                         ((row[2],) for row in rows if row[5] is None))
+        conn.executemany("UPDATE members SET active_loans = ? WHERE id = ?",
+                         ((count, i) for i, count in enumerate(active) if count))
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def summarize(latencies):
+    """Latency statistics in milliseconds for a list of durations in seconds"""
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {
+        'ops': len(ordered),
+        'total_s': round(total, 4),
+        'ops_per_s': round(len(ordered) / total, 1) if total else None,
+        'mean_ms': round(total / len(ordered) * 1000, 3),
+        'p50_ms': round(pick(0.50), 3),
+        'p95_ms': round(pick(0.95), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def measure(func, repeat=1):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def bench_startup(path, repeat):
+    """Open + migrate, then the first page of every list the window shows"""
+    def startup():
+        service = LibraryService.open(path)
+        service.books_page(0, PAGE_SIZE)
+        service.members_page(0, PAGE_SIZE)
+        service.issued_page(0, PAGE_SIZE)
+        service.close()
+    return measure(startup, repeat)
+
+
+def bench_circulation(service, ops, rng):
+    """Issue ops books to random members, then return them all"""
+    max_book = service.conn.execute("SELECT MAX(id) FROM books").fetchone()[0]
+    max_member = service.conn.execute("SELECT MAX(id) FROM members").fetchone()[0]
+    issue_latencies, return_latencies, rejected, issued = [], [], 0, []
+
+    while len(issued) < ops:
+        member_id, book_id = rng.randint(1, max_member), rng.randint(1, max_book)
+        started = time.perf_counter()
+        try:
+            issue_id, due_date = service.issue_book(member_id, book_id)
+        except LibraryError:
+            rejected += 1
+            continue
+        finally:
+            issue_latencies.append(time.perf_counter() - started)
+        issued.append(issue_id)
+
+    for issue_id in issued:
+        started = time.perf_counter()
+        service.return_book(issue_id)
+        return_latencies.append(time.perf_counter() - started)
+
+    results = {'issue_book': summarize(issue_latencies), 'return_book': summarize(return_latencies)}
+    results['issue_book']['rejected'] = rejected
+    return results
+
+
+def bench_loads(service, repeat):
+    """The queries behind load_books, load_members and load_issued_books"""
+    return {
+        'load_books': measure(lambda: (service.books_page(0, PAGE_SIZE),
+                                       service.available_books(limit=SEARCH_LIMIT)), repeat),
+        'load_members': measure(lambda: (service.members_page(0, PAGE_SIZE),
+                                         service.member_choices()), repeat),
+        'load_issued_books': measure(lambda: (service.issued_page(0, PAGE_SIZE),
+                                              service.active_loans()), repeat),
+        'search_books': measure(lambda: service.search_books("history wor", available_only=True), repeat),
+    }
+
+
+def bench_reports(service, repeat):
+    """Render every report to completion, as the Reports tab would when scrolled through"""
+    results = {}
+    for name in REPORTS:
+        def render():
+            for line in render_lines(name, iter_rows(service.conn, name)):
+                pass
+        results[f'generate_{name}_report'] = measure(render, repeat)
+    return results
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(path, ops=1000, repeat=5, seed=0):
+    rng = random.Random(seed)
+    service = LibraryService.open(path)
+    counts = {table: service.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('books', 'members', 'issued_books')}
+
+    results = {'startup': bench_startup(path, repeat)}
+    results.update(bench_loads(service, repeat))
+    results.update(bench_circulation(service, ops, rng))
+    # The first run backfills late returns on a new database; later ones are incremental
+    results['update_fines_first'] = measure(service.update_fines)
+    results['update_fines'] = measure(service.update_fines, repeat)
+    results.update(bench_reports(service, max(1, repeat // 5)))
+    service.close()
+
+    return {
+        'meta': {
+            'version': git_version(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'database': os.path.abspath(path),
+            'rows': counts,
+        },
+        'results': results,
+    }
+
+
+def bench_fanout(directory, size, shard_counts, repeat=20, seed=0, progress=print):
+    """Time federated reads against 1..n synthetic branch shards and return {shards: results}.
+
+    Shards are generated into directory once (branchN.db, the lms_bench
+    library at the given size) and reused. Every branch stocks the same
+    ISBNs, so each locate finds the title in every shard.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for k in range(max(shard_counts)):
+        path = os.path.join(directory, f"branch{k + 1}.db")
+        if not os.path.exists(path):
+            progress(f"generating {path}")
+            generate_library(path, *SIZES[size], seed=seed + k, progress=lambda message: None)
+        paths[f"branch{k + 1}"] = path
+
+    rng = random.Random(seed)
+    isbns = cycle([f"978{rng.randrange(SIZES[size][0]):010d}" for _ in range(repeat)])
+    search = lambda service: service.search_books("history wor", available_only=True, scored=True)
+    results = {}
+    for count in shard_counts:
+        library = BranchLibrary(dict(islice(paths.items(), count)))
+        timings = {}
+        if count <= ATTACH_LIMIT:
+            timings['locate_attach'] = lambda: library.union_all(LOCATE_SQL, (next(isbns),))
+        timings['locate_fanout'] = lambda: library.fan_out(
+            lambda service: service.conn.execute(LOCATE_SQL.format(db='main'), (next(isbns),)).fetchall())
+        timings['search_serial'] = lambda: library.fan_out(search, parallel=False)
+        timings['search_fanout'] = lambda: library.fan_out(search)
+        timings['top_books_fanout'] = lambda: sum(1 for row in library.report_rows('top_books'))
+        results[count] = {}
+        for name, func in timings.items():
+            func()  # warm the page caches
+            results[count][name] = measure(func, repeat if 'top_books' not in name else max(1, repeat // 5))
+        library.close()
+        progress(f"{count:>3} shards: " + ' '.join(f"{name}={stats['mean_ms']}ms"
+                                                  for name, stats in results[count].items()))
+    return results
+
+
+def compare(baseline, current):
+    """Print mean latency changes between two result files"""
+    print(f"{'benchmark':<28} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for name, stats in current['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        change = (stats['mean_ms'] - before['mean_ms']) / before['mean_ms'] * 100 if before['mean_ms'] else 0
+        print(f"{name:<28} {before['mean_ms']:>12.3f} {stats['mean_ms']:>12.3f} {change:>+7.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic libraries and time the hot paths")
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k')
+    parser.add_argument('--db', help="database to benchmark (default: bench_<size>.db, generated if missing)")
+    parser.add_argument('--regenerate', action='store_true', help="rebuild the synthetic database")
+    parser.add_argument('--ops', type=int, default=1000, help="issue/return operations to time")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="write results JSON here (default: stdout)")
+    parser.add_argument('--compare', help="baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    path = args.db or f"bench_{args.size}.db"
+    if args.regenerate or not os.path.exists(path):
+        started = time.perf_counter()
+        generate_library(path, *SIZES[args.size], seed=args.seed)
+        print(f"generated {path} in {time.perf_counter() - started:.1f}s")
+
+    report = run_benchmarks(path, args.ops, args.repeat, args.seed)
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+        print(f"results written to {args.out}")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
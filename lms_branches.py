@@ -0,0 +1,358 @@
+import argparse
+import heapq
+import json
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.request import pathname2url
+
+from lms_db import DEFAULT_DURABILITY
+from lms_fines import FINES_REPORTS
+from lms_reports import FILTERS, REPORTS
+from lms_service import SEARCH_LIMIT, LibraryService, NotFoundError, ValidationError
+
+BRANCHES_FILE = 'branches.json'
+
+# Rows handed from a shard's reader thread to a consolidated report at a time
+REPORT_BATCH = 500
+
+LOCATE_SQL = "SELECT id, title, quantity, available FROM {db}.books WHERE isbn = ?"
+
+# Point lookups that find which shard owns a record
+MEMBER_SQL = "SELECT id FROM {db}.members WHERE email = ?"
+COPY_SQL = "SELECT id FROM {db}.items WHERE barcode = ?"
+LOANED_COPY_SQL = "SELECT id FROM {db}.items WHERE barcode = ? AND status = 'on_loan'"
+ACTIVE_LOAN_SQL = "SELECT id FROM {db}.issued_books WHERE id = ? AND return_date IS NULL"
+
+
+def attach_limit():
+    """How many databases one SQLite connection may ATTACH (10 unless SQLite was built otherwise)"""
+    conn = sqlite3.connect(':memory:')
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    finally:
+        conn.close()
+
+
+ATTACH_LIMIT = attach_limit()
+
+
+def load_branches(path=BRANCHES_FILE):
+    """Read {branch: database file} from a JSON file; relative paths are taken from the file's directory"""
+    with open(path) as f:
+        branches = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    return {name: os.path.join(base, db) for name, db in branches.items()}
+
+
+class BranchLibrary:
+    """A library split into one SQLite shard per branch.
+
+    Each shard is a complete library database owned by its branch: its
+    copies, its members and their loans and holds. Writes are routed to the
+    owning shard's LibraryService, opened on the caller's thread: new books
+    and members go to the branch named, and circulation goes to the shard
+    that holds the copy (by barcode), the loan or the member (by email),
+    found with a lookup across the shards. Ids are only unique within a
+    shard, so a lookup that matches at several branches needs the branch
+    named to settle it. Reads that
+    span branches fan out: every shard has one reader thread with its own
+    connection, so the shards are queried in parallel (SQLite releases the
+    GIL while it steps) and each shard serves one request at a time. Point
+    lookups such as locate() instead run as a single UNION ALL over the
+    shards ATTACHed read-only to one connection, which saves the thread
+    handoffs while the shard count is within ATTACH_LIMIT. Reads may be made
+    from any thread; writes belong to the thread that opened the library.
+    """
+
+    def __init__(self, branches, durability=DEFAULT_DURABILITY):
+        if not branches:
+            raise ValueError("A branch library needs at least one branch")
+        self.branches = dict(branches)
+        self.durability = durability
+        self.writers = {}
+        self.attached = None
+        self.attach_lock = threading.Lock()
+        self.local = threading.local()
+        self.readers = {
+            name: ThreadPoolExecutor(1, thread_name_prefix=f'lms-branch-{name}', initializer=self.open_reader,
+                                     initargs=(path,))
+            for name, path in self.branches.items()
+        }
+        # Each shard is migrated once, by its reader, before anything else opens it
+        for future in [reader.submit(int) for reader in self.readers.values()]:
+            future.result()
+
+    @classmethod
+    def open(cls, path=BRANCHES_FILE, durability=DEFAULT_DURABILITY):
+        """Open the shards listed in a branches file"""
+        return cls(load_branches(path), durability)
+
+    def open_reader(self, path):
+        self.local.service = LibraryService.open(path, self.durability)
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.submit(lambda: self.local.service.close())
+            reader.shutdown()
+        for service in self.writers.values():
+            service.close()
+        if self.attached is not None:
+            self.attached.close()
+
+    def check(self, branches=None):
+        """The given branch names (default: all), after making sure they exist"""
+        branches = list(self.branches) if branches is None else list(branches)
+        for branch in branches:
+            if branch not in self.branches:
+                raise NotFoundError(f"There is no branch named {branch!r}")
+        return branches
+
+    def shard(self, branch):
+        """The writable service of a branch's shard"""
+        self.check([branch])
+        if branch not in self.writers:
+            self.writers[branch] = LibraryService.open(self.branches[branch], self.durability)
+        return self.writers[branch]
+
+    def owner(self, what, sql, params, branch=None):
+        """The branch whose shard holds a record: the one given, else the only shard where sql finds it"""
+        if branch is not None:
+            return self.check([branch])[0]
+        found = list(dict.fromkeys(row[0] for row in self.lookup(sql, params)))
+        if not found:
+            raise NotFoundError(f"No branch has {what}")
+        if len(found) > 1:
+            raise ValidationError(f"{what.capitalize()} is at more than one branch ({', '.join(found)}); "
+                                  "name the branch")
+        return found[0]
+
+    def home_member(self, email, branch=None):
+        """(branch, service, member_id) of the member registered with this email"""
+        email = email.strip()
+        branch = self.owner(f"a member with email {email}", MEMBER_SQL, (email,), branch)
+        service = self.shard(branch)
+        member = service.find_member_by_email(email)
+        if member is None:
+            raise NotFoundError(f"No member has email {email} at {branch}")
+        return branch, service, member[0]
+
+    # Writes, routed to the owning shard
+
+    def add_book(self, branch, title, author, isbn, quantity):
+        """Add copies of a title to a branch's stock and return the book id in that shard"""
+        return self.shard(branch).add_book(title, author, isbn, quantity)
+
+    def add_member(self, branch, name, email, phone=''):
+        """Register a member at their home branch and return the member id in that shard"""
+        return self.shard(branch).add_member(name, email, phone)
+
+    def issue_copy(self, email, barcode, branch=None):
+        """Issue a copy at the branch that owns it, to a member registered there; return (branch, loan id, due)"""
+        barcode = barcode.strip()
+        branch = self.owner(f"copy {barcode}", COPY_SQL, (barcode,), branch)
+        branch, service, member_id = self.home_member(email, branch)
+        return (branch, *service.issue_copy(member_id, barcode))
+
+    def issue_book(self, email, isbn, branch=None):
+        """Issue a title from the member's home branch shelf; return (branch, loan id, due)"""
+        branch, service, member_id = self.home_member(email, branch)
+        book = service.find_book_by_isbn(isbn)
+        if book is None:
+            raise NotFoundError(f"{branch} does not stock ISBN {isbn.strip()}")
+        return (branch, *service.issue_book(member_id, book[0]))
+
+    def return_copy(self, barcode, branch=None):
+        """Return a copy to the branch whose loan it is on; return (branch, book id)"""
+        barcode = barcode.strip()
+        branch = self.owner(f"copy {barcode} on loan", LOANED_COPY_SQL, (barcode,), branch)
+        return branch, self.shard(branch).return_copy(barcode)
+
+    def return_book(self, issue_id, branch=None):
+        """Return an active loan to the branch that issued it; see LibraryService.return_book"""
+        branch = self.owner(f"active loan {issue_id}", ACTIVE_LOAN_SQL, (issue_id,), branch)
+        return self.shard(branch).return_book(issue_id)
+
+    def place_hold(self, email, isbn, branch=None):
+        """Queue the member for a title at their home branch; see LibraryService.place_hold"""
+        branch, service, member_id = self.home_member(email, branch)
+        book = service.find_book_by_isbn(isbn)
+        if book is None:
+            raise NotFoundError(f"{branch} does not stock ISBN {isbn.strip()}")
+        return service.place_hold(member_id, book[0])
+
+    # Federated reads
+
+    def read(self, func):
+        return func(self.local.service)
+
+    def fan_out(self, func, branches=None, parallel=True):
+        """Run func(service) on the reader of every branch (or the given ones); return {branch: result}.
+
+        The shards work at the same time, so a fan-out takes about as long
+        as its slowest shard. With parallel false each shard starts only when
+        the one before has answered, the baseline the benchmark compares.
+        """
+        branches = self.check(branches)
+        if not parallel:
+            return {branch: self.readers[branch].submit(self.read, func).result() for branch in branches}
+        futures = {branch: self.readers[branch].submit(self.read, func) for branch in branches}
+        return {branch: future.result() for branch, future in futures.items()}
+
+    def attach(self):
+        """A connection with every shard ATTACHed read-only as b0, b1, ..."""
+        if self.attached is None:
+            if len(self.branches) > ATTACH_LIMIT:
+                raise ValueError(f"SQLite can attach at most {ATTACH_LIMIT} shards to one connection")
+            conn = sqlite3.connect(':memory:', uri=True, check_same_thread=False)
+            for index, path in enumerate(self.branches.values()):
+                conn.execute(f"ATTACH DATABASE ? AS b{index}",
+                             (f"file:{pathname2url(os.path.abspath(path))}?mode=ro",))
+            self.attached = conn
+        return self.attached
+
+    def union_all(self, sql, params=(), branches=None):
+        """Run sql against every shard as one UNION ALL statement; return (branch, *row) rows.
+
+        sql refers to its tables as {db}.table and is repeated per shard with
+        the same params. The statement reads all shards in one pass on the
+        calling thread.
+        """
+        branches = self.check(branches)
+        schemas = {branch: f"b{index}" for index, branch in enumerate(self.branches)}
+        query = ' UNION ALL '.join(f"SELECT ?, * FROM ({sql.format(db=schemas[branch])})" for branch in branches)
+        with self.attach_lock:
+            return self.attach().execute(query, [value for branch in branches for value in (branch, *params)]).fetchall()
+
+    def lookup(self, sql, params=()):
+        """Run a point query on every shard and return (branch, *row) rows in branch order.
+
+        While the shards fit ATTACH_LIMIT this is one UNION ALL; beyond it the
+        query fans out to the readers.
+        """
+        if len(self.branches) <= ATTACH_LIMIT:
+            return self.union_all(sql, params)
+        results = self.fan_out(lambda service: service.conn.execute(sql.format(db='main'), params).fetchall())
+        return [(branch, *row) for branch, rows in results.items() for row in rows]
+
+    def locate(self, isbn):
+        """Which branches stock a title: (branch, book_id, title, quantity, available), in branch order"""
+        return self.lookup(LOCATE_SQL, (isbn.strip(),))
+
+    def search_books(self, text, limit=SEARCH_LIMIT, available_only=False):
+        """Search every branch's catalog at once and return the best (branch, *book) rows.
+
+        Each shard ranks its own matches by bm25 and the ranked lists are
+        merged, so the order is exact when the branches' catalogs are alike
+        and close otherwise (bm25 weighs words by how rare they are per shard).
+        """
+        results = self.fan_out(lambda service: service.search_books(text, limit, available_only, scored=True))
+        merged = heapq.merge(*([(row[0], branch, row[1:]) for row in rows] for branch, rows in results.items()))
+        return [(branch, *book) for score, branch, book in islice(merged, limit)]
+
+    def report_rows(self, name, branches=None, **filters):
+        """Stream a named report from every branch, each row prefixed with its branch.
+
+        The shards run the report in parallel on their readers and hand rows
+        over in batches through small bounded queues, so memory stays flat
+        however large the report. The shards' streams are merged on the
+        report's sort order, so the consolidated rows come in the same order
+        as a single library's report.
+        """
+        if name not in REPORTS:
+            raise NotFoundError(f"Unknown report: {name}")
+        branches = self.check(branches)
+        if name in FINES_REPORTS:
+            # The readers only read, so each shard's writer brings its fines up to date first
+            for branch in branches:
+                self.shard(branch).refresh_fines()
+        batches = {branch: queue.Queue(maxsize=4) for branch in branches}
+        cancelled = threading.Event()
+
+        def produce(branch, service):
+            try:
+                batch = []
+                for row in service.report_rows(name, **filters):
+                    if cancelled.is_set():
+                        return
+                    batch.append((branch, *row))
+                    if len(batch) >= REPORT_BATCH:
+                        batches[branch].put(batch)
+                        batch = []
+                batches[branch].put(batch)
+            finally:
+                batches[branch].put(None)
+
+        producers = {branch: self.readers[branch].submit(self.read, lambda service, branch=branch: produce(branch, service))
+                     for branch in branches}
+        def consume(branch):
+            while (batch := batches[branch].get()) is not None:
+                yield from batch
+            producers[branch].result()
+
+        sort_key = REPORTS[name].sort_key
+        try:
+            yield from heapq.merge(*(consume(branch) for branch in branches), key=lambda row: sort_key(row[1:]))
+        finally:
+            cancelled.set()
+            for branch in branches:
+                while not producers[branch].done():
+                    try:
+                        batches[branch].get(timeout=0.01)
+                    except queue.Empty:
+                        pass
+
+
+if __name__ == "__main__":
+    # Only the bench command needs the data generator; desks importing this module never load it
+    from lms_bench import SIZES, bench_fanout
+
+    parser = argparse.ArgumentParser(description="Query every branch of a sharded library, or benchmark the fan-out")
+    parser.add_argument('--branches', default=BRANCHES_FILE, help="JSON file mapping branch names to databases")
+    commands = parser.add_subparsers(dest='command', required=True)
+    locate = commands.add_parser('locate', help="list the branches that stock an ISBN")
+    locate.add_argument('isbn')
+    search = commands.add_parser('search', help="search every branch's catalog")
+    search.add_argument('text')
+    search.add_argument('--available', action='store_true', help="only titles with a copy on the shelf")
+    search.add_argument('--limit', type=int, default=SEARCH_LIMIT)
+    report = commands.add_parser('report', help="print a report consolidated over every branch")
+    report.add_argument('name', choices=sorted(REPORTS))
+    report.add_argument('--from', dest='date_from')
+    report.add_argument('--to', dest='date_to')
+    bench = commands.add_parser('bench', help="time fan-out reads as the number of shards grows")
+    bench.add_argument('--size', choices=sorted(SIZES), default='tiny', help="size of each shard")
+    bench.add_argument('--shards', default='1,2,4,8,16', help="comma-separated shard counts")
+    bench.add_argument('--dir', default='bench_shards', help="where the generated shards are kept")
+    bench.add_argument('--repeat', type=int, default=20)
+    bench.add_argument('--out', help="write results JSON here")
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        results = bench_fanout(args.dir, args.size, [int(count) for count in args.shards.split(',')], args.repeat)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(json.dumps(results, indent=2) + '\n')
+            print(f"results written to {args.out}")
+    else:
+        library = BranchLibrary.open(args.branches)
+        try:
+            if args.command == 'locate':
+                for branch, book_id, title, quantity, available in library.locate(args.isbn):
+                    print(f"{branch:<15} #{book_id:<8} {available} of {quantity} on the shelf  {title}")
+            elif args.command == 'search':
+                for branch, book_id, title, author, isbn, quantity, available, *rest in library.search_books(
+                        args.text, args.limit, args.available):
+                    print(f"{branch:<15} {isbn:<15} {available}/{quantity}  {title} - {author}")
+            else:
+                report = REPORTS[args.name]
+                title, rule, header, underline = report.format_header()
+                print(f"{title}\n{rule}\n{'Branch':<15} {header}\n{'-' * (16 + len(header))}")
+                filters = {key: getattr(args, key) for key in FILTERS if getattr(args, key, None)}
+                for branch, *row in library.report_rows(args.name, **filters):
+                    print(f"{branch:<15} {report.format_row(row)}")
+        finally:
+            library.close()
@@ -0,0 +1,267 @@
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from bisect import bisect_left
+
+from lms_db import DB_PATH, connect_database
+
+
+class BookRecord:
+    __slots__ = ('id', 'title', 'author', 'isbn', 'quantity', 'on_loan', 'on_hold')
+
+    def __init__(self, id, title, author, isbn, quantity):
+        self.id = id
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.quantity = quantity
+        self.on_loan = 0
+        self.on_hold = 0
+
+    @property
+    def available(self):
+        return self.quantity - self.on_loan - self.on_hold
+
+
+class MemberRecord:
+    __slots__ = ('id', 'name', 'email')
+
+    def __init__(self, id, name, email):
+        self.id = id
+        self.name = name
+        self.email = email
+
+
+class LoanRecord:
+    __slots__ = ('id', 'book_id', 'member_id', 'due_date')
+
+    def __init__(self, id, book_id, member_id, due_date):
+        self.id = id
+        self.book_id = book_id
+        self.member_id = member_id
+        self.due_date = due_date
+
+
+class CatalogCache:
+    """In-process copy of the books, members and active loans a desk looks up.
+
+    Books and members are reloaded only when their counter in table_versions
+    moves, which happens on catalog edits but not on circulation. Active loans
+    and ready holds follow the circulation log instead: after any change to
+    the database, detected through ``PRAGMA data_version`` (commits on other
+    connections) and ``total_changes`` (writes on this one), only the loans
+    and holds logged since the last lookup are re-read. Book availability is
+    derived from them, with the ids of books that have a copy on the shelf
+    kept sorted in ``shelf``. Every lookup checks the counters first, so it
+    never returns data older than the last commit.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.versions = {}
+        self.books = {}
+        self.books_by_isbn = {}
+        self.shelf = []
+        self.members = {}
+        self.members_by_email = {}
+        self.loans = {}
+        self.holds = {}
+        self.log_seq = 0
+
+    def refresh(self):
+        """Reload whatever changed since the last lookup"""
+        change = (self.conn.execute("PRAGMA data_version").fetchone()[0], self.conn.total_changes)
+        if change == self.versions.get('change'):
+            return
+
+        # Read everything from one snapshot so loans match the books they count
+        snapshot = not self.conn.in_transaction
+        if snapshot:
+            self.conn.execute("BEGIN")
+        try:
+            versions = dict(self.conn.execute("SELECT name, version FROM table_versions"))
+            if versions['members'] != self.versions.get('members'):
+                self.load_members()
+            if versions['books'] != self.versions.get('books'):
+                self.load_books()
+                self.load_loans()
+            else:
+                self.apply_circulation_log()
+        finally:
+            if snapshot:
+                self.conn.execute("COMMIT")
+        self.versions = dict(versions, change=change)
+
+    def invalidate(self):
+        self.versions = {}
+
+    def load_books(self):
+        intern = sys.intern
+        self.books = {row[0]: BookRecord(row[0], row[1], intern(row[2]), row[3], row[4]) for row in self.conn.execute(
+            "SELECT id, title, author, isbn, quantity FROM books ORDER BY id"
+        )}
+        self.books_by_isbn = {book.isbn: book for book in self.books.values()}
+        self.shelf = [book.id for book in self.books.values() if book.quantity > 0]
+        self.loans = {}
+        self.holds = {}
+
+    def load_members(self):
+        self.members = {row[0]: MemberRecord(*row) for row in self.conn.execute(
+            "SELECT id, name, email FROM members ORDER BY id"
+        )}
+        self.members_by_email = {member.email: member for member in self.members.values()}
+
+    def load_loans(self):
+        for book in self.books.values():
+            book.on_loan = book.on_hold = 0
+        self.log_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM circulation_log").fetchone()[0]
+
+        intern = sys.intern
+        self.loans = {row[0]: LoanRecord(row[0], row[1], row[2], intern(row[3])) for row in self.conn.execute(
+            "SELECT id, book_id, member_id, due_date FROM issued_books WHERE return_date IS NULL ORDER BY id"
+        )}
+        for loan in self.loans.values():
+            book = self.books.get(loan.book_id)
+            if book is not None:
+                book.on_loan += 1
+
+        # Copies set aside on the pickup shelf, as {hold id: book id}
+        self.holds = dict(self.conn.execute("SELECT id, book_id FROM holds WHERE status = 'ready'"))
+        for book_id in self.holds.values():
+            book = self.books.get(book_id)
+            if book is not None:
+                book.on_hold += 1
+
+        self.shelf = [book.id for book in self.books.values() if book.available > 0]
+
+    def apply_circulation_log(self):
+        """Re-read only the loans and holds logged since the last lookup"""
+        changes = self.conn.execute(
+            "SELECT seq, kind, row_id FROM circulation_log WHERE seq > ? ORDER BY seq", (self.log_seq,)
+        ).fetchall()
+        if not changes:
+            return
+        if changes[0][0] != self.log_seq + 1:
+            # The log was pruned past the last change this cache saw
+            self.load_loans()
+            return
+        self.log_seq = changes[-1][0]
+
+        loan_ids = list({row_id for seq, kind, row_id in changes if kind == 'loan'})
+        hold_ids = list({row_id for seq, kind, row_id in changes if kind == 'hold'})
+        touched = {}
+
+        def count(book_id, field, delta):
+            book = self.books.get(book_id)
+            if book is not None:
+                setattr(book, field, getattr(book, field) + delta)
+                touched[book_id] = book
+
+        for loan_id in loan_ids:
+            loan = self.loans.pop(loan_id, None)
+            if loan is not None:
+                count(loan.book_id, 'on_loan', -1)
+        for row in self.conn.execute('''
+            SELECT id, book_id, member_id, due_date FROM issued_books
+            WHERE id IN (SELECT value FROM json_each(?)) AND return_date IS NULL
+        ''', (json.dumps(loan_ids),)):
+            self.loans[row[0]] = LoanRecord(row[0], row[1], row[2], sys.intern(row[3]))
+            count(row[1], 'on_loan', 1)
+
+        for hold_id in hold_ids:
+            book_id = self.holds.pop(hold_id, None)
+            if book_id is not None:
+                count(book_id, 'on_hold', -1)
+        for hold_id, book_id in self.conn.execute(
+            "SELECT id, book_id FROM holds WHERE id IN (SELECT value FROM json_each(?)) AND status = 'ready'",
+            (json.dumps(hold_ids),)
+        ):
+            self.holds[hold_id] = book_id
+            count(book_id, 'on_hold', 1)
+
+        for book in touched.values():
+            self.reshelve(book)
+
+    def reshelve(self, book):
+        """Add a book to the shelf index or take it off, as its availability says"""
+        i = bisect_left(self.shelf, book.id)
+        listed = i < len(self.shelf) and self.shelf[i] == book.id
+        if book.available > 0 and not listed:
+            self.shelf.insert(i, book.id)
+        elif book.available <= 0 and listed:
+            del self.shelf[i]
+
+    # Lookups
+
+    def book(self, book_id):
+        self.refresh()
+        return self.books.get(book_id)
+
+    def book_by_isbn(self, isbn):
+        self.refresh()
+        return self.books_by_isbn.get(isbn)
+
+    def member(self, member_id):
+        self.refresh()
+        return self.members.get(member_id)
+
+    def member_by_email(self, email):
+        self.refresh()
+        return self.members_by_email.get(email)
+
+    def available_books(self, limit=-1):
+        """Return books with a copy on the shelf in id order"""
+        self.refresh()
+        return [self.books[book_id] for book_id in (self.shelf[:limit] if limit >= 0 else self.shelf)]
+
+    def all_members(self):
+        self.refresh()
+        return list(self.members.values())
+
+    def active_loans(self):
+        """Return (loan, book, member) for every active loan"""
+        self.refresh()
+        return [(loan, self.books.get(loan.book_id), self.members.get(loan.member_id))
+                for loan in self.loans.values()]
+
+
+def measure_memory(path):
+    """Load the cache section by section and report time and bytes per 100k records"""
+    conn = connect_database(path)
+    sections = ('books', 'members', 'loans')
+    results = {section: {} for section in sections}
+
+    # Time without tracing, then trace a fresh cache so nothing is shared
+    cache = CatalogCache(conn)
+    for section in sections:
+        started = time.perf_counter()
+        getattr(cache, f'load_{section}')()
+        results[section]['load_s'] = round(time.perf_counter() - started, 3)
+    del cache
+    gc.collect()
+
+    cache = CatalogCache(conn)
+    for section in sections:
+        tracemalloc.start()
+        getattr(cache, f'load_{section}')()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        count = len(getattr(cache, section))
+        results[section]['records'] = count
+        results[section]['mb_per_100k'] = round(size / count * 100000 / 2 ** 20, 1) if count else None
+
+    conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the catalog cache's load time and memory use")
+    parser.add_argument('db', nargs='?', default=DB_PATH)
+    args = parser.parse_args()
+
+    for section, stats in measure_memory(args.db).items():
+        print(f"{section:<8} {stats['records']:>9} records  {stats['load_s']:>7.3f}s  "
+              f"{stats['mb_per_100k']} MB per 100k records")
@@ -0,0 +1,225 @@
+import http.client
+import json
+import select
+from urllib.parse import urlencode, urlsplit
+
+import lms_service
+from lms_reports import REPORTS, write_report
+from lms_service import LibraryError, SEARCH_LIMIT
+
+TIMEOUT = 30
+
+# Methods the client may resend after losing the connection mid-request
+IDEMPOTENT_METHODS = ('GET', 'DELETE')
+
+
+class RemoteLibraryService:
+    """LibraryService look-alike that talks to lms_server over HTTP.
+
+    Each instance keeps one keep-alive connection, so use one per thread.
+    Server errors are raised as the same LibraryError subclasses the local
+    service raises.
+    """
+
+    def __init__(self, url, timeout=TIMEOUT):
+        parts = urlsplit(url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def interrupt(self):
+        """Requests cannot be aborted midway; the worker just drops the result"""
+
+    def stale(self):
+        """Whether the server has closed the idle keep-alive connection (it is readable before any request)"""
+        return bool(select.select([self.connection.sock], [], [], 0)[0])
+
+    def request(self, method, path, params=None, body=None, stream=False):
+        if params:
+            path = f"{path}?{urlencode({k: v for k, v in params.items() if v not in (None, '')})}"
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload else {}
+
+        for attempt in (1, 2):
+            if self.connection is not None and self.connection.sock is not None and self.stale():
+                self.close()
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, payload, headers)
+            except (BrokenPipeError, ConnectionResetError):
+                # The server closed the connection before taking the request, so any method can be resent
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            except OSError as e:
+                self.close()
+                raise LibraryError(f"Cannot reach library server at {self.host}:{self.port}: {e}") from None
+            try:
+                response = self.connection.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError):
+                # The request was sent: only a read can be safely repeated
+                self.close()
+                if method not in IDEMPOTENT_METHODS:
+                    raise LibraryError(f"Lost the connection to {self.host}:{self.port} during {method} {path}; "
+                                       "it may or may not have been applied") from None
+                if attempt == 2:
+                    raise
+
+        if response.status >= 400:
+            error = json.loads(response.read() or b'{}')
+            cls = getattr(lms_service, error.get('type', ''), None)
+            if not (isinstance(cls, type) and issubclass(cls, LibraryError)):
+                cls = LibraryError
+            raise cls(error.get('error', f"Server error {response.status}"))
+        if stream:
+            return response
+        return json.loads(response.read())
+
+    def stats(self):
+        return self.request('GET', '/stats')
+
+    # Books
+
+    def add_book(self, title, author, isbn, quantity):
+        data = {'title': title, 'author': author, 'isbn': isbn, 'quantity': quantity}
+        return self.request('POST', '/books', body=data)['id']
+
+    def import_catalog(self, path, **options):
+        raise LibraryError("Catalog import has to run on the server (python lms_import.py)")
+
+    def book_has_active_loans(self, book_id):
+        return self.request('GET', f'/books/{book_id}/active')['active']
+
+    def delete_book(self, book_id):
+        self.request('DELETE', f'/books/{book_id}')
+
+    def get_book(self, book_id):
+        return self.request('GET', f'/books/{book_id}')
+
+    def books_page(self, after_id, limit):
+        return self.request('GET', '/books', {'after_id': after_id, 'limit': limit})
+
+    def available_books(self, limit=-1):
+        return self.request('GET', '/books/available', {'limit': limit})
+
+    def find_book_by_isbn(self, isbn):
+        return self.request('GET', '/books/lookup', {'isbn': isbn})
+
+    def search_books(self, text, limit=SEARCH_LIMIT, available_only=False):
+        return self.request('GET', '/books/search', {'q': text, 'limit': limit, 'available': int(available_only)})
+
+    # Members
+
+    def add_member(self, name, email, phone=''):
+        data = {'name': name, 'email': email, 'phone': phone}
+        return self.request('POST', '/members', body=data)['id']
+
+    def find_member_by_email(self, email):
+        return self.request('GET', '/members/lookup', {'email': email})
+
+    def member_has_active_loans(self, member_id):
+        return self.request('GET', f'/members/{member_id}/active')['active']
+
+    def delete_member(self, member_id):
+        self.request('DELETE', f'/members/{member_id}')
+
+    def get_member(self, member_id):
+        return self.request('GET', f'/members/{member_id}')
+
+    def members_page(self, after_id, limit):
+        return self.request('GET', '/members', {'after_id': after_id, 'limit': limit})
+
+    def member_choices(self):
+        return self.request('GET', '/members/choices')
+
+    # Circulation
+
+    def issue_book(self, member_id, book_id):
+        data = self.request('POST', '/loans', body={'member_id': member_id, 'book_id': book_id})
+        return data['id'], data['due_date']
+
+    def return_book(self, issue_id):
+        return self.request('POST', f'/loans/{issue_id}/return')['book_id']
+
+    def issue_books(self, member_id, codes):
+        data = {'member_id': member_id, 'codes': list(codes)}
+        return [tuple(result) for result in self.request('POST', '/loans/batch', body=data)]
+
+    def return_books(self, codes):
+        return [tuple(result) for result in self.request('POST', '/loans/batch/return', body={'codes': list(codes)})]
+
+    def get_issued(self, issue_id):
+        return self.request('GET', f'/loans/{issue_id}')
+
+    def issued_page(self, after_id, limit):
+        return self.request('GET', '/loans', {'after_id': after_id, 'limit': limit})
+
+    def active_loans(self):
+        return self.request('GET', '/loans/active')
+
+    def issue_copy(self, member_id, barcode):
+        data = self.request('POST', '/items/issue', body={'member_id': member_id, 'barcode': barcode})
+        return data['id'], data['due_date']
+
+    def return_copy(self, barcode):
+        return self.request('POST', '/items/return', body={'barcode': barcode})['book_id']
+
+    # Copies
+
+    def book_items(self, book_id):
+        return self.request('GET', f'/books/{book_id}/items')
+
+    def move_item(self, barcode, location):
+        self.request('POST', '/items/move', body={'barcode': barcode, 'location': location})
+
+    def items_at(self, location):
+        return self.request('GET', '/items', {'location': location})
+
+    # Holds
+
+    def place_hold(self, member_id, book_id):
+        data = self.request('POST', '/holds', body={'member_id': member_id, 'book_id': book_id})
+        return data['id'], data['place']
+
+    def cancel_hold(self, hold_id):
+        self.request('DELETE', f'/holds/{hold_id}')
+
+    def open_holds(self, member_id=None):
+        return self.request('GET', '/holds', {'member_id': member_id})
+
+    # Reports
+
+    def update_fines(self, today=None):
+        return self.request('POST', '/jobs/fines', body={'today': today})
+
+    def refresh_fines(self, today=None):
+        """The server brings the fines up to date before serving a fines report"""
+
+    def expire_holds(self, today=None):
+        return self.request('POST', '/jobs/holds', body={'today': today})
+
+    def take_snapshot(self):
+        return self.request('POST', '/jobs/snapshot')
+
+    def report_rows(self, name, snapshot=False, **filters):
+        """Stream report rows from the server's NDJSON response"""
+        response = self.request('GET', f'/reports/{name}', dict(filters, snapshot=1 if snapshot else None), stream=True)
+        try:
+            for line in response:
+                yield tuple(json.loads(line))
+        finally:
+            # Drop the connection if the report was abandoned midway
+            if not response.isclosed():
+                self.close()
+
+    def export_report(self, name, path, fmt='csv', snapshot=False, **filters):
+        return write_report(self.report_rows(name, snapshot, **filters), REPORTS[name].keys, path, fmt)
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from lms_analytics import verify_rollups
+from lms_bench import SIZES, generate_library
+from lms_db import DEFAULT_DURABILITY, DURABILITY, connect_database
+from lms_service import LibraryError, LibraryService
+from lms_worker import GroupCommitWriter
+
+ROUNDS = 5
+DESKS = 8
+GROUP_COMMIT_MS = 0.0
+MIN_RUN_S = 0.3
+MAX_RUN_S = 1.5
+
+LOAN_ID = re.compile(r'loan (\d+)')
+
+
+def run_desks(path, durability, group_commit_ms, desks, seed):
+    """Child process: simulated desks issuing and returning until killed.
+
+    Writes go through a GroupCommitWriter as on the server, and each desk
+    prints a line for every loan issued or returned once its write has been
+    acknowledged, i.e. committed.
+    """
+    writer = GroupCommitWriter(lambda: LibraryService.open(path, durability), group_commit_ms)
+    books, members = writer.submit(lambda service: (service.stats()['max_book_id'],
+                                                    service.stats()['max_member_id'])).result()
+    lock = threading.Lock()
+
+    def acknowledge(action, loan_ids):
+        # One write per acknowledgement, so a kill can only cut off the last line
+        with lock:
+            sys.stdout.write(''.join(f"{action} {loan_id}\n" for loan_id in loan_ids))
+            sys.stdout.flush()
+
+    def desk(number):
+        rng = random.Random(seed * 1000 + number)
+        loans = []
+        while True:
+            member_id, choice = rng.randint(1, members), rng.random()
+            try:
+                if loans and choice < 0.4:
+                    loan_id = loans.pop(rng.randrange(len(loans)))
+                    writer.submit(lambda service: service.return_book(loan_id)).result()
+                    acknowledge('returned', [loan_id])
+                elif loans and choice < 0.5:
+                    batch, loans = loans[:3], loans[3:]
+                    results = writer.submit(lambda service: service.return_books([str(i) for i in batch])).result()
+                    acknowledge('returned', [int(LOAN_ID.search(message)[1]) for code, ok, message in results if ok])
+                elif choice < 0.55:
+                    writer.submit(lambda service: service.place_hold(member_id, rng.randint(1, books))).result()
+                elif choice < 0.6:
+                    # Two titles by ISBN and one specific copy by barcode
+                    codes = [f"978{rng.randint(0, books - 1):010d}" for _ in range(3)]
+                    codes[2] += '-1'
+                    results = writer.submit(lambda service: service.issue_books(member_id, codes)).result()
+                    issued = [int(LOAN_ID.search(message)[1]) for code, ok, message in results if ok]
+                    loans.extend(issued)
+                    acknowledge('issued', issued)
+                elif choice < 0.7:
+                    barcode = f"978{rng.randint(0, books - 1):010d}-1"
+                    issue_id, due_date = writer.submit(lambda service: service.issue_copy(member_id, barcode)).result()
+                    loans.append(issue_id)
+                    acknowledge('issued', [issue_id])
+                else:
+                    book_id = rng.randint(1, books)
+                    issue_id, due_date = writer.submit(lambda service: service.issue_book(member_id, book_id)).result()
+                    loans.append(issue_id)
+                    acknowledge('issued', [issue_id])
+            except LibraryError:
+                pass
+
+    for number in range(desks):
+        threading.Thread(target=desk, args=(number,), daemon=True).start()
+    threading.Event().wait()
+
+
+def check_consistency(path, issued, returned):
+    """Return a list of problems found in the database after a crash"""
+    conn = connect_database(path)
+    try:
+        problems = []
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != 'ok':
+            problems.append(f"integrity_check: {result}")
+
+        for row in conn.execute('''
+            SELECT id, quantity, available,
+                   (SELECT COUNT(*) FROM issued_books WHERE book_id = b.id AND return_date IS NULL),
+                   (SELECT COUNT(*) FROM holds WHERE book_id = b.id AND status = 'ready'),
+                   (SELECT COUNT(*) FROM holds WHERE book_id = b.id AND status = 'waiting')
+            FROM books b
+        '''):
+            book_id, quantity, available, active, ready, waiting = row
+            if available != quantity - active - ready or not 0 <= available <= quantity:
+                problems.append(f"book {book_id}: available {available}, quantity {quantity}, "
+                                f"{active} on loan, {ready} held for pickup")
+            if available and waiting:
+                problems.append(f"book {book_id}: {available} on the shelf while {waiting} holds wait")
+
+        for book_id, quantity, available, copies, shelved in conn.execute('''
+            SELECT b.id, b.quantity, b.available, COUNT(i.id), TOTAL(i.status = 'available')
+            FROM books b LEFT JOIN items i ON i.book_id = b.id
+            GROUP BY b.id
+        '''):
+            if quantity != copies or available != shelved:
+                problems.append(f"book {book_id}: quantity {quantity} and available {available}, "
+                                f"but {copies} copies with {int(shelved)} on the shelf")
+
+        loans_off_loan, stray_on_loan, holds_off_hold, stray_on_hold = conn.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM issued_books ib LEFT JOIN items i ON i.id = ib.item_id
+                 WHERE ib.return_date IS NULL AND i.status IS NOT 'on_loan'),
+                (SELECT COUNT(*) FROM items i WHERE i.status = 'on_loan' AND NOT EXISTS (
+                    SELECT 1 FROM issued_books WHERE item_id = i.id AND return_date IS NULL)),
+                (SELECT COUNT(*) FROM holds h LEFT JOIN items i ON i.id = h.item_id
+                 WHERE h.status = 'ready' AND i.status IS NOT 'on_hold'),
+                (SELECT COUNT(*) FROM items i WHERE i.status = 'on_hold' AND NOT EXISTS (
+                    SELECT 1 FROM holds WHERE item_id = i.id AND status = 'ready'))
+        ''').fetchone()
+        if loans_off_loan or stray_on_loan:
+            problems.append(f"{loans_off_loan} active loans without a copy on loan, "
+                            f"{stray_on_loan} copies on loan without an active loan")
+        if holds_off_hold or stray_on_hold:
+            problems.append(f"{holds_off_hold} ready holds without a copy set aside, "
+                            f"{stray_on_hold} copies set aside without a ready hold")
+
+        for member_id, counter, active in conn.execute('''
+            SELECT id, active_loans,
+                   (SELECT COUNT(*) FROM issued_books WHERE member_id = m.id AND return_date IS NULL)
+            FROM members m
+        '''):
+            if counter != active:
+                problems.append(f"member {member_id}: active_loans {counter}, {active} on loan")
+
+        for table, (stale, missing) in verify_rollups(conn).items():
+            if stale or missing:
+                problems.append(f"{table}: {stale} stale and {missing} missing rollup rows")
+
+        found = {loan_id: return_date for loan_id, return_date in conn.execute(
+            "SELECT id, return_date FROM issued_books WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(sorted(issued | returned)),)
+        )}
+        lost_issues = [loan_id for loan_id in issued if loan_id not in found]
+        lost_returns = [loan_id for loan_id in returned if found.get(loan_id) is None]
+        if lost_issues:
+            problems.append(f"{len(lost_issues)} acknowledged loans missing, e.g. {lost_issues[:5]}")
+        if lost_returns:
+            problems.append(f"{len(lost_returns)} acknowledged returns missing, e.g. {lost_returns[:5]}")
+        return problems
+    finally:
+        conn.close()
+
+
+def crash_round(path, durability, group_commit_ms, desks, seed, rng):
+    """Run the desks in a child process, SIGKILL it mid-load and check the database"""
+    command = [sys.executable, __file__, '--child', path, '--durability', durability,
+               '--desks', str(desks), '--seed', str(seed)]
+    if group_commit_ms is not None:
+        command += ['--grouped', '--group-commit-ms', str(group_commit_ms)]
+    child = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+
+    acknowledged = {'issued': set(), 'returned': set()}
+    started = threading.Event()
+
+    def read_acks():
+        for line in child.stdout:
+            if not line.endswith('\n'):
+                break
+            action, loan_id = line.split()
+            acknowledged[action].add(int(loan_id))
+            started.set()
+
+    reader = threading.Thread(target=read_acks, daemon=True)
+    reader.start()
+    if not started.wait(timeout=30):
+        child.kill()
+        raise RuntimeError("the desks never got going")
+    run_s = rng.uniform(MIN_RUN_S, MAX_RUN_S)
+    time.sleep(run_s)
+    child.kill()
+    child.wait()
+    reader.join()
+
+    writes = len(acknowledged['issued']) + len(acknowledged['returned'])
+    return writes / run_s, check_consistency(path, acknowledged['issued'], acknowledged['returned'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Crash-consistency check: kill circulation mid-batch and verify the counters and committed writes")
+    parser.add_argument('--db', help="library to use (default: a fresh tiny synthetic library)")
+    parser.add_argument('--rounds', type=int, default=ROUNDS, help="kills per configuration")
+    parser.add_argument('--desks', type=int, default=DESKS)
+    parser.add_argument('--durability', choices=DURABILITY, action='append',
+                        help="mode(s) to test (default: all)")
+    parser.add_argument('--group-commit-ms', type=float, default=GROUP_COMMIT_MS,
+                        help="window for the group commit runs; each mode also runs without")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--child', metavar='DB', help=argparse.SUPPRESS)
+    parser.add_argument('--grouped', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_desks(args.child, (args.durability or [DEFAULT_DURABILITY])[0],
+                  args.group_commit_ms if args.grouped else None, args.desks, args.seed)
+
+    path = args.db
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='lms-crash-'), 'crash.db')
+        generate_library(path, *SIZES['tiny'], progress=lambda message: None)
+    rng = random.Random(args.seed)
+
+    failed = False
+    seed = args.seed
+    for durability in args.durability or list(DURABILITY):
+        for group_commit_ms in (None, args.group_commit_ms):
+            label = f"{durability}, " + ("no group commit" if group_commit_ms is None else f"group commit {group_commit_ms:g} ms")
+            rates, failures = [], 0
+            for _ in range(args.rounds):
+                seed += 1
+                rate, problems = crash_round(path, durability, group_commit_ms, args.desks, seed, rng)
+                rates.append(rate)
+                if problems:
+                    failures += 1
+                    print(f"FAIL  {label}, round seed {seed}:")
+                    for problem in problems[:20]:
+                        print(f"      {problem}")
+            failed = failed or failures > 0
+            print(f"{'FAIL' if failures else 'ok':<5} {label}: {args.rounds} kills, "
+                  f"~{sum(rates) / len(rates):.0f} acknowledged writes/s")
+
+    print(f"database: {path}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,736 @@
+import os
+import sqlite3
+import sys
+
+from lms_profile import connection_factory
+
+DB_PATH = 'library.db'
+
+# (journal_mode, synchronous) for each durability setting. 'rollback' is
+# SQLite's default journal: every commit syncs both the journal and the
+# database file. 'wal' appends to the write-ahead log and syncs it once per
+# commit. 'relaxed' leaves syncing to checkpoints: a power cut (not a crash)
+# may lose the last commits, but never leaves the database inconsistent.
+DURABILITY = {
+    'rollback': ('DELETE', 'FULL'),
+    'wal': ('WAL', 'FULL'),
+    'relaxed': ('WAL', 'NORMAL'),
+}
+DEFAULT_DURABILITY = 'wal'
+
+# Keep the books_fts index in step with books. Only changes to the indexed
+# columns fire the update trigger, so circulation never touches the index.
+BOOKS_FTS_TRIGGERS = '''
+    CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts (rowid, title, author, isbn) VALUES (new.id, new.title, new.author, new.isbn);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, author, isbn)
+        VALUES ('delete', old.id, old.title, old.author, old.isbn);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, isbn ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, author, isbn)
+        VALUES ('delete', old.id, old.title, old.author, old.isbn);
+        INSERT INTO books_fts (rowid, title, author, isbn) VALUES (new.id, new.title, new.author, new.isbn);
+    END;
+'''
+
+TABLE_VERSION_TRIGGERS = ''.join(f'''
+    CREATE TRIGGER IF NOT EXISTS {table}_version_insert AFTER INSERT ON {table} BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {table}_version_delete AFTER DELETE ON {table} BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {table}_version_update AFTER UPDATE OF {columns} ON {table} BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+    END;
+''' for table, columns in (('books', 'title, author, isbn, quantity'), ('members', 'name, email')))
+
+# Circulation rollups by day, book and member, kept current by triggers on
+# issued_books so every write path (single, batch, bulk load) updates them in
+# its own transaction. A loan counts as issued on its issue_date and as
+# returned on its return_date; loan_days sums the length of returned loans.
+# Every statement is an upsert, so the triggers may fire in any order.
+LOAN_STATS_ISSUE = '''
+        INSERT INTO stats_daily (day, issued) VALUES (new.issue_date, 1)
+        ON CONFLICT (day) DO UPDATE SET issued = issued + 1;
+        INSERT INTO stats_book (book_id, loans, last_issued) VALUES (new.book_id, 1, new.issue_date)
+        ON CONFLICT (book_id) DO UPDATE SET
+            loans = loans + 1, last_issued = MAX(COALESCE(last_issued, ''), excluded.last_issued);
+        INSERT INTO stats_member (member_id, loans, last_issued) VALUES (new.member_id, 1, new.issue_date)
+        ON CONFLICT (member_id) DO UPDATE SET
+            loans = loans + 1, last_issued = MAX(COALESCE(last_issued, ''), excluded.last_issued);
+'''
+
+LOAN_STATS_RETURN = ''.join(f'''
+        INSERT INTO stats_{table} ({key}, returned, returned_late, loan_days)
+        VALUES ({value}, 1, new.return_date > new.due_date,
+                CAST(julianday(new.return_date) - julianday(new.issue_date) AS INTEGER))
+        ON CONFLICT ({key}) DO UPDATE SET
+            returned = returned + 1,
+            returned_late = returned_late + excluded.returned_late,
+            loan_days = loan_days + excluded.loan_days;'''
+    for table, key, value in (('daily', 'day', 'new.return_date'), ('book', 'book_id', 'new.book_id'),
+                              ('member', 'member_id', 'new.member_id'))) + '\n'
+
+LOAN_STATS_TRIGGERS = f'''
+    CREATE TRIGGER IF NOT EXISTS loan_stats_issue AFTER INSERT ON issued_books BEGIN{LOAN_STATS_ISSUE}    END;
+
+    CREATE TRIGGER IF NOT EXISTS loan_stats_insert_returned AFTER INSERT ON issued_books
+    WHEN new.return_date IS NOT NULL BEGIN{LOAN_STATS_RETURN}    END;
+
+    CREATE TRIGGER IF NOT EXISTS loan_stats_return AFTER UPDATE OF return_date ON issued_books
+    WHEN old.return_date IS NULL AND new.return_date IS NOT NULL BEGIN{LOAN_STATS_RETURN}    END;
+'''
+
+# What each rollup table must contain, computed from the full loan history.
+# Used to fill the tables when they are created and by lms_analytics to
+# rebuild or verify them. Columns are in table order.
+LOAN_STATS = {
+    'stats_daily': '''
+        SELECT day, SUM(issued), SUM(returned), SUM(returned_late), SUM(loan_days)
+        FROM (
+            SELECT issue_date AS day, 1 AS issued, 0 AS returned, 0 AS returned_late, 0 AS loan_days
+            FROM loan_history
+            UNION ALL
+            SELECT return_date, 0, 1, return_date > due_date,
+                   CAST(julianday(return_date) - julianday(issue_date) AS INTEGER)
+            FROM loan_history
+            WHERE return_date IS NOT NULL
+        )
+        GROUP BY day
+    ''',
+    **{f'stats_{key}': f'''
+        SELECT {key}_id, COUNT(*), COUNT(return_date), COALESCE(SUM(return_date > due_date), 0),
+               COALESCE(SUM(CAST(julianday(return_date) - julianday(issue_date) AS INTEGER)), 0),
+               MAX(issue_date)
+        FROM loan_history
+        GROUP BY {key}_id
+    ''' for key in ('book', 'member')},
+}
+
+# books.quantity and books.available are cached counts of a title's items
+# (one row per physical copy) and of those on the shelf. Every insert,
+# delete or status change of an item adjusts them in the same statement, so
+# they cannot drift from the items whatever path writes them.
+ITEM_COUNT_TRIGGERS = '''
+    CREATE TRIGGER items_count_insert AFTER INSERT ON items BEGIN
+        UPDATE books SET quantity = quantity + 1, available = available + (new.status = 'available')
+        WHERE id = new.book_id;
+    END;
+
+    CREATE TRIGGER items_count_delete AFTER DELETE ON items BEGIN
+        UPDATE books SET quantity = quantity - 1, available = available - (old.status = 'available')
+        WHERE id = old.book_id;
+    END;
+
+    CREATE TRIGGER items_count_status AFTER UPDATE OF status ON items
+    WHEN (old.status = 'available') <> (new.status = 'available') BEGIN
+        UPDATE books SET available = available + (new.status = 'available') - (old.status = 'available')
+        WHERE id = new.book_id;
+    END;
+'''
+
+# Rows of the circulation log kept for caches catching up (lms_cache); a
+# cache that falls further behind reloads its loans and holds in full
+CIRCULATION_LOG_KEEP = 10000
+
+# The circulation log records which loans and ready holds changed, so a cache
+# can re-read just those rows. Only changes a cache can see are logged:
+# archiving returned loans or moving waiting holds in the queue is not.
+CIRCULATION_LOG_TRIGGERS = f'''
+    CREATE TRIGGER circulation_log_issue AFTER INSERT ON issued_books WHEN new.return_date IS NULL BEGIN
+        INSERT INTO circulation_log (kind, row_id) VALUES ('loan', new.id);
+    END;
+
+    CREATE TRIGGER circulation_log_return AFTER UPDATE OF return_date ON issued_books
+    WHEN old.return_date IS NULL BEGIN
+        INSERT INTO circulation_log (kind, row_id) VALUES ('loan', new.id);
+    END;
+
+    CREATE TRIGGER circulation_log_loan_delete AFTER DELETE ON issued_books WHEN old.return_date IS NULL BEGIN
+        INSERT INTO circulation_log (kind, row_id) VALUES ('loan', old.id);
+    END;
+
+    CREATE TRIGGER circulation_log_hold_insert AFTER INSERT ON holds WHEN new.status = 'ready' BEGIN
+        INSERT INTO circulation_log (kind, row_id) VALUES ('hold', new.id);
+    END;
+
+    CREATE TRIGGER circulation_log_hold_status AFTER UPDATE OF status ON holds
+    WHEN (old.status = 'ready') <> (new.status = 'ready') BEGIN
+        INSERT INTO circulation_log (kind, row_id) VALUES ('hold', new.id);
+    END;
+
+    CREATE TRIGGER circulation_log_hold_delete AFTER DELETE ON holds WHEN old.status = 'ready' BEGIN
+        INSERT INTO circulation_log (kind, row_id) VALUES ('hold', old.id);
+    END;
+
+    CREATE TRIGGER circulation_log_prune AFTER INSERT ON circulation_log BEGIN
+        DELETE FROM circulation_log WHERE seq <= new.seq - {CIRCULATION_LOG_KEEP};
+    END;
+'''
+
+# Each entry upgrades the schema by one version; PRAGMA user_version records
+# how many have been applied. Only ever append to this list.
+MIGRATIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        author TEXT NOT NULL,
+        isbn TEXT UNIQUE NOT NULL,
+        quantity INTEGER NOT NULL,
+        available INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS members (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        phone TEXT,
+        membership_date TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS issued_books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER NOT NULL,
+        member_id INTEGER NOT NULL,
+        issue_date TEXT NOT NULL,
+        due_date TEXT NOT NULL,
+        return_date TEXT,
+        FOREIGN KEY (book_id) REFERENCES books (id),
+        FOREIGN KEY (member_id) REFERENCES members (id)
+    );
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_issued_active_member
+        ON issued_books (member_id) WHERE return_date IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_issued_active_book
+        ON issued_books (book_id) WHERE return_date IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_issued_active_due
+        ON issued_books (due_date, book_id, member_id, issue_date) WHERE return_date IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_issued_active
+        ON issued_books (id, book_id, member_id, issue_date, due_date) WHERE return_date IS NULL;
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5 (
+        title, author, isbn,
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    ''' + BOOKS_FTS_TRIGGERS + '''
+    INSERT INTO books_fts (books_fts) VALUES ('rebuild');
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_issued_issue_date ON issued_books (issue_date);
+    CREATE INDEX IF NOT EXISTS idx_issued_member_date ON issued_books (member_id, issue_date);
+    CREATE INDEX IF NOT EXISTS idx_issued_book_date ON issued_books (book_id, issue_date);
+    ''',
+    # Counters maintained by circulation: members.active_loans and a checked
+    # books.available, both recomputed here from the loans table. books is
+    # rebuilt because SQLite cannot add CHECK constraints to an existing table.
+    '''
+    ALTER TABLE members ADD COLUMN active_loans INTEGER NOT NULL DEFAULT 0 CHECK (active_loans >= 0);
+
+    UPDATE members SET active_loans = (
+        SELECT COUNT(*) FROM issued_books WHERE member_id = members.id AND return_date IS NULL
+    );
+
+    CREATE TABLE books_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        author TEXT NOT NULL,
+        isbn TEXT UNIQUE NOT NULL,
+        quantity INTEGER NOT NULL CHECK (quantity >= 0),
+        available INTEGER NOT NULL CHECK (available >= 0 AND available <= quantity)
+    );
+
+    INSERT INTO books_new (id, title, author, isbn, quantity, available)
+    SELECT id, title, author, isbn, quantity, MAX(0, quantity - (
+        SELECT COUNT(*) FROM issued_books WHERE book_id = books.id AND return_date IS NULL
+    ))
+    FROM books;
+
+    DELETE FROM sqlite_sequence WHERE name = 'books_new';
+    INSERT INTO sqlite_sequence (name, seq)
+    SELECT 'books_new', seq FROM sqlite_sequence WHERE name = 'books';
+
+    DROP TABLE books;
+    ALTER TABLE books_new RENAME TO books;
+    ''' + BOOKS_FTS_TRIGGERS,
+    # Per-table version counters for in-process caches (lms_cache). Only
+    # catalog changes bump them; circulation counters are left out so issuing
+    # a book does not force every cache to reload the whole catalog.
+    '''
+    CREATE TABLE table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+
+    INSERT INTO table_versions (name) VALUES ('books'), ('members');
+    ''' + TABLE_VERSION_TRIGGERS,
+    # Overdue loans, fines and per-member totals materialized by the daily
+    # job in lms_fines. job_runs records when each scheduled job last ran.
+    '''
+    CREATE TABLE job_runs (
+        name TEXT PRIMARY KEY,
+        last_run TEXT NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE TABLE fines (
+        issue_id INTEGER PRIMARY KEY REFERENCES issued_books (id),
+        member_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        due_date TEXT NOT NULL,
+        days_overdue INTEGER NOT NULL,
+        amount_cents INTEGER NOT NULL,
+        return_date TEXT
+    );
+
+    CREATE INDEX idx_fines_open ON fines (due_date) WHERE return_date IS NULL;
+    CREATE INDEX idx_fines_open_member ON fines (member_id, days_overdue, amount_cents) WHERE return_date IS NULL;
+    CREATE INDEX idx_fines_member ON fines (member_id);
+    CREATE INDEX idx_issued_returned ON issued_books (return_date) WHERE return_date IS NOT NULL;
+
+    -- Open totals change daily and are recomputed from the few open fines;
+    -- closed totals change only when a member returns something late
+    CREATE TABLE member_fines (
+        member_id INTEGER PRIMARY KEY,
+        open_overdue INTEGER NOT NULL DEFAULT 0,
+        open_days INTEGER NOT NULL DEFAULT 0,
+        open_cents INTEGER NOT NULL DEFAULT 0,
+        late_returns INTEGER NOT NULL DEFAULT 0,
+        closed_days INTEGER NOT NULL DEFAULT 0,
+        closed_cents INTEGER NOT NULL DEFAULT 0,
+        amount_cents INTEGER GENERATED ALWAYS AS (open_cents + closed_cents) STORED
+    );
+
+    CREATE INDEX idx_member_fines_amount ON member_fines (amount_cents DESC, member_id);
+    ''',
+    # Returned loans older than the archive age are moved out of issued_books
+    # by lms_archive; loan_history reads both tables for reports.
+    '''
+    CREATE TABLE issued_books_archive (
+        id INTEGER PRIMARY KEY,
+        book_id INTEGER NOT NULL,
+        member_id INTEGER NOT NULL,
+        issue_date TEXT NOT NULL,
+        due_date TEXT NOT NULL,
+        return_date TEXT NOT NULL
+    );
+
+    CREATE INDEX idx_archive_issue_date ON issued_books_archive (issue_date);
+    CREATE INDEX idx_archive_member_date ON issued_books_archive (member_id, issue_date);
+    CREATE INDEX idx_archive_book_date ON issued_books_archive (book_id, issue_date);
+
+    CREATE VIEW loan_history AS
+    SELECT id, book_id, member_id, issue_date, due_date, return_date FROM issued_books
+    UNION ALL
+    SELECT id, book_id, member_id, issue_date, due_date, return_date FROM issued_books_archive;
+    ''',
+    # Hold queues (lms_holds). A hold waits in its book's queue by position,
+    # then a returned copy is set aside for it: 'ready' holds are on the
+    # pickup shelf until expires_date and are not counted in books.available.
+    '''
+    CREATE TABLE holds (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER NOT NULL REFERENCES books (id),
+        member_id INTEGER NOT NULL REFERENCES members (id),
+        position INTEGER NOT NULL,
+        placed_date TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'waiting',
+        ready_date TEXT,
+        expires_date TEXT
+    );
+
+    CREATE UNIQUE INDEX idx_holds_queue ON holds (book_id, position) WHERE status = 'waiting';
+    CREATE INDEX idx_holds_ready ON holds (expires_date) WHERE status = 'ready';
+    CREATE INDEX idx_holds_member ON holds (member_id, book_id);
+    ''',
+    # Circulation rollups for the dashboard reports (lms_analytics), filled
+    # from the existing history and then maintained by LOAN_STATS_TRIGGERS.
+    '''
+    CREATE TABLE stats_daily (
+        day TEXT PRIMARY KEY,
+        issued INTEGER NOT NULL DEFAULT 0,
+        returned INTEGER NOT NULL DEFAULT 0,
+        returned_late INTEGER NOT NULL DEFAULT 0,
+        loan_days INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+
+    CREATE TABLE stats_book (
+        book_id INTEGER PRIMARY KEY,
+        loans INTEGER NOT NULL DEFAULT 0,
+        returned INTEGER NOT NULL DEFAULT 0,
+        returned_late INTEGER NOT NULL DEFAULT 0,
+        loan_days INTEGER NOT NULL DEFAULT 0,
+        last_issued TEXT
+    );
+
+    CREATE TABLE stats_member (
+        member_id INTEGER PRIMARY KEY,
+        loans INTEGER NOT NULL DEFAULT 0,
+        returned INTEGER NOT NULL DEFAULT 0,
+        returned_late INTEGER NOT NULL DEFAULT 0,
+        loan_days INTEGER NOT NULL DEFAULT 0,
+        last_issued TEXT
+    );
+
+    CREATE INDEX idx_stats_book_loans ON stats_book (loans DESC, book_id);
+    CREATE INDEX idx_stats_member_loans ON stats_member (loans DESC, member_id);
+    ''' + ''.join(f"INSERT INTO {table} {sql};\n" for table, sql in LOAN_STATS.items()) + LOAN_STATS_TRIGGERS,
+    # Per-copy items (lms_items). Each title's quantity is expanded into
+    # copies barcoded <isbn>-<n>: the first cover its active loans, the next
+    # its ready holds, the rest are on the shelf. Loans and ready holds then
+    # point at their copy, and ITEM_COUNT_TRIGGERS take over the counts.
+    '''
+    CREATE TABLE items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER NOT NULL REFERENCES books (id),
+        barcode TEXT UNIQUE NOT NULL,
+        status TEXT NOT NULL DEFAULT 'available' CHECK (status IN ('available', 'on_loan', 'on_hold')),
+        location TEXT NOT NULL DEFAULT ''
+    );
+
+    CREATE INDEX idx_items_book_status ON items (book_id, status);
+    CREATE INDEX idx_items_location ON items (location, book_id);
+
+    ALTER TABLE issued_books ADD COLUMN item_id INTEGER REFERENCES items (id);
+    ALTER TABLE issued_books_archive ADD COLUMN item_id INTEGER;
+    ALTER TABLE holds ADD COLUMN item_id INTEGER REFERENCES items (id);
+
+    WITH RECURSIVE copy (n) AS (
+        SELECT 1 UNION ALL SELECT n + 1 FROM copy WHERE n < (SELECT MAX(quantity) FROM books)
+    ),
+    counts AS (
+        SELECT id, isbn, quantity,
+               (SELECT COUNT(*) FROM issued_books WHERE book_id = books.id AND return_date IS NULL) AS on_loan,
+               (SELECT COUNT(*) FROM holds WHERE book_id = books.id AND status = 'ready') AS on_hold
+        FROM books
+    )
+    INSERT INTO items (book_id, barcode, status)
+    SELECT counts.id, printf('%s-%d', counts.isbn, copy.n),
+           CASE WHEN copy.n <= on_loan THEN 'on_loan'
+                WHEN copy.n <= on_loan + on_hold THEN 'on_hold'
+                ELSE 'available' END
+    FROM counts JOIN copy ON copy.n <= counts.quantity
+    ORDER BY counts.id, copy.n;
+
+    WITH loans AS (
+        SELECT id, book_id, ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id) AS n
+        FROM issued_books WHERE return_date IS NULL
+    ),
+    copies AS (
+        SELECT id, book_id, ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id) AS n
+        FROM items WHERE status = 'on_loan'
+    )
+    UPDATE issued_books SET item_id = copies.id
+    FROM loans JOIN copies USING (book_id, n)
+    WHERE issued_books.id = loans.id;
+
+    WITH ready AS (
+        SELECT id, book_id, ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id) AS n
+        FROM holds WHERE status = 'ready'
+    ),
+    copies AS (
+        SELECT id, book_id, ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id) AS n
+        FROM items WHERE status = 'on_hold'
+    )
+    UPDATE holds SET item_id = copies.id
+    FROM ready JOIN copies USING (book_id, n)
+    WHERE holds.id = ready.id;
+
+    UPDATE books SET available = (SELECT COUNT(*) FROM items WHERE book_id = books.id AND status = 'available');
+
+    CREATE UNIQUE INDEX idx_issued_active_item ON issued_books (item_id) WHERE return_date IS NULL;
+    CREATE UNIQUE INDEX idx_holds_item ON holds (item_id) WHERE status = 'ready';
+    ''' + ITEM_COUNT_TRIGGERS,
+    # Log of changed loans and ready holds for lms_cache, so issuing or
+    # returning a book no longer reloads every active loan. seq counts up
+    # without gaps; only the newest CIRCULATION_LOG_KEEP rows are kept.
+    '''
+    CREATE TABLE circulation_log (
+        seq INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL CHECK (kind IN ('loan', 'hold')),
+        row_id INTEGER NOT NULL
+    );
+    ''' + CIRCULATION_LOG_TRIGGERS,
+]
+
+# Queries on the circulation hot path, with the index (or indexes) each one
+# must use. Checked by check_query_plans().
+HOT_QUERIES = {
+    'active_loans_page': (
+        '''
+        SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date
+        FROM issued_books ib
+        JOIN books b ON ib.book_id = b.id
+        JOIN members m ON ib.member_id = m.id
+        WHERE ib.return_date IS NULL AND ib.id > ?
+        ORDER BY ib.id
+        LIMIT ?
+        ''',
+        (0, 200),
+        'idx_issued_active',
+    ),
+    'newly_overdue': (
+        '''
+        SELECT id, member_id, book_id, due_date
+        FROM issued_books
+        WHERE return_date IS NULL AND due_date < ? AND due_date >= ?
+        ''',
+        ('2024-01-15', '2024-01-14'),
+        'idx_issued_active_due',
+    ),
+    'returned_since': (
+        "SELECT id, member_id, book_id, due_date FROM issued_books WHERE return_date >= ? AND return_date > due_date",
+        ('2024-01-14',),
+        'idx_issued_returned',
+    ),
+    'archive_batch': (
+        "SELECT id FROM issued_books WHERE return_date < ? ORDER BY return_date LIMIT ?",
+        ('2024-01-01', 5000),
+        'idx_issued_returned',
+    ),
+    'next_holds': (
+        "SELECT id FROM holds WHERE book_id = ? AND status = 'waiting' ORDER BY position LIMIT ?",
+        (1, 1),
+        'idx_holds_queue',
+    ),
+    'hold_queue_end': (
+        "SELECT COALESCE(MAX(position), 0) + 1 FROM holds WHERE book_id = ? AND status = 'waiting'",
+        (1,),
+        'idx_holds_queue',
+    ),
+    'expired_holds': (
+        "SELECT book_id FROM holds WHERE status = 'ready' AND expires_date < ?",
+        ('2024-01-15',),
+        'idx_holds_ready',
+    ),
+    'member_holds': (
+        "SELECT id, status FROM holds WHERE member_id = ? AND book_id = ?",
+        (1, 1),
+        'idx_holds_member',
+    ),
+    'item_by_barcode': (
+        "SELECT id, book_id, status FROM items WHERE barcode = ?",
+        ('9780000000001-1',),
+        'sqlite_autoindex_items_1',
+    ),
+    'shelf_copy': (
+        "SELECT id, barcode FROM items WHERE book_id = ? AND status = 'available' ORDER BY id LIMIT ?",
+        (1, 1),
+        'idx_items_book_status',
+    ),
+    'loan_by_copy': (
+        '''
+        SELECT ib.id FROM items i
+        JOIN issued_books ib ON ib.item_id = i.id AND ib.return_date IS NULL
+        WHERE i.barcode = ?
+        ''',
+        ('9780000000001-1',),
+        ('sqlite_autoindex_items_1', 'idx_issued_active_item'),
+    ),
+    'items_at_location': (
+        "SELECT barcode, book_id, status FROM items WHERE location = ? ORDER BY book_id",
+        ('A1',),
+        'idx_items_location',
+    ),
+    'top_books': (
+        '''
+        SELECT sb.book_id, b.title, sb.loans FROM stats_book sb
+        CROSS JOIN books b ON b.id = sb.book_id
+        WHERE sb.loans > 0
+        ORDER BY sb.loans DESC, sb.book_id
+        LIMIT ?
+        ''',
+        (20,),
+        'idx_stats_book_loans',
+    ),
+    'member_activity': (
+        '''
+        SELECT sm.member_id, m.name, sm.loans FROM stats_member sm
+        CROSS JOIN members m ON m.id = sm.member_id
+        WHERE sm.loans > 0
+        ORDER BY sm.loans DESC, sm.member_id
+        LIMIT ?
+        ''',
+        (20,),
+        'idx_stats_member_loans',
+    ),
+    'loans_by_day': (
+        "SELECT day, issued, returned FROM stats_daily WHERE day >= ? AND day <= ? ORDER BY day DESC",
+        ('2024-01-01', '2024-01-31'),
+        'PRIMARY KEY',
+    ),
+    'overdue_report': (
+        '''
+        SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date, f.days_overdue
+        FROM fines f
+        CROSS JOIN issued_books ib ON ib.id = f.issue_id
+        JOIN books b ON ib.book_id = b.id
+        JOIN members m ON ib.member_id = m.id
+        WHERE f.return_date IS NULL AND ib.return_date IS NULL
+        ORDER BY f.due_date
+        ''',
+        (),
+        'idx_fines_open',
+    ),
+    'member_fines_closed': (
+        '''
+        SELECT member_id, COUNT(*), SUM(days_overdue), SUM(amount_cents)
+        FROM fines
+        WHERE member_id IN (SELECT value FROM json_each(?)) AND return_date IS NOT NULL
+        GROUP BY member_id
+        ''',
+        ('[1, 2]',),
+        'idx_fines_member',
+    ),
+    'member_fines_open': (
+        '''
+        SELECT member_id, COUNT(*), SUM(days_overdue), SUM(amount_cents)
+        FROM fines
+        WHERE return_date IS NULL
+        GROUP BY member_id
+        ''',
+        (),
+        'idx_fines_open_member',
+    ),
+    'fines_report': (
+        '''
+        SELECT mf.member_id, m.name, mf.open_overdue, mf.late_returns, mf.amount_cents
+        FROM member_fines mf
+        CROSS JOIN members m ON m.id = mf.member_id
+        ORDER BY mf.amount_cents DESC, mf.member_id
+        ''',
+        (),
+        'idx_member_fines_amount',
+    ),
+    'issued_report_range': (
+        '''
+        SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date, ib.return_date
+        FROM loan_history ib
+        CROSS JOIN books b ON ib.book_id = b.id
+        CROSS JOIN members m ON ib.member_id = m.id
+        WHERE ib.issue_date >= ? AND ib.issue_date <= ?
+        ORDER BY ib.issue_date DESC
+        ''',
+        ('2024-01-01', '2024-12-31'),
+        ('idx_issued_issue_date', 'idx_archive_issue_date'),
+    ),
+    'issued_report_member': (
+        '''
+        SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date, ib.return_date
+        FROM loan_history ib
+        CROSS JOIN books b ON ib.book_id = b.id
+        CROSS JOIN members m ON ib.member_id = m.id
+        WHERE ib.member_id = ?
+        ORDER BY ib.issue_date DESC
+        ''',
+        (1,),
+        ('idx_issued_member_date', 'idx_archive_member_date'),
+    ),
+    'search_books': (
+        '''
+        SELECT b.* FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        WHERE books_fts MATCH ? AND b.available > 0
+        ORDER BY bm25(books_fts, 10.0, 5.0, 1.0)
+        LIMIT ?
+        ''',
+        ('"harry"*', 20),
+        'VIRTUAL TABLE INDEX',
+    ),
+    'books_page': (
+        "SELECT * FROM books WHERE id > ? ORDER BY id LIMIT ?",
+        (0, 200),
+        'INTEGER PRIMARY KEY',
+    ),
+    'members_page': (
+        "SELECT * FROM members WHERE id > ? ORDER BY id LIMIT ?",
+        (0, 200),
+        'INTEGER PRIMARY KEY',
+    ),
+}
+
+
+def migrate(conn):
+    """Apply any pending migrations and return the resulting schema version"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0:
+        # Takes effect on a new file; existing ones switch on their next VACUUM
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    for target, sql in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.executescript(f"BEGIN;\n{sql}\nPRAGMA user_version = {target};\nCOMMIT;")
+
+    return len(MIGRATIONS)
+
+
+def set_durability(conn, durability):
+    journal_mode, synchronous = DURABILITY[durability]
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+
+
+def connect_database(path=DB_PATH, durability=DEFAULT_DURABILITY):
+    """Open the library database, bring its schema up to date and set its durability"""
+    conn = sqlite3.connect(path, factory=connection_factory())
+    migrate(conn)
+    set_durability(conn, durability)
+    return conn
+
+
+def query_plan(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def check_query_plans(conn):
+    """Return {name: plan} for every hot query that scans or misses its index"""
+    failures = {}
+    for name, (sql, params, indexes) in HOT_QUERIES.items():
+        plan = query_plan(conn, sql, params)
+        indexes = (indexes,) if isinstance(indexes, str) else indexes
+        # Scanning a view's co-routine reads its result rows, not a table
+        coroutines = {step.split()[1] for step in plan if step.startswith('CO-ROUTINE ')}
+        full_scan = any(step.startswith('SCAN ') and 'INDEX' not in step and step.split()[1] not in coroutines
+                        for step in plan)
+        if full_scan or not all(any(index in step for step in plan) for index in indexes):
+            failures[name] = plan
+    return failures
+
+
+if __name__ == "__main__":
+    # Query plan regression check: python lms_db.py [database]. Without a
+    # database it checks an empty schema and a generated, ANALYZEd library,
+    # whose statistics can steer the planner off an index the empty one uses.
+    import tempfile
+    from lms_bench import SIZES, generate_library
+
+    with tempfile.TemporaryDirectory() as directory:
+        if len(sys.argv) > 1:
+            databases = [sys.argv[1]]
+        else:
+            databases = [':memory:', os.path.join(directory, 'generated.db')]
+            generate_library(databases[1], *SIZES['tiny'], progress=lambda message: None)
+
+        failed = False
+        for path in databases:
+            conn = connect_database(path)
+            failures = check_query_plans(conn)
+            conn.close()
+            failed = failed or bool(failures)
+
+            print(f"{path if path == ':memory:' or len(sys.argv) > 1 else 'generated tiny library'}:")
+            for name in HOT_QUERIES:
+                print(f"{'FAIL' if name in failures else 'ok':<5} {name}")
+                for step in failures.get(name, []):
+                    print(f"      {step}")
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,140 @@
+import argparse
+import json
+import time
+from datetime import datetime
+
+from lms_db import DB_PATH, connect_database
+
+FINE_CENTS_PER_DAY = 25
+MAX_FINE_CENTS = 2000
+
+JOB_NAME = 'fines'
+
+# Reports that read the fines table and so need today's run first
+FINES_REPORTS = {'overdue', 'fines'}
+
+FINE_AMOUNT = "MIN(CAST(julianday({end}) - julianday(due_date) AS INTEGER) * :rate, :cap)"
+
+
+def last_run(conn, name=JOB_NAME):
+    row = conn.execute("SELECT last_run FROM job_runs WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def update_fines(conn, today=None):
+    """Bring the fines table up to date and return what changed.
+
+    Only loans whose status moved since the last run are touched: loans that
+    fell overdue after it, loans returned on or after it, and the still-open
+    overdue loans whose days keep counting. Per-member totals are refreshed
+    the same way: open totals from the open fines, closed totals only for
+    members with late returns since the last run. The first run backfills every
+    late return on record. Runs in one transaction, so it is safe to repeat.
+    """
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    params = {'today': today, 'rate': FINE_CENTS_PER_DAY, 'cap': MAX_FINE_CENTS}
+    started = time.perf_counter()
+
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        params['since'] = last_run(conn) or ''
+
+        # Loans that became overdue since the last run
+        newly_overdue = conn.execute(f'''
+            INSERT INTO fines (issue_id, member_id, book_id, due_date, days_overdue, amount_cents)
+            SELECT id, member_id, book_id, due_date,
+                   CAST(julianday(:today) - julianday(due_date) AS INTEGER),
+                   {FINE_AMOUNT.format(end=':today')}
+            FROM issued_books
+            WHERE return_date IS NULL AND due_date < :today AND due_date >= :since
+            ON CONFLICT (issue_id) DO NOTHING
+        ''', params).rowcount
+
+        # Late returns since the last run: the fine stops at the return date
+        closed = conn.execute(f'''
+            INSERT INTO fines (issue_id, member_id, book_id, due_date, days_overdue, amount_cents, return_date)
+            SELECT id, member_id, book_id, due_date,
+                   CAST(julianday(return_date) - julianday(due_date) AS INTEGER),
+                   {FINE_AMOUNT.format(end='return_date')},
+                   return_date
+            FROM issued_books
+            WHERE return_date >= :since AND return_date > due_date
+            ON CONFLICT (issue_id) DO UPDATE SET
+                days_overdue = excluded.days_overdue,
+                amount_cents = excluded.amount_cents,
+                return_date = excluded.return_date
+        ''', params).rowcount
+
+        # Everything still out keeps accruing
+        accrued = conn.execute(f'''
+            UPDATE fines SET
+                days_overdue = CAST(julianday(:today) - julianday(due_date) AS INTEGER),
+                amount_cents = {FINE_AMOUNT.format(end=':today')}
+            WHERE return_date IS NULL
+        ''', params).rowcount
+
+        # Open totals: reset whoever had open fines, then sum the open fines
+        conn.execute('''
+            UPDATE member_fines SET open_overdue = 0, open_days = 0, open_cents = 0
+            WHERE open_overdue > 0
+        ''')
+        conn.execute('''
+            INSERT INTO member_fines (member_id, open_overdue, open_days, open_cents)
+            SELECT member_id, COUNT(*), SUM(days_overdue), SUM(amount_cents)
+            FROM fines
+            WHERE return_date IS NULL
+            GROUP BY member_id
+            ON CONFLICT (member_id) DO UPDATE SET
+                open_overdue = excluded.open_overdue,
+                open_days = excluded.open_days,
+                open_cents = excluded.open_cents
+        ''')
+
+        # Closed totals: only members who returned something late since the last run
+        members = list({row[0] for row in conn.execute(
+            "SELECT member_id FROM issued_books WHERE return_date >= :since AND return_date > due_date", params
+        )})
+        conn.execute('''
+            INSERT INTO member_fines (member_id, late_returns, closed_days, closed_cents)
+            SELECT member_id, COUNT(*), SUM(days_overdue), SUM(amount_cents)
+            FROM fines
+            WHERE member_id IN (SELECT value FROM json_each(?)) AND return_date IS NOT NULL
+            GROUP BY member_id
+            ON CONFLICT (member_id) DO UPDATE SET
+                late_returns = excluded.late_returns,
+                closed_days = excluded.closed_days,
+                closed_cents = excluded.closed_cents
+        ''', (json.dumps(members),))
+
+        conn.execute('''
+            INSERT INTO job_runs (name, last_run) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET last_run = excluded.last_run
+        ''', (JOB_NAME, today))
+
+    return {
+        'today': today,
+        'since': params['since'] or None,
+        'newly_overdue': newly_overdue,
+        'closed': closed,
+        'accrued': accrued,
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+
+def refresh_fines(conn, today=None):
+    """Run update_fines unless it already ran today; return its result or None"""
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    if last_run(conn) == today:
+        return None
+    return update_fines(conn, today)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the overdue/fines table (run daily, e.g. from cron)")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--today', help="YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    result = update_fines(connect_database(args.db), args.today)
+    print(f"fines updated for {result['today']}: {result['newly_overdue']} newly overdue, "
+          f"{result['closed']} returned late, {result['accrued']} accruing ({result['elapsed_s']}s)")
@@ -0,0 +1,113 @@
+import argparse
+import json
+import time
+from datetime import date, datetime, timedelta
+
+from lms_db import DB_PATH, connect_database
+from lms_items import shelf_items
+
+HOLD_PICKUP_DAYS = 7
+
+JOB_NAME = 'holds'
+
+# waiting: queued for a copy; ready: a copy is set aside on the pickup shelf
+OPEN_STATUSES = ('waiting', 'ready')
+
+
+def assign_items(conn, book_id, item_ids, today):
+    """Set copies aside for the front of a book's hold queue and return how many were taken.
+
+    The first copies in item_ids go to the next holds, read from
+    idx_holds_queue in position order, so the cost is O(log n) per copy
+    however long the queue or the loan history. Must run inside the caller's
+    transaction.
+    """
+    if not item_ids:
+        return 0
+    expires = (date.fromisoformat(today) + timedelta(days=HOLD_PICKUP_DAYS)).isoformat()
+    holds = [row[0] for row in conn.execute(
+        "SELECT id FROM holds WHERE book_id = ? AND status = 'waiting' ORDER BY position LIMIT ?",
+        (book_id, len(item_ids))
+    )]
+    pairs = list(zip(holds, item_ids))
+    conn.executemany(
+        "UPDATE holds SET status = 'ready', ready_date = ?, expires_date = ?, item_id = ? WHERE id = ?",
+        [(today, expires, item_id, hold_id) for hold_id, item_id in pairs]
+    )
+    conn.executemany("UPDATE items SET status = 'on_hold' WHERE id = ?", [(item_id,) for hold_id, item_id in pairs])
+    return len(pairs)
+
+
+def release_items(conn, book_id, item_ids, today):
+    """Hand copies back: to the next holds in the queue first, the rest to the shelf; return how many were shelved.
+
+    A loan or hold from before copies were tracked may have no item_id;
+    those Nones are skipped, so no hold is made ready without a copy.
+    """
+    item_ids = [item_id for item_id in item_ids if item_id is not None]
+    taken = assign_items(conn, book_id, item_ids, today)
+    conn.executemany("UPDATE items SET status = 'available' WHERE id = ?", [(item_id,) for item_id in item_ids[taken:]])
+    return len(item_ids) - taken
+
+
+def fill_holds_from_shelf(conn, isbns, today=None):
+    """Move copies on the shelf to waiting holds for the given ISBNs; return how many moved.
+
+    For copies that reach the shelf without a return, e.g. a catalog import
+    adding to a title members are queued for. Must run inside the caller's
+    transaction.
+    """
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    moved = 0
+    for book_id, in conn.execute('''
+        SELECT b.id FROM books b
+        WHERE b.isbn IN (SELECT value FROM json_each(?)) AND b.available > 0
+          AND EXISTS (SELECT 1 FROM holds WHERE book_id = b.id AND status = 'waiting')
+    ''', (json.dumps(isbns),)).fetchall():
+        moved += assign_items(conn, book_id, [item_id for item_id, barcode in shelf_items(conn, book_id)], today)
+    return moved
+
+
+def expire_holds(conn, today=None):
+    """Expire ready holds not picked up in time and pass their copies on.
+
+    Only holds on the pickup shelf are read, through the partial index
+    idx_holds_ready. Each copy they held goes to the next waiting hold for its
+    book, or back on the shelf. Runs in one transaction.
+    """
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    started = time.perf_counter()
+
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        expired = {}
+        for book_id, item_id in conn.execute(
+            "UPDATE holds SET status = 'expired' WHERE status = 'ready' AND expires_date < ? RETURNING book_id, item_id",
+            (today,)
+        ).fetchall():
+            expired.setdefault(book_id, []).append(item_id)
+        shelved = sum(release_items(conn, book_id, item_ids, today) for book_id, item_ids in expired.items())
+
+        conn.execute('''
+            INSERT INTO job_runs (name, last_run) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET last_run = excluded.last_run
+        ''', (JOB_NAME, today))
+
+    return {
+        'today': today,
+        'expired': sum(map(len, expired.values())),
+        'reassigned': sum(map(len, expired.values())) - shelved,
+        'shelved': shelved,
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expire holds not picked up in time (run daily, e.g. from cron)")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--today', help="YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    result = expire_holds(connect_database(args.db), args.today)
+    print(f"holds swept for {result['today']}: {result['expired']} expired, {result['reassigned']} passed to "
+          f"the next hold, {result['shelved']} back on the shelf ({result['elapsed_s']}s)")
@@ -0,0 +1,196 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import time
+from itertools import islice
+
+from lms_db import DB_PATH, connect_database
+from lms_holds import fill_holds_from_shelf
+from lms_items import add_copies
+
+BATCH_SIZE = 5000
+
+# Quantities are counted from the copies added by add_copies
+INSERT_BOOK = "INSERT INTO books (title, author, isbn, quantity, available) VALUES (?, ?, ?, 0, 0) ON CONFLICT (isbn) DO NOTHING"
+
+# MARC-lite: the MarcEdit text (.mrk) layout, one "=TAG  ind$aValue" line per
+# field and a blank line between records. Only the fields we store are read.
+MARC_FIELDS = {'020': 'isbn', '100': 'author', '245': 'title'}
+
+
+class ImportStats:
+    """Counters for a finished import"""
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.rejected = 0
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.read} rows read, {self.imported} imported, {self.rejected} rejected "
+                f"in {self.elapsed:.2f}s ({self.rows_per_second:,.0f} rows/s)")
+
+
+def read_csv(path):
+    """Yield one dict per CSV row; the header names the fields"""
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+def read_jsonl(path):
+    """Yield one dict per non-blank JSON line"""
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {'_error': f"line {line_no}: {e.msg}", '_raw': line.rstrip('\n')}
+
+
+def read_marc_lite(path):
+    """Yield one dict per MARC-lite record"""
+    record = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                if record:
+                    yield record
+                record = {}
+                continue
+            if not line.startswith('=') or len(line) < 5:
+                continue
+            field = MARC_FIELDS.get(line[1:4])
+            if field and '$a' in line:
+                value = line.split('$a', 1)[1].split('$', 1)[0]
+                record[field] = value.strip(' /:;,') if field != 'isbn' else value.split()[0]
+    if record:
+        yield record
+
+
+READERS = {
+    '.csv': read_csv,
+    '.jsonl': read_jsonl,
+    '.mrk': read_marc_lite,
+    '.marc': read_marc_lite,
+}
+
+
+def validate(record):
+    """Return (title, author, isbn, quantity) for a record, or raise ValueError"""
+    if '_error' in record:
+        raise ValueError(record['_error'])
+
+    title = str(record.get('title') or '').strip()
+    author = str(record.get('author') or '').strip()
+    isbn = str(record.get('isbn') or '').strip()
+    if not title or not author or not isbn:
+        raise ValueError("title, author and isbn are required")
+
+    quantity = record.get('quantity')
+    try:
+        quantity = int(quantity) if quantity not in (None, '') else 1
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid quantity {quantity!r}") from None
+    if quantity < 1:
+        raise ValueError("quantity must be a positive integer")
+
+    return title, author, isbn, quantity
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_catalog(conn, path, reader=None, batch_size=BATCH_SIZE, reject_path=None, progress=None):
+    """Stream a catalog file into books and return ImportStats.
+
+    Each row's quantity becomes that many new copies (items) of the title;
+    rows with an ISBN that already exists add their copies to the existing
+    title, and the added copies go to any holds queued for it first. Each
+    batch is written with executemany in one transaction, with
+    synchronous=NORMAL for the duration if the database is in WAL mode.
+    Rows that fail validation go to reject_path (default:
+    <path>.rejects.csv) together with the reason. progress, if given, is
+    called with the stats after every batch.
+    """
+    if reader is None:
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in READERS:
+            raise ValueError(f"Unsupported catalog format: {extension or path}")
+        reader = READERS[extension]
+    reject_path = reject_path or f"{path}.rejects.csv"
+
+    stats = ImportStats()
+    started = time.perf_counter()
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    # Keep the journal mode the connection was opened with; only a WAL
+    # database can drop to synchronous=NORMAL without risking corruption
+    if conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+    rejects = None
+    try:
+        for chunk in chunked(reader(path), batch_size):
+            rows = []
+            for record in chunk:
+                stats.read += 1
+                try:
+                    rows.append(validate(record))
+                except ValueError as e:
+                    if rejects is None:
+                        reject_file = open(reject_path, 'w', newline='', encoding='utf-8')
+                        rejects = csv.writer(reject_file)
+                        rejects.writerow(['row', 'reason', 'record'])
+                    raw = record.get('_raw') or json.dumps(record, default=str)
+                    rejects.writerow([stats.read, str(e), raw])
+                    stats.rejected += 1
+
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(INSERT_BOOK, [row[:3] for row in rows])
+                add_copies(conn, [(isbn, quantity) for title, author, isbn, quantity in rows])
+                fill_holds_from_shelf(conn, [row[2] for row in rows])
+            stats.imported += len(rows)
+            stats.elapsed = time.perf_counter() - started
+            if progress:
+                progress(stats)
+    finally:
+        if rejects is not None:
+            reject_file.close()
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+
+    stats.elapsed = time.perf_counter() - started
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import books from CSV, JSONL or MARC-lite (.mrk)")
+    parser.add_argument('path')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--rejects', help="reject file (default: <path>.rejects.csv)")
+    args = parser.parse_args()
+
+    conn = connect_database(args.db)
+    try:
+        stats = import_catalog(conn, args.path, batch_size=args.batch_size, reject_path=args.rejects,
+                               progress=lambda s: print(s, end='\r', flush=True))
+    except (OSError, ValueError, sqlite3.Error) as e:
+        parser.exit(1, f"Import failed: {e}\n")
+    print(stats)
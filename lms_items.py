@@ -0,0 +1,68 @@
+import argparse
+
+from lms_db import DB_PATH, connect_database
+
+# available: on the shelf; on_loan: issued; on_hold: set aside for a ready hold
+ITEM_STATUSES = ('available', 'on_loan', 'on_hold')
+
+
+def barcode_for(isbn, copy):
+    """Barcode of a title's copy number copy (counting from 1), as the items migration assigns them"""
+    return f"{isbn}-{copy}"
+
+
+def add_copies(conn, copies, location=''):
+    """Create item rows for new copies of titles given as (isbn, count) pairs; return how many.
+
+    Barcodes continue each title's numbering after its existing copies. The
+    item triggers raise books.quantity and books.available to match. Must
+    run inside the caller's transaction.
+    """
+    numbered = {}
+    rows = []
+    for isbn, count in copies:
+        if isbn not in numbered:
+            book = conn.execute("SELECT id, quantity FROM books WHERE isbn = ?", (isbn,)).fetchone()
+            if book is None:
+                continue
+            numbered[isbn] = list(book)
+        book_id, last = numbered[isbn]
+        rows.extend((book_id, barcode_for(isbn, last + n), location) for n in range(1, count + 1))
+        numbered[isbn][1] = last + count
+    conn.executemany("INSERT INTO items (book_id, barcode, location) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+def find_item(conn, barcode):
+    """Return (id, book_id, status) of the copy with this barcode, or None"""
+    return conn.execute("SELECT id, book_id, status FROM items WHERE barcode = ?", (barcode,)).fetchone()
+
+
+def shelf_items(conn, book_id, limit=-1):
+    """Return (id, barcode) of a title's copies on the shelf, oldest first, from idx_items_book_status"""
+    return conn.execute(
+        "SELECT id, barcode FROM items WHERE book_id = ? AND status = 'available' ORDER BY id LIMIT ?", (book_id, limit)
+    ).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the copies of a title, or the copies shelved at a location")
+    parser.add_argument('--db', default=DB_PATH)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--isbn', help="list this title's copies")
+    group.add_argument('--location', help="list the copies shelved here")
+    args = parser.parse_args()
+
+    conn = connect_database(args.db)
+    if args.isbn:
+        rows = conn.execute('''
+            SELECT i.barcode, i.status, i.location FROM books b JOIN items i ON i.book_id = b.id
+            WHERE b.isbn = ? ORDER BY i.id
+        ''', (args.isbn,))
+    else:
+        rows = conn.execute('''
+            SELECT i.barcode, i.status, b.title FROM items i JOIN books b ON b.id = i.book_id
+            WHERE i.location = ? ORDER BY i.book_id, i.id
+        ''', (args.location,))
+    for row in rows:
+        print('  '.join(str(value) for value in row))
@@ -0,0 +1,128 @@
+import argparse
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from lms_bench import summarize
+from lms_client import RemoteLibraryService
+from lms_service import LibraryError
+
+# Relative weight of each operation in the simulated desk traffic
+MIX = {
+    'books_page': 25,
+    'search_books': 20,
+    'get_member': 15,
+    'issued_page': 10,
+    'issue_book': 15,
+    'return_book': 15,
+}
+SEARCH_TERMS = ['history', 'world', 'love', 'the sea', 'science', 'modern art', 'python', 'war']
+
+
+def desk(url, deadline, seed, results, lock):
+    """One simulated circulation desk issuing requests until the deadline"""
+    rng = random.Random(seed)
+    client = RemoteLibraryService(url)
+    stats = client.stats()
+    max_book, max_member = stats['max_book_id'] or 1, stats['max_member_id'] or 1
+    loans = []
+    names, weights = list(MIX), list(MIX.values())
+    latencies = {name: [] for name in MIX}
+    errors = {name: 0 for name in MIX}
+
+    while time.monotonic() < deadline:
+        op = rng.choices(names, weights)[0]
+        if op == 'return_book' and not loans:
+            op = 'issue_book'
+        started = time.perf_counter()
+        try:
+            if op == 'books_page':
+                client.books_page(rng.randint(0, max_book), 200)
+            elif op == 'search_books':
+                client.search_books(rng.choice(SEARCH_TERMS), available_only=True)
+            elif op == 'get_member':
+                client.get_member(rng.randint(1, max_member))
+            elif op == 'issued_page':
+                client.issued_page(0, 200)
+            elif op == 'issue_book':
+                issue_id, due_date = client.issue_book(rng.randint(1, max_member), rng.randint(1, max_book))
+                loans.append(issue_id)
+            else:
+                client.return_book(loans.pop(rng.randrange(len(loans))))
+        except LibraryError:
+            errors[op] += 1
+        latencies[op].append(time.perf_counter() - started)
+
+    # Put the library back the way we found it
+    for issue_id in loans:
+        client.return_book(issue_id)
+    client.close()
+
+    with lock:
+        for op in MIX:
+            results['latencies'][op].extend(latencies[op])
+            results['errors'][op] += errors[op]
+
+
+def wait_for_server(url, timeout=30):
+    client = RemoteLibraryService(url, timeout=2)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client.request('GET', '/health')
+            return
+        except (LibraryError, OSError):
+            time.sleep(0.2)
+    raise SystemExit(f"server at {url} did not come up")
+
+
+def run_load(url, desks, duration, seed=0):
+    results = {'latencies': {op: [] for op in MIX}, 'errors': {op: 0 for op in MIX}}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=desk, args=(url, deadline, seed + i, results, lock)) for i in range(desks)]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in results['latencies'].values())
+    return {
+        'desks': desks,
+        'duration_s': round(elapsed, 2),
+        'requests': total,
+        'requests_per_s': round(total / elapsed, 1),
+        'operations': {
+            op: dict(summarize(values), rejected=results['errors'][op])
+            for op, values in results['latencies'].items() if values
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a running library server")
+    parser.add_argument('--url', default='http://127.0.0.1:8750')
+    parser.add_argument('--desks', type=int, default=8, help="concurrent simulated desks")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--spawn', metavar='DB', help="start lms_server.py on this database first")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        port = args.url.rsplit(':', 1)[-1].strip('/')
+        server = subprocess.Popen([sys.executable, 'lms_server.py', '--db', args.spawn, '--port', port],
+                                  stdout=subprocess.DEVNULL)
+    try:
+        wait_for_server(args.url)
+        print(json.dumps(run_load(args.url, args.desks, args.duration, args.seed), indent=2))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
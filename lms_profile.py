@@ -0,0 +1,365 @@
+import argparse
+import json
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+from functools import wraps
+from itertools import chain
+
+SLOW_QUERY_MS = 50
+SLOW_QUERY_LOG = 100
+
+# Upper bounds of the latency histogram buckets; the last bucket is open-ended
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_profiler = None
+
+
+def normalize_sql(sql):
+    """Collapse whitespace so one statement always lands in the same histogram"""
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class Histogram:
+    """Latency counts in fixed buckets plus count, total and max"""
+
+    __slots__ = ('counts', 'count', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': {f"<={bound}" if bound is not None else f">{BUCKETS_MS[-1]}": count
+                        for bound, count in zip(BUCKETS_MS + (None,), self.counts) if count},
+        }
+
+
+class Profiler:
+    """Latency histograms by kind and name, and a log of slow SQL statements.
+
+    Kinds used by the app are 'sql', 'handler' (Tk event handlers),
+    'render' (filling a Treeview, picker or report), 'job' (time a background
+    job ran on the worker) and 'job_latency' (from submit until its result
+    reached the Tk thread). Safe to record into from any thread.
+    """
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, slow_log=SLOW_QUERY_LOG):
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.slow_queries = deque(maxlen=slow_log)
+        self.started = datetime.now().isoformat(timespec='seconds')
+
+    def record(self, kind, name, ms):
+        with self.lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[kind, name] = Histogram()
+            histogram.add(ms)
+
+    def record_slow(self, sql, ms, rows, plan):
+        with self.lock:
+            self.slow_queries.append({
+                'at': datetime.now().isoformat(timespec='seconds'),
+                'ms': round(ms, 3),
+                'rows': rows,
+                'sql': sql,
+                'plan': plan,
+            })
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.slow_queries.clear()
+            self.started = datetime.now().isoformat(timespec='seconds')
+
+    def snapshot(self):
+        """Return everything recorded so far as JSON-ready data, slowest totals first"""
+        with self.lock:
+            items = sorted(self.histograms.items(), key=lambda item: -item[1].total_ms)
+            return {
+                'started': self.started,
+                'taken': datetime.now().isoformat(timespec='seconds'),
+                'slow_ms': self.slow_ms,
+                'sqlite': sqlite3.sqlite_version,
+                'latency': [{'kind': kind, 'name': name, **histogram.summary()}
+                            for (kind, name), histogram in items],
+                'slow_queries': list(reversed(self.slow_queries)),
+            }
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+def enable_profiling(slow_ms=SLOW_QUERY_MS):
+    """Turn profiling on for connections opened from now on and return the profiler"""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(slow_ms)
+    return _profiler
+
+
+def get_profiler():
+    """The active Profiler, or None when profiling is off"""
+    return _profiler
+
+
+def measure(kind, name):
+    """Context manager timing a block into the profiler; a no-op when profiling is off"""
+    if _profiler is None:
+        return nullcontext()
+    return _Timer(_profiler, kind, name)
+
+
+class _Timer:
+    __slots__ = ('profiler', 'kind', 'name', 'started')
+
+    def __init__(self, profiler, kind, name):
+        self.profiler = profiler
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.kind, self.name, (time.perf_counter() - self.started) * 1000)
+
+
+def timed(kind):
+    """Decorator recording each call of a function under its qualified name"""
+    def decorate(func):
+        name = func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _Timer(_profiler, kind, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def connection_factory():
+    """Connection class for sqlite3.connect: profiled when profiling is on"""
+    return sqlite3.Connection if _profiler is None else ProfiledConnection
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor timing each statement from execute until its last row is read.
+
+    A statement's time includes fetching: it is recorded when the cursor is
+    exhausted, re-executed, closed or dropped, so a streamed report counts in
+    full. Slow statements are logged with their EXPLAIN QUERY PLAN, which is
+    read on the same connection right away or, for a cursor that was simply
+    dropped, before the connection's next statement.
+    """
+
+    def __init__(self, conn):
+        super().__init__(conn)
+        self.profiled_sql = None
+
+    def start(self, sql, params):
+        self.finish()
+        self.profiled_sql = sql
+        self.profiled_params = params
+        self.profiled_ms = 0.0
+        self.profiled_rows = 0
+        self.connection.explain_pending()
+
+    def finish(self, explain=True):
+        if self.profiled_sql is None:
+            return
+        sql, self.profiled_sql = self.profiled_sql, None
+        ms = self.profiled_ms
+        _profiler.record('sql', normalize_sql(sql), ms)
+        if ms >= _profiler.slow_ms:
+            self.connection.slow_pending.append((sql, self.profiled_params, ms, self.profiled_rows))
+            if explain:
+                self.connection.explain_pending()
+
+    def timed_call(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.profiled_ms += (time.perf_counter() - started) * 1000
+
+    def execute(self, sql, params=()):
+        self.start(sql, params)
+        try:
+            return self.timed_call(super().execute, sql, params)
+        except BaseException:
+            self.finish()
+            raise
+
+    def executemany(self, sql, seq_of_params):
+        # Keep the first parameter set for the plan without consuming a generator
+        seq_of_params = iter(seq_of_params)
+        first = next(seq_of_params, None)
+        self.start(sql, first)
+        try:
+            return self.timed_call(super().executemany, sql, chain([first] if first is not None else [], seq_of_params))
+        finally:
+            self.finish()
+
+    def executescript(self, script):
+        self.start(script, None)
+        try:
+            return self.timed_call(super().executescript, script)
+        finally:
+            self.finish()
+
+    def __next__(self):
+        try:
+            row = self.timed_call(super().__next__)
+        except StopIteration:
+            self.finish()
+            raise
+        self.profiled_rows += 1
+        return row
+
+    def fetchone(self):
+        row = self.timed_call(super().fetchone)
+        if row is None:
+            self.finish()
+        else:
+            self.profiled_rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.timed_call(super().fetchmany, self.arraysize if size is None else size)
+        self.profiled_rows += len(rows)
+        if not rows:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        rows = self.timed_call(super().fetchall)
+        self.profiled_rows += len(rows)
+        self.finish()
+        return rows
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def __del__(self):
+        # Running SQL from a finalizer is unsafe; the plan is read on the next statement
+        if self.profiled_sql is not None:
+            self.finish(explain=False)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose statements all run on ProfiledCursors"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slow_pending = []
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def explain_pending(self):
+        """Log the slow statements waiting for their query plans"""
+        while self.slow_pending:
+            sql, params, ms, rows = self.slow_pending.pop(0)
+            plan = None
+            if params is not None:
+                try:
+                    # The base class cursor keeps this lookup out of the statistics
+                    plan = [row[3] for row in sqlite3.Connection.execute(self, f"EXPLAIN QUERY PLAN {sql}", params)]
+                except sqlite3.Error as e:
+                    plan = [f"(no plan: {e})"]
+            _profiler.record_slow(normalize_sql(sql), ms, rows, plan)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            _profiler.record('sql', 'COMMIT', (time.perf_counter() - started) * 1000)
+
+    def __exit__(self, exc_type, exc, traceback):
+        # ``with conn:`` commits in C without calling commit(), so time it here
+        if exc_type is not None or not self.in_transaction:
+            return super().__exit__(exc_type, exc, traceback)
+        started = time.perf_counter()
+        try:
+            return super().__exit__(exc_type, exc, traceback)
+        finally:
+            _profiler.record('sql', 'COMMIT', (time.perf_counter() - started) * 1000)
+
+    def close(self):
+        self.explain_pending()
+        super().close()
+
+
+def format_summary(snapshot, limit=25):
+    """Render a snapshot as text lines: the costliest histograms, then the slow query log"""
+    lines = [f"{'kind':<12}{'count':>8}{'total ms':>12}{'mean':>9}{'p95':>9}{'max':>10}  name"]
+    for entry in snapshot['latency'][:limit]:
+        lines.append(f"{entry['kind']:<12}{entry['count']:>8}{entry['total_ms']:>12.1f}{entry['mean_ms']:>9.2f}"
+                     f"{entry['p95_ms']:>9.2f}{entry['max_ms']:>10.2f}  {entry['name'][:100]}")
+
+    lines.append('')
+    lines.append(f"{len(snapshot['slow_queries'])} statements slower than {snapshot['slow_ms']} ms")
+    for query in snapshot['slow_queries'][:limit]:
+        lines.append(f"{query['ms']:>10.1f} ms  {query['rows']} rows  {query['sql'][:100]}")
+        for step in query['plan'] or []:
+            lines.append(f"              {step}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a profile dump written by LMS.py --profile")
+    parser.add_argument('dump')
+    parser.add_argument('--limit', type=int, default=25)
+    args = parser.parse_args()
+
+    with open(args.dump, encoding='utf-8') as f:
+        print('\n'.join(format_summary(json.load(f), args.limit)))
@@ -0,0 +1,318 @@
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime
+
+from lms_db import DB_PATH, connect_database
+from lms_fines import FINES_REPORTS, refresh_fines
+
+FETCH_SIZE = 500
+
+FILTERS = ('date_from', 'date_to', 'member_id', 'book_id')
+
+# Free-text columns are cut to fit their width; the rest are printed whole
+TRUNCATED = {'title', 'author', 'name', 'email', 'book', 'member'}
+
+# Amounts formatted as text in SQL, compared as numbers when merging rows
+DECIMAL = {'fine'}
+
+
+class Descending:
+    """Sort key wrapper that orders its value in reverse"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class Report:
+    """A tabular report: one SQL query plus how to lay out its columns.
+
+    ``sql`` contains a ``{where}`` placeholder. ``where`` lists conditions
+    that always apply; ``filters`` maps filter names to the condition used
+    when that filter is given, so filtering happens in SQL rather than Python.
+    Conditions use named parameters; ``:today`` is always available.
+    ``order`` repeats the ORDER BY in terms of the output columns (a leading
+    '-' for descending), so rows from several databases can be merged.
+    """
+
+    def __init__(self, title, columns, sql, filters, where=(), empty_text=None, order=()):
+        self.title = title
+        self.columns = columns
+        self.sql = sql
+        self.filters = filters
+        self.where = list(where)
+        self.empty_text = empty_text
+        self.order = [(self.keys.index(key.lstrip('-')), key.startswith('-'), key.lstrip('-') in DECIMAL)
+                      for key in order]
+
+    @property
+    def keys(self):
+        return [key for key, header, width in self.columns]
+
+    def sort_key(self, row):
+        """The report's ORDER BY as a key on one of its rows"""
+        key = []
+        for index, descending, decimal in self.order:
+            value = float(row[index]) if decimal else row[index]
+            key.append(Descending(value) if descending else value)
+        return key
+
+    def query(self, filters=None, today=None):
+        """Return (sql, params) with the given filters pushed into WHERE"""
+        filters = {name: value for name, value in (filters or {}).items() if value not in (None, '')}
+        conditions = self.where + [cond for name, cond in self.filters.items() if name in filters]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params = dict(filters, today=today or datetime.now().strftime("%Y-%m-%d"))
+        return self.sql.format(where=where), params
+
+    def format_header(self):
+        header = ' '.join(f"{header:<{width}}" for key, header, width in self.columns)
+        return [self.title, "=" * 50, header, "-" * len(header)]
+
+    def format_row(self, row):
+        cells = []
+        for value, (key, header, width) in zip(row, self.columns):
+            if value is None:
+                value = "Not Returned" if key == 'return_date' else ""
+            text = str(value)[:width - 1] if key in TRUNCATED else value
+            cells.append(f"{text:<{width}}")
+        return ' '.join(cells)
+
+
+ISSUED_FILTERS = {
+    'date_from': "ib.issue_date >= :date_from",
+    'date_to': "ib.issue_date <= :date_to",
+    'member_id': "ib.member_id = :member_id",
+    'book_id': "ib.book_id = :book_id",
+}
+
+REPORTS = {
+    'books': Report(
+        "BOOKS REPORT",
+        [('id', 'ID', 5), ('title', 'Title', 30), ('author', 'Author', 20),
+         ('isbn', 'ISBN', 15), ('quantity', 'Qty', 5), ('available', 'Avail', 5)],
+        "SELECT id, title, author, isbn, quantity, available FROM books {where} ORDER BY id",
+        {'book_id': "id = :book_id"},
+        order=('id',),
+    ),
+    'members': Report(
+        "MEMBERS REPORT",
+        [('id', 'ID', 5), ('name', 'Name', 25), ('email', 'Email', 25),
+         ('phone', 'Phone', 15), ('membership_date', 'Member Since', 12)],
+        "SELECT id, name, email, phone, membership_date FROM members {where} ORDER BY id",
+        {
+            'date_from': "membership_date >= :date_from",
+            'date_to': "membership_date <= :date_to",
+            'member_id': "id = :member_id",
+        },
+        order=('id',),
+    ),
+    'issued': Report(
+        "ISSUED BOOKS REPORT",
+        [('id', 'ID', 5), ('book', 'Book', 25), ('member', 'Member', 20),
+         ('issue_date', 'Issue Date', 12), ('due_date', 'Due Date', 12), ('return_date', 'Return Date', 12)],
+        '''
+        SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date, ib.return_date
+        FROM loan_history ib
+        CROSS JOIN books b ON ib.book_id = b.id
+        CROSS JOIN members m ON ib.member_id = m.id
+        {where}
+        ORDER BY ib.issue_date DESC
+        ''',
+        ISSUED_FILTERS,
+        order=('-issue_date',),
+    ),
+    'overdue': Report(
+        "OVERDUE BOOKS REPORT",
+        [('id', 'ID', 5), ('book', 'Book', 25), ('member', 'Member', 20), ('issue_date', 'Issue Date', 12),
+         ('due_date', 'Due Date', 12), ('days_overdue', 'Days Overdue', 12), ('fine', 'Fine', 8)],
+        # Reads the rows materialized by lms_fines; CROSS JOIN keeps the
+        # small open-fines index as the driving table
+        '''
+        SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date, f.days_overdue,
+               printf('%.2f', f.amount_cents / 100.0)
+        FROM fines f
+        CROSS JOIN issued_books ib ON ib.id = f.issue_id
+        JOIN books b ON ib.book_id = b.id
+        JOIN members m ON ib.member_id = m.id
+        {where}
+        ORDER BY f.due_date
+        ''',
+        ISSUED_FILTERS,
+        where=["f.return_date IS NULL", "ib.return_date IS NULL"],
+        empty_text="No overdue books.",
+        order=('due_date',),
+    ),
+    'fines': Report(
+        "MEMBER FINES REPORT",
+        [('member_id', 'ID', 5), ('member', 'Member', 25), ('open_overdue', 'Overdue', 8),
+         ('late_returns', 'Late Returns', 12), ('days_overdue', 'Days Late', 10), ('fine', 'Fine', 10)],
+        '''
+        SELECT mf.member_id, m.name, mf.open_overdue, mf.late_returns, mf.open_days + mf.closed_days,
+               printf('%.2f', mf.amount_cents / 100.0)
+        FROM member_fines mf
+        CROSS JOIN members m ON m.id = mf.member_id
+        {where}
+        ORDER BY mf.amount_cents DESC, mf.member_id
+        ''',
+        {'member_id': "mf.member_id = :member_id"},
+        where=["mf.amount_cents > 0"],
+        empty_text="No fines.",
+        order=('-fine', 'member_id'),
+    ),
+    # Dashboard reports read the rollup tables kept by LOAN_STATS_TRIGGERS
+    # (lms_db), so their cost depends on the days, books or members shown,
+    # not on the size of the loan history
+    'circulation': Report(
+        "CIRCULATION SUMMARY",
+        [('days', 'Days', 6), ('issued', 'Issued', 9), ('returned', 'Returned', 9),
+         ('returned_late', 'Late', 8), ('late_share', 'Late %', 7), ('avg_loan_days', 'Avg Days', 9)],
+        '''
+        SELECT COUNT(*), COALESCE(SUM(issued), 0), COALESCE(SUM(returned), 0), COALESCE(SUM(returned_late), 0),
+               ROUND(100.0 * SUM(returned_late) / NULLIF(SUM(returned), 0), 1),
+               ROUND(1.0 * SUM(loan_days) / NULLIF(SUM(returned), 0), 1)
+        FROM stats_daily
+        {where}
+        ''',
+        {'date_from': "day >= :date_from", 'date_to': "day <= :date_to"},
+    ),
+    'loans_by_day': Report(
+        "LOANS PER DAY",
+        [('day', 'Day', 12), ('issued', 'Issued', 8), ('returned', 'Returned', 9),
+         ('returned_late', 'Late', 6), ('avg_loan_days', 'Avg Days', 9)],
+        '''
+        SELECT day, issued, returned, returned_late, ROUND(1.0 * loan_days / NULLIF(returned, 0), 1)
+        FROM stats_daily
+        {where}
+        ORDER BY day DESC
+        ''',
+        {'date_from': "day >= :date_from", 'date_to': "day <= :date_to"},
+        empty_text="No loans in this period.",
+        order=('-day',),
+    ),
+    'top_books': Report(
+        "MOST BORROWED BOOKS",
+        [('book_id', 'ID', 6), ('title', 'Title', 30), ('author', 'Author', 20), ('loans', 'Loans', 7),
+         ('returned_late', 'Late', 6), ('avg_loan_days', 'Avg Days', 9), ('last_issued', 'Last Issued', 12)],
+        '''
+        SELECT sb.book_id, b.title, b.author, sb.loans, sb.returned_late,
+               ROUND(1.0 * sb.loan_days / NULLIF(sb.returned, 0), 1), sb.last_issued
+        FROM stats_book sb
+        CROSS JOIN books b ON b.id = sb.book_id
+        {where}
+        ORDER BY sb.loans DESC, sb.book_id
+        ''',
+        {'book_id': "sb.book_id = :book_id"},
+        where=["sb.loans > 0"],
+        empty_text="No loans yet.",
+        order=('-loans', 'book_id'),
+    ),
+    'member_activity': Report(
+        "MEMBER ACTIVITY",
+        [('member_id', 'ID', 6), ('member', 'Member', 25), ('loans', 'Loans', 7), ('on_loan', 'Out', 5),
+         ('returned_late', 'Late', 6), ('avg_loan_days', 'Avg Days', 9), ('last_issued', 'Last Issued', 12)],
+        '''
+        SELECT sm.member_id, m.name, sm.loans, sm.loans - sm.returned, sm.returned_late,
+               ROUND(1.0 * sm.loan_days / NULLIF(sm.returned, 0), 1), sm.last_issued
+        FROM stats_member sm
+        CROSS JOIN members m ON m.id = sm.member_id
+        {where}
+        ORDER BY sm.loans DESC, sm.member_id
+        ''',
+        {'member_id': "sm.member_id = :member_id"},
+        where=["sm.loans > 0"],
+        empty_text="No loans yet.",
+        order=('-loans', 'member_id'),
+    ),
+}
+
+
+def iter_rows(conn, name, filters=None, fetch_size=FETCH_SIZE):
+    """Yield report rows straight from the cursor, fetch_size at a time"""
+    sql, params = REPORTS[name].query(filters)
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def render_lines(name, rows):
+    """Yield the text lines of a report, header first"""
+    report = REPORTS[name]
+    header = report.format_header()
+    empty = True
+    for row in rows:
+        if empty:
+            yield from header
+            empty = False
+        yield report.format_row(row)
+    if empty:
+        yield from header[:2] if report.empty_text else header
+        if report.empty_text:
+            yield report.empty_text
+
+
+def write_report(rows, keys, path, fmt='csv'):
+    """Stream rows to a CSV or JSONL file and return the row count"""
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f"Unsupported export format: {fmt}")
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(keys)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(keys, row))) + '\n')
+                count += 1
+    return count
+
+
+def export_report(conn, name, path, fmt='csv', filters=None):
+    """Stream a report to a CSV or JSONL file and return the row count"""
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return write_report(iter_rows(conn, name, filters), REPORTS[name].keys, path, fmt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print or export a library report")
+    parser.add_argument('report', choices=sorted(REPORTS))
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--format', choices=('text', 'csv', 'jsonl'), default='text')
+    parser.add_argument('--out', help="output file (required for csv/jsonl)")
+    parser.add_argument('--from', dest='date_from', help="YYYY-MM-DD")
+    parser.add_argument('--to', dest='date_to', help="YYYY-MM-DD")
+    parser.add_argument('--member', dest='member_id', type=int)
+    parser.add_argument('--book', dest='book_id', type=int)
+    args = parser.parse_args()
+
+    conn = connect_database(args.db)
+    filters = {name: getattr(args, name) for name in FILTERS}
+    if args.report in FINES_REPORTS:
+        refresh_fines(conn)
+
+    if args.format == 'text':
+        for line in render_lines(args.report, iter_rows(conn, args.report, filters)):
+            sys.stdout.write(line + '\n')
+    elif not args.out:
+        parser.error("--out is required for csv and jsonl exports")
+    else:
+        count = export_report(conn, args.report, args.out, args.format, filters)
+        print(f"Exported {count} rows to {args.out}")
@@ -0,0 +1,522 @@
+import argparse
+import asyncio
+import json
+import queue
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from lms_db import DB_PATH, DEFAULT_DURABILITY, DURABILITY
+from lms_fines import FINES_REPORTS
+from lms_reports import FILTERS, REPORTS
+from lms_service import (BorrowLimitError, DuplicateError, HoldError, InUseError, LibraryError, LibraryService,
+                         NotFoundError, UnavailableError, ValidationError)
+from lms_worker import GroupCommitWriter
+
+HOST = '127.0.0.1'
+PORT = 8750
+READERS = 4
+MAX_PAGE = 1000
+REPORT_BATCH = 500
+JOB_INTERVAL_S = 60 * 60
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               409: 'Conflict', 500: 'Internal Server Error'}
+
+ERROR_STATUS = {
+    ValidationError: 400,
+    NotFoundError: 404,
+    DuplicateError: 409,
+    InUseError: 409,
+    BorrowLimitError: 409,
+    UnavailableError: 409,
+    HoldError: 409,
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path.rstrip('/') or '/'
+        self.query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        self.body = body
+        self.params = {}
+
+    def json(self):
+        try:
+            data = json.loads(self.body or b'{}')
+        except ValueError:
+            raise HTTPError(400, "Request body must be JSON") from None
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return data
+
+    def int_arg(self, name, default=None, maximum=None):
+        value = self.query.get(name)
+        if value is None:
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise HTTPError(400, f"{name} must be an integer") from None
+        return min(value, maximum) if maximum else value
+
+
+class LibraryServer:
+    """HTTP/JSON front end for a library database shared by many desks.
+
+    Every write goes through a single writer thread and connection, so desks
+    never contend for the SQLite write lock; with ``group_commit_ms`` set,
+    writes arriving together share one commit. Reads run on a pool of reader
+    threads, each with its own connection. Only the WAL durability modes are
+    accepted, so readers never block the writer. With ``snapshot_minutes``
+    set, a reader also takes a read-only snapshot at that interval, which
+    reports requested with ?snapshot=1 read instead of the live database.
+    """
+
+    def __init__(self, path=DB_PATH, readers=READERS, durability=DEFAULT_DURABILITY, group_commit_ms=None,
+                 snapshot_minutes=None):
+        if DURABILITY[durability][0] != 'WAL':
+            raise ValueError(f"The server needs a WAL durability mode, not {durability}")
+        self.path = path
+        self.durability = durability
+        self.snapshot_minutes = snapshot_minutes
+
+        self.local = threading.local()
+        self.writer = GroupCommitWriter(lambda: LibraryService.open(path, durability), group_commit_ms)
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix='lms-reader', initializer=self.open_service)
+        self.routes = []
+        self.add_routes()
+
+    def open_service(self):
+        self.local.service = LibraryService.open(self.path, self.durability)
+
+    async def read(self, func):
+        """Run func(service) on a reader connection"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.readers, lambda: func(self.local.service))
+
+    async def write(self, func, group=True):
+        """Run func(service) on the single writer connection.
+
+        Pass group=False for jobs that manage their own transactions, so they
+        are never folded into a group commit.
+        """
+        return await asyncio.wrap_future(self.writer.submit(func, group))
+
+    def route(self, method, pattern, handler):
+        self.routes.append((method, re.compile(f"^{pattern}$"), handler))
+
+    def add_routes(self):
+        self.route('GET', r'/health', self.health)
+        self.route('GET', r'/stats', self.stats)
+        self.route('GET', r'/books', self.list_books)
+        self.route('POST', r'/books', self.add_book)
+        self.route('GET', r'/books/search', self.search_books)
+        self.route('GET', r'/books/available', self.available_books)
+        self.route('GET', r'/books/lookup', self.find_book)
+        self.route('GET', r'/books/(?P<book_id>\d+)', self.get_book)
+        self.route('DELETE', r'/books/(?P<book_id>\d+)', self.delete_book)
+        self.route('GET', r'/books/(?P<book_id>\d+)/active', self.book_active)
+        self.route('GET', r'/books/(?P<book_id>\d+)/items', self.book_items)
+        self.route('GET', r'/members', self.list_members)
+        self.route('POST', r'/members', self.add_member)
+        self.route('GET', r'/members/choices', self.member_choices)
+        self.route('GET', r'/members/lookup', self.find_member)
+        self.route('GET', r'/members/(?P<member_id>\d+)', self.get_member)
+        self.route('DELETE', r'/members/(?P<member_id>\d+)', self.delete_member)
+        self.route('GET', r'/members/(?P<member_id>\d+)/active', self.member_active)
+        self.route('GET', r'/loans', self.list_loans)
+        self.route('POST', r'/loans', self.issue_book)
+        self.route('GET', r'/loans/active', self.active_loans)
+        self.route('POST', r'/loans/batch', self.issue_books)
+        self.route('POST', r'/loans/batch/return', self.return_books)
+        self.route('GET', r'/loans/(?P<issue_id>\d+)', self.get_loan)
+        self.route('POST', r'/loans/(?P<issue_id>\d+)/return', self.return_book)
+        self.route('GET', r'/items', self.items_at)
+        self.route('POST', r'/items/issue', self.issue_copy)
+        self.route('POST', r'/items/return', self.return_copy)
+        self.route('POST', r'/items/move', self.move_item)
+        self.route('GET', r'/holds', self.open_holds)
+        self.route('POST', r'/holds', self.place_hold)
+        self.route('DELETE', r'/holds/(?P<hold_id>\d+)', self.cancel_hold)
+        self.route('GET', r'/reports/(?P<name>\w+)', self.report)
+        self.route('POST', r'/jobs/fines', self.update_fines)
+        self.route('POST', r'/jobs/holds', self.expire_holds)
+        self.route('POST', r'/jobs/snapshot', self.take_snapshot)
+
+    # Handlers return (status, payload) or an async iterator of NDJSON lines
+
+    async def health(self, request):
+        return 200, {'status': 'ok'}
+
+    async def stats(self, request):
+        stats = await self.read(lambda service: service.stats())
+        stats['writer'] = {'writes': self.writer.writes, 'batches': self.writer.batches}
+        return 200, stats
+
+    async def list_books(self, request):
+        after_id, limit = request.int_arg('after_id', 0), request.int_arg('limit', 200, MAX_PAGE)
+        return 200, await self.read(lambda service: service.books_page(after_id, limit))
+
+    async def add_book(self, request):
+        data = request.json()
+        book_id = await self.write(lambda service: service.add_book(
+            data.get('title') or '', data.get('author') or '', data.get('isbn') or '', data.get('quantity')))
+        return 201, {'id': book_id}
+
+    async def search_books(self, request):
+        text = request.query.get('q', '')
+        limit = request.int_arg('limit', 50, MAX_PAGE)
+        available_only = request.query.get('available') in ('1', 'true')
+        return 200, await self.read(lambda service: service.search_books(text, limit, available_only))
+
+    async def available_books(self, request):
+        limit = request.int_arg('limit', -1)
+        return 200, await self.read(lambda service: service.available_books(limit))
+
+    async def find_book(self, request):
+        isbn = request.query.get('isbn', '')
+        return 200, await self.read(lambda service: service.find_book_by_isbn(isbn))
+
+    async def get_book(self, request):
+        book_id = int(request.params['book_id'])
+        return 200, await self.read(lambda service: service.get_book(book_id))
+
+    async def delete_book(self, request):
+        book_id = int(request.params['book_id'])
+        await self.write(lambda service: service.delete_book(book_id))
+        return 200, {'deleted': book_id}
+
+    async def book_active(self, request):
+        book_id = int(request.params['book_id'])
+        return 200, {'active': await self.read(lambda service: service.book_has_active_loans(book_id))}
+
+    async def list_members(self, request):
+        after_id, limit = request.int_arg('after_id', 0), request.int_arg('limit', 200, MAX_PAGE)
+        return 200, await self.read(lambda service: service.members_page(after_id, limit))
+
+    async def add_member(self, request):
+        data = request.json()
+        member_id = await self.write(lambda service: service.add_member(
+            data.get('name') or '', data.get('email') or '', data.get('phone') or ''))
+        return 201, {'id': member_id}
+
+    async def member_choices(self, request):
+        return 200, await self.read(lambda service: service.member_choices())
+
+    async def find_member(self, request):
+        email = request.query.get('email', '')
+        return 200, await self.read(lambda service: service.find_member_by_email(email))
+
+    async def get_member(self, request):
+        member_id = int(request.params['member_id'])
+        return 200, await self.read(lambda service: service.get_member(member_id))
+
+    async def delete_member(self, request):
+        member_id = int(request.params['member_id'])
+        await self.write(lambda service: service.delete_member(member_id))
+        return 200, {'deleted': member_id}
+
+    async def member_active(self, request):
+        member_id = int(request.params['member_id'])
+        return 200, {'active': await self.read(lambda service: service.member_has_active_loans(member_id))}
+
+    async def list_loans(self, request):
+        after_id, limit = request.int_arg('after_id', 0), request.int_arg('limit', 200, MAX_PAGE)
+        return 200, await self.read(lambda service: service.issued_page(after_id, limit))
+
+    async def issue_book(self, request):
+        data = request.json()
+        try:
+            member_id, book_id = int(data['member_id']), int(data['book_id'])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "member_id and book_id are required integers") from None
+        issue_id, due_date = await self.write(lambda service: service.issue_book(member_id, book_id))
+        return 201, {'id': issue_id, 'due_date': due_date}
+
+    async def issue_books(self, request):
+        data = request.json()
+        codes = self.scan_codes(data)
+        try:
+            member_id = int(data['member_id'])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "member_id is a required integer") from None
+        return 200, await self.write(lambda service: service.issue_books(member_id, codes))
+
+    async def return_books(self, request):
+        codes = self.scan_codes(request.json())
+        return 200, await self.write(lambda service: service.return_books(codes))
+
+    def scan_codes(self, data):
+        codes = data.get('codes')
+        if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+            raise HTTPError(400, "codes must be a list of strings")
+        return codes
+
+    async def active_loans(self, request):
+        return 200, await self.read(lambda service: service.active_loans())
+
+    async def get_loan(self, request):
+        issue_id = int(request.params['issue_id'])
+        return 200, await self.read(lambda service: service.get_issued(issue_id))
+
+    async def return_book(self, request):
+        issue_id = int(request.params['issue_id'])
+        book_id = await self.write(lambda service: service.return_book(issue_id))
+        return 200, {'book_id': book_id}
+
+    async def book_items(self, request):
+        book_id = int(request.params['book_id'])
+        return 200, await self.read(lambda service: service.book_items(book_id))
+
+    async def items_at(self, request):
+        location = request.query.get('location', '')
+        return 200, await self.read(lambda service: service.items_at(location))
+
+    async def issue_copy(self, request):
+        data = request.json()
+        try:
+            member_id, barcode = int(data['member_id']), str(data['barcode'])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "member_id (integer) and barcode are required") from None
+        issue_id, due_date = await self.write(lambda service: service.issue_copy(member_id, barcode))
+        return 201, {'id': issue_id, 'due_date': due_date}
+
+    async def return_copy(self, request):
+        barcode = str(request.json().get('barcode') or '')
+        book_id = await self.write(lambda service: service.return_copy(barcode))
+        return 200, {'book_id': book_id}
+
+    async def move_item(self, request):
+        data = request.json()
+        barcode, location = str(data.get('barcode') or ''), str(data.get('location') or '')
+        await self.write(lambda service: service.move_item(barcode, location))
+        return 200, {'barcode': barcode, 'location': location}
+
+    async def open_holds(self, request):
+        member_id = request.int_arg('member_id')
+        return 200, await self.read(lambda service: service.open_holds(member_id))
+
+    async def place_hold(self, request):
+        data = request.json()
+        try:
+            member_id, book_id = int(data['member_id']), int(data['book_id'])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "member_id and book_id are required integers") from None
+        hold_id, place = await self.write(lambda service: service.place_hold(member_id, book_id))
+        return 201, {'id': hold_id, 'place': place}
+
+    async def cancel_hold(self, request):
+        hold_id = int(request.params['hold_id'])
+        await self.write(lambda service: service.cancel_hold(hold_id))
+        return 200, {'cancelled': hold_id}
+
+    async def update_fines(self, request):
+        today = request.json().get('today')
+        return 200, await self.write(lambda service: service.update_fines(today), group=False)
+
+    async def expire_holds(self, request):
+        today = request.json().get('today')
+        return 200, await self.write(lambda service: service.expire_holds(today), group=False)
+
+    async def take_snapshot(self, request):
+        return 200, await self.read(lambda service: service.take_snapshot())
+
+    async def run_snapshots(self):
+        """Take a snapshot on a reader at startup and every snapshot_minutes"""
+        while True:
+            try:
+                await self.read(lambda service: service.take_snapshot())
+            except Exception as e:
+                print(f"snapshot failed: {e}", file=sys.stderr)
+            await asyncio.sleep(self.snapshot_minutes * 60)
+
+    async def run_jobs(self):
+        """Run the scheduled jobs on the writer at startup and every JOB_INTERVAL_S"""
+        while True:
+            try:
+                await self.write(lambda service: service.update_fines(), group=False)
+            except Exception as e:
+                print(f"fines job failed: {e}", file=sys.stderr)
+            try:
+                await self.write(lambda service: service.expire_holds(), group=False)
+            except Exception as e:
+                print(f"holds job failed: {e}", file=sys.stderr)
+            await asyncio.sleep(JOB_INTERVAL_S)
+
+    async def report(self, request):
+        name = request.params['name']
+        if name not in REPORTS:
+            raise HTTPError(404, f"Unknown report: {name}")
+        filters = {key: request.query[key] for key in FILTERS if key in request.query}
+        snapshot = request.query.get('snapshot') == '1'
+        # Readers never write: if today's fines run is missing, the writer does it first
+        if name in FINES_REPORTS and not snapshot and not await self.read(lambda service: service.fines_current()):
+            await self.write(lambda service: service.refresh_fines(), group=False)
+        return self.stream_report(name, filters, snapshot)
+
+    async def stream_report(self, name, filters, snapshot=False):
+        """Yield NDJSON report rows produced on a reader thread.
+
+        A bounded queue hands batches across, so a slow client holds back the
+        reader instead of the whole report piling up in memory.
+        """
+        batches = queue.Queue(maxsize=4)
+        cancelled = threading.Event()
+
+        def produce(service):
+            try:
+                batch = []
+                for row in service.report_rows(name, snapshot, **filters):
+                    batch.append(row)
+                    if len(batch) >= REPORT_BATCH:
+                        batches.put(batch)
+                        batch = []
+                        if cancelled.is_set():
+                            return
+                batches.put(batch)
+            finally:
+                batches.put(None)
+
+        loop = asyncio.get_running_loop()
+        producer = asyncio.ensure_future(self.read(produce))
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, batches.get)
+                if batch is None:
+                    break
+                yield ''.join(json.dumps(row) + '\n' for row in batch).encode()
+        finally:
+            cancelled.set()
+            while not producer.done():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    await asyncio.sleep(0.01)
+            producer.result()
+
+    # HTTP plumbing
+
+    async def dispatch(self, request):
+        allowed = False
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            request.params = match.groupdict()
+            return await handler(request)
+        if allowed:
+            raise HTTPError(405, f"{request.method} not allowed on {request.path}")
+        raise HTTPError(404, f"No route for {request.path}")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = header.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                await self.respond(writer, Request(method, target, body), keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, request, keep_alive):
+        try:
+            status, payload = 200, await self.dispatch(request)
+            if isinstance(payload, tuple):
+                status, payload = payload
+        except HTTPError as e:
+            status, payload = e.status, {'error': str(e), 'type': 'HTTPError'}
+        except LibraryError as e:
+            status = next((code for cls, code in ERROR_STATUS.items() if isinstance(e, cls)), 400)
+            payload = {'error': str(e), 'type': type(e).__name__}
+        except Exception as e:
+            status, payload = 500, {'error': str(e), 'type': type(e).__name__}
+
+        connection = 'keep-alive' if keep_alive else 'close'
+        if hasattr(payload, '__aiter__'):
+            writer.write((f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                          f"Content-Type: application/x-ndjson\r\n"
+                          f"Transfer-Encoding: chunked\r\nConnection: {connection}\r\n\r\n").encode())
+            async for chunk in payload:
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+        else:
+            body = json.dumps(payload).encode()
+            writer.write((f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                          f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                          f"Connection: {connection}\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        jobs = [asyncio.create_task(self.run_jobs())]
+        if self.snapshot_minutes:
+            jobs.append(asyncio.create_task(self.run_snapshots()))
+        if ready:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for job in jobs:
+                job.cancel()
+
+    def close(self):
+        self.writer.close()
+        self.readers.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the library database over HTTP/JSON")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--readers', type=int, default=READERS, help="reader connections")
+    parser.add_argument('--durability', choices=('wal', 'relaxed'), default=DEFAULT_DURABILITY,
+                        help="wal: every commit is synced; relaxed: synced at checkpoints")
+    parser.add_argument('--group-commit-ms', type=float, metavar='MS',
+                        help="commit writes arriving within MS milliseconds together; 0 groups the writes "
+                             "that queued up during the previous commit")
+    parser.add_argument('--snapshot-every', type=float, metavar='MINUTES',
+                        help="take a read-only snapshot for reports at this interval")
+    args = parser.parse_args()
+
+    library = LibraryServer(args.db, args.readers, args.durability, args.group_commit_ms, args.snapshot_every)
+    print(f"Serving {args.db} on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(library.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        library.close()
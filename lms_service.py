@@ -0,0 +1,757 @@
+import json
+import re
+import sqlite3
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from lms_analytics import rebuild_rollups, verify_rollups
+from lms_archive import archive_loans, reclaim_space
+from lms_backup import SNAPSHOT_KEEP, backup_database, database_file, latest_snapshot, open_snapshot, take_snapshot
+from lms_cache import CatalogCache
+from lms_db import DB_PATH, DEFAULT_DURABILITY, connect_database
+from lms_fines import last_run, refresh_fines, update_fines
+from lms_holds import expire_holds, release_items
+from lms_import import import_catalog
+from lms_items import add_copies, find_item, shelf_items
+from lms_reports import export_report, iter_rows
+
+MAX_LOANS = 5
+LOAN_DAYS = 14
+SEARCH_LIMIT = 50
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+class LibraryError(Exception):
+    """Base class for errors raised by LibraryService"""
+
+
+class ValidationError(LibraryError):
+    """Input is missing or malformed"""
+
+
+class DuplicateError(LibraryError):
+    """A unique field (ISBN or email) is already taken"""
+
+
+class NotFoundError(LibraryError):
+    """The referenced book, member or loan does not exist"""
+
+
+class InUseError(LibraryError):
+    """The record cannot be deleted while it has active loans"""
+
+
+class BorrowLimitError(LibraryError):
+    """The member already has the maximum number of books"""
+
+
+class UnavailableError(LibraryError):
+    """No copies of the book are available to issue"""
+
+
+class HoldError(LibraryError):
+    """A hold cannot be placed or is not open"""
+
+
+class LibraryService:
+    """Headless library operations on top of a SQLite connection.
+
+    Every write runs in its own BEGIN IMMEDIATE transaction, or in a savepoint
+    when a group commit (lms_worker.GroupCommitWriter) already has one open.
+    Failures are reported by raising
+    a LibraryError subclass whose message is suitable for showing to staff.
+    Choice lists and id/ISBN/email lookups are served from a CatalogCache
+    that reloads itself when the database changes. Reports can be read from
+    the latest snapshot (lms_backup) instead of the live database.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cache = CatalogCache(conn)
+        self.snapshot = None
+
+    @classmethod
+    def open(cls, path=None, durability=DEFAULT_DURABILITY):
+        """Open (and migrate) a database file and wrap it in a service"""
+        return cls(connect_database(path or DB_PATH, durability))
+
+    def close(self):
+        if self.snapshot is not None:
+            self.snapshot[1].close()
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Make the enclosed statements one write: commit on success, roll back on error.
+
+        The write lock is taken up front with BEGIN IMMEDIATE, so a write never
+        fails halfway through on a busy upgrade. Inside an open transaction the
+        write is a savepoint instead and only its own changes are undone.
+        """
+        if self.conn.in_transaction:
+            self.conn.execute("SAVEPOINT write")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK TO write")
+                raise
+            finally:
+                self.conn.execute("RELEASE write")
+        else:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                yield
+
+    def interrupt(self):
+        """Abort the query running on this service's connection, from any thread"""
+        self.conn.interrupt()
+
+    def stats(self):
+        """Return row counts and highest ids of the main tables"""
+        books, max_book = self.conn.execute("SELECT COUNT(*), MAX(id) FROM books").fetchone()
+        members, max_member = self.conn.execute("SELECT COUNT(*), MAX(id) FROM members").fetchone()
+        return {
+            'books': books,
+            'max_book_id': max_book,
+            'members': members,
+            'max_member_id': max_member,
+        }
+
+    # Books
+
+    def add_book(self, title, author, isbn, quantity):
+        """Add a new book with quantity copies and return its id"""
+        title, author, isbn = title.strip(), author.strip(), isbn.strip()
+        if not title or not author or not isbn or quantity is None or not str(quantity).strip():
+            raise ValidationError("Please fill all fields")
+
+        try:
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity < 1:
+            raise ValidationError("Quantity must be a positive integer")
+
+        try:
+            with self.transaction():
+                cursor = self.conn.execute(
+                    "INSERT INTO books (title, author, isbn, quantity, available) VALUES (?, ?, ?, 0, 0)",
+                    (title, author, isbn)
+                )
+                add_copies(self.conn, [(isbn, quantity)])
+        except sqlite3.IntegrityError:
+            raise DuplicateError("A book with this ISBN already exists") from None
+        return cursor.lastrowid
+
+    def import_catalog(self, path, **options):
+        """Bulk import a CSV/JSONL/MARC-lite catalog; see lms_import.import_catalog"""
+        return import_catalog(self.conn, path, **options)
+
+    def book_has_active_loans(self, book_id):
+        return bool(self.conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM items WHERE book_id = ? AND status = 'on_loan')", (book_id,)
+        ).fetchone()[0])
+
+    def delete_book(self, book_id):
+        """Delete a book and its copies if none is issued, cancelling any holds queued for it"""
+        with self.transaction():
+            cursor = self.conn.execute("DELETE FROM books WHERE id = ? AND available = quantity", (book_id,))
+            if cursor.rowcount:
+                self.conn.execute("DELETE FROM items WHERE book_id = ?", (book_id,))
+                self.conn.execute(
+                    "UPDATE holds SET status = 'cancelled' WHERE book_id = ? AND status = 'waiting'", (book_id,)
+                )
+        if cursor.rowcount == 0 and self.get_book(book_id) is not None:
+            if self.book_has_active_loans(book_id):
+                raise InUseError("Cannot delete book that is currently issued")
+            raise InUseError("Cannot delete book while a copy is set aside for a hold awaiting pickup")
+
+    def get_book(self, book_id):
+        return self.conn.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+
+    def books_page(self, after_id, limit):
+        """Return up to limit books with id greater than after_id"""
+        return self.conn.execute(
+            "SELECT * FROM books WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+
+    def available_books(self, limit=-1):
+        """Return (id, title) for books with a copy on the shelf"""
+        return [(book.id, book.title) for book in self.cache.available_books(limit)]
+
+    def find_book_by_isbn(self, isbn):
+        """Return (id, title) of the book with this ISBN, or None"""
+        book = self.cache.book_by_isbn(isbn.strip())
+        return (book.id, book.title) if book else None
+
+    def search_books(self, text, limit=SEARCH_LIMIT, available_only=False, scored=False):
+        """Return the best matching books for free text, ranked by bm25.
+
+        Every word is matched as a prefix of a title, author or ISBN token;
+        title matches weigh most. With scored set each row starts with its
+        bm25 score (lower is better), so results from several branches can
+        be merged.
+        """
+        match = fts_query(text)
+        if not match:
+            return []
+        available = "AND b.available > 0" if available_only else ""
+        score = "bm25(books_fts, 10.0, 5.0, 1.0), " if scored else ""
+        return self.conn.execute(f'''
+            SELECT {score}b.* FROM books_fts
+            JOIN books b ON b.id = books_fts.rowid
+            WHERE books_fts MATCH ? {available}
+            ORDER BY bm25(books_fts, 10.0, 5.0, 1.0)
+            LIMIT ?
+        ''', (match, limit)).fetchall()
+
+    # Members
+
+    def add_member(self, name, email, phone=''):
+        """Register a new member and return their id"""
+        name, email, phone = name.strip(), email.strip(), (phone or '').strip()
+        if not name or not email:
+            raise ValidationError("Name and email are required")
+
+        membership_date = datetime.now().strftime("%Y-%m-%d")
+
+        try:
+            with self.transaction():
+                cursor = self.conn.execute(
+                    "INSERT INTO members (name, email, phone, membership_date) VALUES (?, ?, ?, ?)",
+                    (name, email, phone, membership_date)
+                )
+        except sqlite3.IntegrityError:
+            raise DuplicateError("A member with this email already exists") from None
+        return cursor.lastrowid
+
+    def member_has_active_loans(self, member_id):
+        return self.active_loan_count(member_id) > 0
+
+    def active_loan_count(self, member_id):
+        row = self.conn.execute("SELECT active_loans FROM members WHERE id = ?", (member_id,)).fetchone()
+        return row[0] if row else 0
+
+    def delete_member(self, member_id):
+        """Delete a member who has no books issued, cancelling their holds"""
+        with self.transaction():
+            cursor = self.conn.execute("DELETE FROM members WHERE id = ? AND active_loans = 0", (member_id,))
+            if cursor.rowcount:
+                for hold_id, in self.conn.execute(
+                    "SELECT id FROM holds WHERE member_id = ? AND status IN ('waiting', 'ready')", (member_id,)
+                ).fetchall():
+                    self.cancel_hold(hold_id)
+        if cursor.rowcount == 0 and self.get_member(member_id) is not None:
+            raise InUseError("Cannot delete member who has issued books")
+
+    def get_member(self, member_id):
+        return self.conn.execute("SELECT * FROM members WHERE id = ?", (member_id,)).fetchone()
+
+    def members_page(self, after_id, limit):
+        """Return up to limit members with id greater than after_id"""
+        return self.conn.execute(
+            "SELECT * FROM members WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+
+    def member_choices(self):
+        """Return (id, name) for every member"""
+        return [(member.id, member.name) for member in self.cache.all_members()]
+
+    def find_member_by_email(self, email):
+        """Return (id, name) of the member with this email, or None"""
+        member = self.cache.member_by_email(email.strip())
+        return (member.id, member.name) if member else None
+
+    # Circulation
+
+    def claim_loan_slot(self, member_id):
+        """Count one more loan against a member, or raise if they have none left"""
+        cursor = self.conn.execute(
+            "UPDATE members SET active_loans = active_loans + 1 WHERE id = ? AND active_loans < ?",
+            (member_id, MAX_LOANS)
+        )
+        if cursor.rowcount == 0:
+            if self.get_member(member_id) is None:
+                raise NotFoundError(f"Member {member_id} does not exist")
+            raise BorrowLimitError(f"Member has reached the maximum borrowing limit ({MAX_LOANS} books)")
+
+    def lend_item(self, member_id, book_id, item_id):
+        """Record the loan of one copy and return (issue_id, due_date); the caller has claimed the copy"""
+        issue_date = datetime.now().strftime("%Y-%m-%d")
+        due_date = (datetime.now() + timedelta(days=LOAN_DAYS)).strftime("%Y-%m-%d")
+        self.conn.execute("UPDATE items SET status = 'on_loan' WHERE id = ?", (item_id,))
+        cursor = self.conn.execute(
+            "INSERT INTO issued_books (book_id, member_id, item_id, issue_date, due_date) VALUES (?, ?, ?, ?, ?)",
+            (book_id, member_id, item_id, issue_date, due_date)
+        )
+        return cursor.lastrowid, due_date
+
+    def issue_book(self, member_id, book_id):
+        """Issue a copy of a book to a member and return (issue_id, due_date).
+
+        The borrowing limit is enforced by a conditional UPDATE of the
+        member's counter, and the copy is found through idx_items_book_status,
+        inside one transaction, so the cost does not depend on loan history
+        and two desks cannot lend the same copy. The copy set aside for the
+        member's ready hold is issued before one from the shelf.
+        """
+        with self.transaction():
+            self.claim_loan_slot(member_id)
+            hold = self.conn.execute(
+                "UPDATE holds SET status = 'fulfilled' WHERE member_id = ? AND book_id = ? AND status = 'ready' "
+                "RETURNING item_id",
+                (member_id, book_id)
+            ).fetchone()
+            copies = [hold] if hold else shelf_items(self.conn, book_id, 1)
+            if not copies:
+                if self.get_book(book_id) is None:
+                    raise NotFoundError(f"Book {book_id} does not exist")
+                raise UnavailableError("No copies of this book are available; place a hold to queue for it")
+            return self.lend_item(member_id, book_id, copies[0][0])
+
+    def issue_copy(self, member_id, barcode):
+        """Issue the copy with this barcode to a member and return (issue_id, due_date).
+
+        The copy is looked up through the unique barcode index. A copy set
+        aside for a hold can only go to that hold's member; if the member
+        has a ready hold on the title but brings a different copy, the hold
+        is fulfilled with it and the set-aside copy passes to the next hold.
+        """
+        barcode = barcode.strip()
+        with self.transaction():
+            item = find_item(self.conn, barcode)
+            if item is None:
+                raise NotFoundError(f"No copy has barcode {barcode}")
+            item_id, book_id, status = item
+            if status == 'on_loan':
+                raise UnavailableError(f"Copy {barcode} is already on loan")
+            self.claim_loan_slot(member_id)
+            hold = self.conn.execute(
+                "UPDATE holds SET status = 'fulfilled' WHERE member_id = ? AND book_id = ? AND status = 'ready' "
+                "RETURNING item_id",
+                (member_id, book_id)
+            ).fetchone()
+            if status == 'on_hold' and (hold is None or hold[0] != item_id):
+                raise UnavailableError(f"Copy {barcode} is set aside for another member's hold")
+            if hold is not None and hold[0] != item_id:
+                release_items(self.conn, book_id, [hold[0]], datetime.now().strftime("%Y-%m-%d"))
+            return self.lend_item(member_id, book_id, item_id)
+
+    def return_book(self, issue_id):
+        """Mark a loan as returned and return the book id.
+
+        The copy goes to the first hold waiting for the book, if any, in the
+        same transaction; otherwise it goes back on the shelf.
+        """
+        return_date = datetime.now().strftime("%Y-%m-%d")
+
+        with self.transaction():
+            row = self.conn.execute(
+                "UPDATE issued_books SET return_date = ? WHERE id = ? AND return_date IS NULL "
+                "RETURNING book_id, member_id, item_id",
+                (return_date, issue_id)
+            ).fetchone()
+            if row is None:
+                raise NotFoundError(f"Loan {issue_id} is not currently issued")
+            book_id, member_id, item_id = row
+
+            release_items(self.conn, book_id, [item_id], return_date)
+            self.conn.execute("UPDATE members SET active_loans = active_loans - 1 WHERE id = ?", (member_id,))
+        return book_id
+
+    def return_copy(self, barcode):
+        """Return the copy with this barcode, found through its active loan; return the book id"""
+        barcode = barcode.strip()
+        with self.transaction():
+            row = self.conn.execute('''
+                SELECT ib.id FROM items i
+                JOIN issued_books ib ON ib.item_id = i.id AND ib.return_date IS NULL
+                WHERE i.barcode = ?
+            ''', (barcode,)).fetchone()
+            if row is None:
+                if find_item(self.conn, barcode) is None:
+                    raise NotFoundError(f"No copy has barcode {barcode}")
+                raise NotFoundError(f"Copy {barcode} is not on loan")
+            return self.return_book(row[0])
+
+    def issue_books(self, member_id, codes):
+        """Issue a batch of scanned copies to one member in a single transaction.
+
+        A code is a copy's barcode, which issues that copy, or an ISBN, which
+        issues the copy set aside for the member's hold on the title or else
+        one from the shelf. Every code is validated against the member's
+        borrowing limit and the copies' status before anything is written;
+        codes that fail are skipped and the rest are issued with executemany.
+        Returns one (code, ok, message) tuple per code, in scan order.
+        """
+        codes = [code.strip() for code in codes if code.strip()]
+        issue_date = datetime.now().strftime("%Y-%m-%d")
+        due_date = (datetime.now() + timedelta(days=LOAN_DAYS)).strftime("%Y-%m-%d")
+        results = [None] * len(codes)
+        accepted = []
+
+        with self.transaction():
+            row = self.conn.execute("SELECT active_loans FROM members WHERE id = ?", (member_id,)).fetchone()
+            if row is None:
+                raise NotFoundError(f"Member {member_id} does not exist")
+            slots = MAX_LOANS - row[0]
+
+            scanned = {barcode: (item_id, book_id, status, title) for item_id, barcode, book_id, status, title in self.conn.execute('''
+                SELECT i.id, i.barcode, i.book_id, i.status, b.title FROM items i JOIN books b ON b.id = i.book_id
+                WHERE i.barcode IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(codes),))}
+            books = {isbn: (book_id, title) for book_id, isbn, title in self.conn.execute(
+                "SELECT id, isbn, title FROM books WHERE isbn IN (SELECT value FROM json_each(?))",
+                (json.dumps(codes),)
+            )}
+            held = {book_id: item_id for book_id, item_id in self.conn.execute(
+                "SELECT book_id, item_id FROM holds WHERE member_id = ? AND status = 'ready'", (member_id,)
+            )}
+            # Copies scanned by barcode are never handed out for an ISBN in the same batch
+            reserved = {item[0] for item in scanned.values()}
+            lent = set()
+            shelves = {}
+            for index, code in enumerate(codes):
+                if code in scanned:
+                    item_id, book_id, status, title = scanned[code]
+                    if slots <= 0:
+                        results[index] = (code, False, f"Member has reached the maximum borrowing limit ({MAX_LOANS} books)")
+                    elif item_id in lent:
+                        results[index] = (code, False, f"Copy {code} was already scanned")
+                    elif status == 'on_loan':
+                        results[index] = (code, False, f"Copy {code} is already on loan")
+                    elif status == 'on_hold' and held.get(book_id) != item_id:
+                        results[index] = (code, False, f"Copy {code} is set aside for another member's hold")
+                    else:
+                        lent.add(item_id)
+                        slots -= 1
+                        accepted.append((index, item_id, book_id, title))
+                elif code in books:
+                    book_id, title = books[code]
+                    if slots <= 0:
+                        results[index] = (code, False, f"Member has reached the maximum borrowing limit ({MAX_LOANS} books)")
+                        continue
+                    item_id = held.get(book_id)
+                    if item_id is None or item_id in lent or item_id in reserved:
+                        if book_id not in shelves:
+                            shelves[book_id] = iter(shelf_items(self.conn, book_id))
+                        item_id = next((item_id for item_id, barcode in shelves[book_id]
+                                        if item_id not in lent and item_id not in reserved), None)
+                    if item_id is None:
+                        results[index] = (code, False, "No copies of this book are available")
+                        continue
+                    lent.add(item_id)
+                    slots -= 1
+                    accepted.append((index, item_id, book_id, title))
+                else:
+                    results[index] = (code, False, f"No copy or book with code {code}")
+
+            if accepted:
+                self.conn.executemany(
+                    "INSERT INTO issued_books (book_id, member_id, item_id, issue_date, due_date) VALUES (?, ?, ?, ?, ?)",
+                    [(book_id, member_id, item_id, issue_date, due_date) for index, item_id, book_id, title in accepted]
+                )
+                last_id = self.conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                self.conn.executemany("UPDATE items SET status = 'on_loan' WHERE id = ?", [(item_id,) for item_id in lent])
+                # A member's hold is fulfilled by any copy of its title; a set-aside copy not taken moves on
+                for book_id in {book_id for index, item_id, book_id, title in accepted if book_id in held}:
+                    self.conn.execute(
+                        "UPDATE holds SET status = 'fulfilled' WHERE member_id = ? AND book_id = ? AND status = 'ready'",
+                        (member_id, book_id)
+                    )
+                    if held[book_id] not in lent:
+                        release_items(self.conn, book_id, [held[book_id]], issue_date)
+                self.conn.execute(
+                    "UPDATE members SET active_loans = active_loans + ? WHERE id = ?", (len(accepted), member_id)
+                )
+
+        # AUTOINCREMENT ids of one executemany under the write lock are consecutive
+        for offset, (index, item_id, book_id, title) in enumerate(accepted):
+            issue_id = last_id - len(accepted) + 1 + offset
+            results[index] = (codes[index], True, f"Issued loan {issue_id}: {title}, due {due_date}")
+        return results
+
+    def return_books(self, codes):
+        """Return a batch of scanned items in a single transaction.
+
+        A code is a copy's barcode, an ISBN, which returns the loan of that
+        book due soonest, or a loan id. Codes that match no active loan are
+        reported and skipped. Returned copies fill waiting holds before going
+        back on the shelf. Returns one (code, ok, message) tuple per code.
+        """
+        codes = [code.strip() for code in codes if code.strip()]
+        return_date = datetime.now().strftime("%Y-%m-%d")
+        results = []
+        returned = []
+        held = Counter()
+
+        with self.transaction():
+            by_barcode, by_isbn, by_id = {}, {}, {}
+            for barcode, *loan in self.conn.execute('''
+                SELECT i.barcode, ib.id, ib.book_id, ib.member_id, ib.item_id, b.title
+                FROM items i
+                JOIN issued_books ib ON ib.item_id = i.id AND ib.return_date IS NULL
+                JOIN books b ON i.book_id = b.id
+                WHERE i.barcode IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(codes),)):
+                by_barcode[barcode] = tuple(loan)
+            for isbn, *loan in self.conn.execute('''
+                SELECT b.isbn, ib.id, ib.book_id, ib.member_id, ib.item_id, b.title
+                FROM books b
+                JOIN issued_books ib ON ib.book_id = b.id AND ib.return_date IS NULL
+                WHERE b.isbn IN (SELECT value FROM json_each(?))
+                ORDER BY ib.due_date, ib.id
+            ''', (json.dumps(codes),)):
+                by_isbn.setdefault(isbn, []).append(tuple(loan))
+            loan_ids = [int(code) for code in codes if code.isdigit()]
+            for loan in self.conn.execute('''
+                SELECT ib.id, ib.book_id, ib.member_id, ib.item_id, b.title
+                FROM issued_books ib
+                JOIN books b ON ib.book_id = b.id
+                WHERE ib.id IN (SELECT value FROM json_each(?)) AND ib.return_date IS NULL
+            ''', (json.dumps(loan_ids),)):
+                by_id[loan[0]] = loan
+
+            taken = set()
+            for code in codes:
+                if code in by_barcode and by_barcode[code][0] not in taken:
+                    loan = by_barcode[code]
+                elif code in by_isbn:
+                    loan = next((loan for loan in by_isbn[code] if loan[0] not in taken), None)
+                    if loan is None:
+                        results.append((code, False, "No more copies of this book are on loan"))
+                        continue
+                elif code.isdigit() and int(code) in by_id and int(code) not in taken:
+                    loan = by_id[int(code)]
+                else:
+                    results.append((code, False, f"Loan {code} is not currently issued"))
+                    continue
+                taken.add(loan[0])
+                returned.append((len(results), loan))
+                results.append((code, True, f"Returned loan {loan[0]}: {loan[4]}"))
+
+            if returned:
+                self.conn.executemany(
+                    "UPDATE issued_books SET return_date = ? WHERE id = ?",
+                    [(return_date, loan[0]) for index, loan in returned]
+                )
+                copies = {}
+                for index, loan in returned:
+                    copies.setdefault(loan[1], []).append(loan[3])
+                for book_id, item_ids in copies.items():
+                    held[book_id] = len(item_ids) - release_items(self.conn, book_id, item_ids, return_date)
+                self.conn.executemany(
+                    "UPDATE members SET active_loans = active_loans - ? WHERE id = ?",
+                    [(count, member_id) for member_id, count in Counter(loan[2] for index, loan in returned).items()]
+                )
+
+        for index, loan in returned:
+            if held[loan[1]] > 0:
+                held[loan[1]] -= 1
+                code, ok, message = results[index]
+                results[index] = (code, ok, f"{message} (set aside for a hold)")
+        return results
+
+    def get_issued(self, issue_id):
+        """Return the active loan row, or None once it is returned"""
+        return self.conn.execute('''
+            SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date
+            FROM issued_books ib
+            JOIN books b ON ib.book_id = b.id
+            JOIN members m ON ib.member_id = m.id
+            WHERE ib.id = ? AND ib.return_date IS NULL
+        ''', (issue_id,)).fetchone()
+
+    def issued_page(self, after_id, limit):
+        """Return up to limit active loans with id greater than after_id"""
+        return self.conn.execute('''
+            SELECT ib.id, b.title, m.name, ib.issue_date, ib.due_date
+            FROM issued_books ib
+            JOIN books b ON ib.book_id = b.id
+            JOIN members m ON ib.member_id = m.id
+            WHERE ib.return_date IS NULL AND ib.id > ?
+            ORDER BY ib.id
+            LIMIT ?
+        ''', (after_id, limit)).fetchall()
+
+    def active_loans(self):
+        """Return (id, title, member name) for every active loan"""
+        return [(loan.id, book.title, member.name)
+                for loan, book, member in self.cache.active_loans() if book and member]
+
+    # Copies
+
+    def book_items(self, book_id):
+        """Return (id, barcode, status, location) for every copy of a book"""
+        return self.conn.execute(
+            "SELECT id, barcode, status, location FROM items WHERE book_id = ? ORDER BY id", (book_id,)
+        ).fetchall()
+
+    def move_item(self, barcode, location):
+        """Record where the copy with this barcode is shelved"""
+        barcode = barcode.strip()
+        with self.transaction():
+            cursor = self.conn.execute("UPDATE items SET location = ? WHERE barcode = ?", (location.strip(), barcode))
+        if cursor.rowcount == 0:
+            raise NotFoundError(f"No copy has barcode {barcode}")
+
+    def items_at(self, location):
+        """Return (barcode, book_id, title, status) for the copies shelved at a location, by title"""
+        return self.conn.execute('''
+            SELECT i.barcode, i.book_id, b.title, i.status FROM items i
+            JOIN books b ON b.id = i.book_id
+            WHERE i.location = ?
+            ORDER BY i.book_id, i.id
+        ''', (location.strip(),)).fetchall()
+
+    # Holds
+
+    def place_hold(self, member_id, book_id):
+        """Queue a member for a book with no copy on the shelf; return (hold_id, place in queue).
+
+        The hold goes after the highest waiting position, read from the end
+        of idx_holds_queue, so placing one costs the same however long the
+        queue.
+        """
+        placed_date = datetime.now().strftime("%Y-%m-%d")
+
+        with self.transaction():
+            if self.get_member(member_id) is None:
+                raise NotFoundError(f"Member {member_id} does not exist")
+            book = self.conn.execute("SELECT available FROM books WHERE id = ?", (book_id,)).fetchone()
+            if book is None:
+                raise NotFoundError(f"Book {book_id} does not exist")
+            if book[0] > 0:
+                raise HoldError("Copies of this book are on the shelf; issue one instead")
+            if self.conn.execute(
+                "SELECT 1 FROM holds WHERE member_id = ? AND book_id = ? AND status IN ('waiting', 'ready')",
+                (member_id, book_id)
+            ).fetchone():
+                raise HoldError("Member already has a hold on this book")
+
+            position = self.conn.execute(
+                "SELECT COALESCE(MAX(position), 0) + 1 FROM holds WHERE book_id = ? AND status = 'waiting'", (book_id,)
+            ).fetchone()[0]
+            cursor = self.conn.execute(
+                "INSERT INTO holds (book_id, member_id, position, placed_date) VALUES (?, ?, ?, ?)",
+                (book_id, member_id, position, placed_date)
+            )
+            place = self.conn.execute(
+                "SELECT COUNT(*) FROM holds WHERE book_id = ? AND status = 'waiting'", (book_id,)
+            ).fetchone()[0]
+        return cursor.lastrowid, place
+
+    def cancel_hold(self, hold_id):
+        """Cancel a waiting or ready hold; a copy set aside for it goes to the next hold"""
+        with self.transaction():
+            row = self.conn.execute(
+                "SELECT book_id, status, item_id FROM holds WHERE id = ? AND status IN ('waiting', 'ready')", (hold_id,)
+            ).fetchone()
+            if row is None:
+                raise HoldError(f"Hold {hold_id} is not open")
+            book_id, status, item_id = row
+            self.conn.execute("UPDATE holds SET status = 'cancelled' WHERE id = ?", (hold_id,))
+            if status == 'ready':
+                release_items(self.conn, book_id, [item_id], datetime.now().strftime("%Y-%m-%d"))
+
+    def open_holds(self, member_id=None):
+        """Return a member's open holds, or with no member the whole pickup shelf.
+
+        Rows are (id, book_id, title, member_id, member name, status, place,
+        expires_date); place is the position in the book's queue counting
+        from 1 for a waiting hold, and None for a ready one.
+        """
+        if member_id is None:
+            where, params = "h.status = 'ready'", ()
+        else:
+            where, params = "h.member_id = ? AND h.status IN ('waiting', 'ready')", (member_id,)
+        return self.conn.execute(f'''
+            SELECT h.id, h.book_id, b.title, h.member_id, m.name, h.status,
+                   CASE h.status WHEN 'waiting' THEN (
+                       SELECT COUNT(*) FROM holds q
+                       WHERE q.book_id = h.book_id AND q.status = 'waiting' AND q.position <= h.position
+                   ) END,
+                   h.expires_date
+            FROM holds h
+            JOIN books b ON h.book_id = b.id
+            JOIN members m ON h.member_id = m.id
+            WHERE {where}
+            ORDER BY h.status, h.expires_date, h.id
+        ''', params).fetchall()
+
+    # Maintenance
+
+    def archive_loans(self, **options):
+        """Move old returned loans to the archive table; see lms_archive.archive_loans"""
+        return archive_loans(self.conn, **options)
+
+    def reclaim_space(self, full=False):
+        """Vacuum the database file; see lms_archive.reclaim_space"""
+        return reclaim_space(self.conn, full)
+
+    def update_fines(self, today=None):
+        """Run the incremental overdue/fines job; see lms_fines.update_fines"""
+        return update_fines(self.conn, today)
+
+    def fines_current(self, today=None):
+        """Whether the fines job has already run today, without writing anything"""
+        return last_run(self.conn) == (today or datetime.now().strftime("%Y-%m-%d"))
+
+    def refresh_fines(self, today=None):
+        """Run the fines job unless it already ran today; call it on the writing connection"""
+        return refresh_fines(self.conn, today)
+
+    def verify_rollups(self):
+        """Check the circulation rollups against the loan history; see lms_analytics.verify_rollups"""
+        return verify_rollups(self.conn)
+
+    def rebuild_rollups(self):
+        """Recompute the circulation rollups from the loan history; see lms_analytics.rebuild_rollups"""
+        return rebuild_rollups(self.conn)
+
+    def backup(self, path, **options):
+        """Copy the live database to a file; see lms_backup.backup_database"""
+        return backup_database(self.conn, path, **options)
+
+    def take_snapshot(self, snapshot_dir=None, keep=SNAPSHOT_KEEP):
+        """Save a read-only snapshot for reports; see lms_backup.take_snapshot"""
+        return take_snapshot(self.conn, snapshot_dir, keep)
+
+    def snapshot_connection(self):
+        """Connection to the newest snapshot, reopened when a newer one appears"""
+        path = latest_snapshot(database_file(self.conn))
+        if path is None:
+            raise NotFoundError("No snapshot has been taken yet")
+        if self.snapshot is None or self.snapshot[0] != path:
+            if self.snapshot is not None:
+                self.snapshot[1].close()
+            self.snapshot = (path, open_snapshot(path))
+        return self.snapshot[1]
+
+    def expire_holds(self, today=None):
+        """Run the holds pickup expiry sweep; see lms_holds.expire_holds"""
+        return expire_holds(self.conn, today)
+
+    # Reports
+
+    def report_conn(self, snapshot):
+        # Reports only read: the fines reports rely on the caller having run
+        # refresh_fines on its writer first
+        return self.snapshot_connection() if snapshot else self.conn
+
+    def report_rows(self, name, snapshot=False, **filters):
+        """Stream the rows of a named report; see lms_reports.REPORTS.
+
+        With snapshot set the report reads the latest snapshot, as of when it
+        was taken, and puts no load on the live database.
+        """
+        return iter_rows(self.report_conn(snapshot), name, filters)
+
+    def export_report(self, name, path, fmt='csv', snapshot=False, **filters):
+        """Write a named report to a CSV or JSONL file and return the row count"""
+        return export_report(self.report_conn(snapshot), name, path, fmt, filters)
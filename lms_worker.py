@@ -0,0 +1,291 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from lms_profile import get_profiler, measure
+
+POLL_MS = 30
+GROUP_COMMIT_MAX = 64
+
+
+class Job:
+    """A unit of work queued on a DatabaseWorker"""
+
+    def __init__(self, func, callback, errback, key, name):
+        self.func = func
+        self.callback = callback
+        self.errback = errback
+        self.key = key
+        self.name = name
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+
+
+class DatabaseWorker:
+    """Runs database jobs on a background thread with its own service.
+
+    ``open_service`` is called on the worker thread to create the service
+    (and so the connection) the jobs use. Jobs are callables taking that
+    service and run one at a time in submission order. Their results are
+    handed back on the Tk thread by polling with root.after, so callbacks may
+    touch widgets. Submitting a job with the same key as an earlier one
+    cancels the earlier job; if it is already running, its query is
+    interrupted and the result dropped.
+    """
+
+    def __init__(self, root, open_service, poll_ms=POLL_MS, on_busy=None):
+        self.root = root
+        self.open_service = open_service
+        self.poll_ms = poll_ms
+        self.on_busy = on_busy
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.current = None
+        self.service = None
+        self.outstanding = 0
+        self.busy = False
+        self.startup_error = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='db-worker', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.startup_error is not None:
+            raise self.startup_error
+        self.poll_job = self.root.after(self.poll_ms, self.poll)
+
+    def submit(self, func, callback=None, errback=None, key=None, name=None):
+        """Queue func(service) and return its Job.
+
+        ``name`` labels the job in profiles; it defaults to the key when that
+        is a string, else to the function's qualified name.
+        """
+        if name is None:
+            name = key if isinstance(key, str) else func.__qualname__.replace('.<locals>', '')
+        job = Job(func, callback, errback, key, name)
+        with self.lock:
+            if key is not None:
+                previous = self.latest.get(key)
+                if previous is not None:
+                    self._cancel(previous)
+                self.latest[key] = job
+        self.outstanding += 1
+        if not self.busy:
+            self.busy = True
+            if self.on_busy:
+                self.on_busy(True)
+        self.requests.put(job)
+        return job
+
+    def cancel(self, job):
+        with self.lock:
+            self._cancel(job)
+
+    def cancel_key(self, key):
+        """Cancel the latest job submitted with key, if any"""
+        with self.lock:
+            job = self.latest.pop(key, None)
+            if job is not None:
+                self._cancel(job)
+
+    def _cancel(self, job):
+        job.cancelled = True
+        if job is self.current:
+            self.service.interrupt()
+
+    def run(self):
+        """Worker thread: execute jobs against a private service"""
+        try:
+            service = self.open_service()
+        except Exception as e:
+            self.startup_error = e
+            self.ready.set()
+            return
+        self.service = service
+        self.ready.set()
+
+        while True:
+            job = self.requests.get()
+            if job is None:
+                break
+
+            with self.lock:
+                if job.cancelled:
+                    self.results.put((job, None, None))
+                    continue
+                self.current = job
+
+            result = error = None
+            try:
+                with measure('job', job.name):
+                    result = job.func(service)
+            except Exception as e:
+                error = e
+
+            with self.lock:
+                self.current = None
+                if self.latest.get(job.key) is job:
+                    del self.latest[job.key]
+            self.results.put((job, result, error))
+
+        service.close()
+
+    def poll(self):
+        """Deliver finished jobs to their callbacks on the Tk thread"""
+        while True:
+            try:
+                job, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            self.outstanding -= 1
+            if job.cancelled:
+                continue
+            profiler = get_profiler()
+            if profiler is not None:
+                profiler.record('job_latency', job.name, (time.perf_counter() - job.submitted) * 1000)
+            if error is not None:
+                if job.errback:
+                    job.errback(error)
+            elif job.callback:
+                job.callback(result)
+
+        if self.busy and self.outstanding == 0:
+            self.busy = False
+            if self.on_busy:
+                self.on_busy(False)
+        self.poll_job = self.root.after(self.poll_ms, self.poll)
+
+    def close(self):
+        """Cancel pending work and stop the worker thread"""
+        self.root.after_cancel(self.poll_job)
+        with self.lock:
+            for job in self.latest.values():
+                self._cancel(job)
+        self.requests.put(None)
+        self.thread.join(timeout=5)
+
+
+class GroupCommitWriter:
+    """Runs writes on one thread and connection, committing concurrent ones together.
+
+    ``submit(func)`` queues func(service) and returns a concurrent.futures
+    Future. With group commit on (``window_ms`` not None), writes arriving
+    within window_ms of the first one, up to ``max_batch``, run in a single
+    BEGIN IMMEDIATE transaction. The wait is capped at the time the last
+    commit took: waiting longer than an fsync costs more than it saves, so on
+    fast storage batches form only from writes that queued up meanwhile. Each runs in its own savepoint (see
+    LibraryService.transaction), so a failing write is undone alone and the
+    batch shares one commit and so one fsync. Futures are resolved only after
+    that commit, so a write is never acknowledged before it is durable. Writes
+    submitted with group=False, such as jobs that manage their own
+    transactions, always run alone.
+    """
+
+    def __init__(self, open_service, window_ms=None, max_batch=GROUP_COMMIT_MAX):
+        self.open_service = open_service
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.writes = 0
+        self.commit_s = (window_ms or 0) / 1000
+        self.startup_error = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.startup_error is not None:
+            raise self.startup_error
+
+    def submit(self, func, group=True):
+        future = Future()
+        self.requests.put((func, group, future))
+        return future
+
+    def run(self):
+        try:
+            service = self.open_service()
+        except Exception as e:
+            self.startup_error = e
+            self.ready.set()
+            return
+        self.ready.set()
+
+        held = None
+        while True:
+            request = held or self.requests.get()
+            held = None
+            if request is None:
+                break
+
+            func, group, future = request
+            if not group or self.window_ms is None:
+                self.run_alone(service, func, future)
+                continue
+
+            batch = [request]
+            deadline = time.perf_counter() + min(self.window_ms / 1000, self.commit_s)
+            while len(batch) < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None or not request[1]:
+                    held = request
+                    break
+                batch.append(request)
+            self.run_batch(service, batch)
+
+        service.close()
+
+    def run_alone(self, service, func, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(service)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        self.batches += 1
+        self.writes += 1
+
+    def run_batch(self, service, batch):
+        """Run a batch of writes in one transaction and resolve their futures after the commit"""
+        conn = service.conn
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, group, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    outcomes.append((future, func(service), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+            started = time.perf_counter()
+            conn.commit()
+            self.commit_s = time.perf_counter() - started
+        except Exception as e:
+            # BEGIN or COMMIT failed: nothing in the batch was written
+            if conn.in_transaction:
+                conn.rollback()
+            for func, group, future in batch:
+                if future.running():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        self.batches += 1
+        self.writes += len(outcomes)
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join(timeout=5)